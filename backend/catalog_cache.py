@@ -0,0 +1,158 @@
+"""In-process cache for rendered shop catalog responses.
+
+The catalog changes only when an admin edits the shop, so rendered listing
+responses are kept in memory and served until a write invalidates them.
+Every shop write calls ``bump()``, which clears this worker's cache and
+increments a shared version document. Other workers notice the change either
+through a change stream on ``shop_items`` (replica sets only) or by polling
+that version document, and clear their own caches.
+
+The same invalidation covers ``items()``, the shop item documents that
+inventory and power rows reference, so hydrating a page of rows usually
+needs no database read at all.
+"""
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure, PyMongoError
+
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "shop_catalog"
+
+
+class CachedResponse:
+    def __init__(self, body: bytes, headers: dict):
+        self.body = body
+        self.headers = headers
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+class CatalogCache:
+    def __init__(self, db, invalidation: str = "auto", poll_interval: float = 2.0, max_entries: int = 64,
+                 max_items: int = 4096):
+        """
+        `invalidation` selects how writes made by other workers are picked up:
+        "change_stream", "poll", "auto" (change stream, falling back to
+        polling) or "none" for a single worker.
+        """
+        self.db = db
+        self.invalidation = invalidation
+        self.poll_interval = poll_interval
+        self.max_entries = max_entries
+        self.version = 0  # Last seen value of the shared version document
+        self.generation = 0  # Bumped on every local invalidation
+        self._entries: "OrderedDict[tuple, CachedResponse]" = OrderedDict()
+        self.max_items = max_items
+        # Shop item documents by id; None records an id that isn't in the catalog
+        self._items: Dict[str, Optional[dict]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, key: tuple) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: tuple, generation: int, body: bytes, headers: dict) -> CachedResponse:
+        """Cache a rendered response, unless the catalog changed while it was being built"""
+        entry = CachedResponse(body, headers)
+        if generation == self.generation:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self):
+        self.generation += 1
+        self._entries.clear()
+        self._items.clear()
+
+    async def items(self, item_ids: Iterable[str]) -> Dict[str, Optional[dict]]:
+        """Shop items by id (None for ids not in the catalog), reading the uncached ones with one $in"""
+        item_ids = set(item_ids)
+        found = {item_id: self._items[item_id] for item_id in item_ids if item_id in self._items}
+        missing = [item_id for item_id in item_ids if item_id not in found]
+        if not missing:
+            return found
+
+        generation = self.generation
+        docs = await self.db.shop_items.find({"id": {"$in": missing}}, {"_id": 0, "images": 0}).to_list(None)
+        fetched = {item_id: None for item_id in missing}
+        fetched.update((doc["id"], doc) for doc in docs)
+        # Don't cache what may already be stale
+        if generation == self.generation:
+            if len(self._items) + len(fetched) > self.max_items:
+                self._items.clear()
+            self._items.update(fetched)
+        return {**found, **fetched}
+
+    async def bump(self):
+        """Invalidate after a catalog write, here and (eventually) on every other worker"""
+        self.invalidate()
+        if self.invalidation == "none":
+            return
+        doc = await self.db.cache_versions.find_one_and_update(
+            {"_id": VERSION_KEY},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self.version = doc["version"]
+
+    async def _read_version(self) -> int:
+        doc = await self.db.cache_versions.find_one({"_id": VERSION_KEY})
+        return doc["version"] if doc else 0
+
+    async def _poll(self):
+        while True:
+            try:
+                version = await self._read_version()
+                if version != self.version:
+                    self.version = version
+                    self.invalidate()
+            except PyMongoError:
+                logger.exception("Polling the shop catalog version failed")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _watch(self):
+        async with self.db.shop_items.watch() as stream:
+            async for _ in stream:
+                self.invalidate()
+
+    async def _run(self):
+        use_change_stream = self.invalidation in ("auto", "change_stream")
+        while use_change_stream:
+            try:
+                await self._watch()
+            except OperationFailure as e:
+                if self.invalidation == "change_stream":
+                    raise
+                # Change streams need a replica set; standalone servers get polling
+                logger.info("Shop catalog change stream unavailable (%s), polling instead", e)
+                use_change_stream = False
+            except PyMongoError:
+                logger.exception("Shop catalog change stream failed, reopening")
+                await asyncio.sleep(self.poll_interval)
+            # Changes may have been missed while the stream was down
+            self.invalidate()
+        await self._poll()
+
+    def start(self):
+        if self.invalidation != "none" and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, PyMongoError):
+                pass
+            self._task = None
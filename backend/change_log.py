@@ -0,0 +1,146 @@
+"""Per-user change log behind delta sync.
+
+Every write to a user's documents (the user itself, quests, inventory,
+powers and custom stats) is recorded in ``user_changes`` under a per-user
+version taken from a counter in ``sync_versions``, which also counts the
+changes per collection so caches can tell whether, say, a user's powers
+changed without reading them. A client that remembers
+the last version it saw asks for the changes after it and receives only the
+documents written since, plus tombstones for deleted ones.
+
+Writers record a change *after* writing the document, so a reader that sees
+the change always reads a document at least that new. Two writers can still
+record their changes out of order (version 7 inserted before version 6), so
+readers only advance through contiguous versions: a missing version blocks
+the ones after it until it shows up, or until GAP_TIMEOUT has passed and its
+writer is assumed to have died between reserving and recording it.
+
+Entries expire after CHANGE_LOG_TTL_SECONDS. A client whose version is
+older than the oldest entry still kept cannot catch up from the log and
+gets ResyncRequired instead, telling it to load a fresh snapshot.
+"""
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+# Collections whose documents are synced, keyed by the `id` field
+SYNCED_COLLECTIONS = ("users", "quests", "inventory", "powers", "custom_stats")
+
+GAP_TIMEOUT = timedelta(seconds=30)
+
+# Clients offline for longer than this resync from a snapshot
+CHANGE_LOG_TTL_SECONDS = 30 * 24 * 60 * 60
+
+# (user_id, collection, document id, operation)
+Change = Tuple[str, str, str, str]
+
+
+class ResyncRequired(Exception):
+    """Changes the client has not seen were pruned from the log"""
+
+
+async def reserve_versions(db, user_id: str, changes: List[Change]) -> int:
+    """Reserve one version per change for the user and return the first"""
+    increments = {"version": len(changes)}
+    for _, collection, _, _ in changes:
+        key = f"collections.{collection}"
+        increments[key] = increments.get(key, 0) + 1
+    counter = await db.sync_versions.find_one_and_update(
+        {"_id": user_id},
+        {"$inc": increments, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["version"] - len(changes) + 1
+
+
+async def record_changes(db, changes: Iterable[Change]):
+    """Append changes to the log; one counter update per user and one insert overall"""
+    by_user: Dict[str, List[Change]] = defaultdict(list)
+    for change in changes:
+        by_user[change[0]].append(change)
+
+    now = datetime.utcnow()
+    firsts = await asyncio.gather(*(
+        reserve_versions(db, user_id, user_changes) for user_id, user_changes in by_user.items()
+    ))
+    entries = []
+    for first, (user_id, user_changes) in zip(firsts, by_user.items()):
+        for offset, (_, collection, doc_id, operation) in enumerate(user_changes):
+            entries.append({
+                "user_id": user_id,
+                "version": first + offset,
+                "collection": collection,
+                "doc_id": doc_id,
+                "op": operation,
+                "at": now,
+            })
+    if entries:
+        await db.user_changes.insert_many(entries, ordered=False)
+
+
+async def record_upserts(db, user_id: str, collection: str, doc_ids: Iterable[str]):
+    await record_changes(db, [(user_id, collection, doc_id, UPSERT) for doc_id in doc_ids])
+
+
+async def record_deletes(db, user_id: str, collection: str, doc_ids: Iterable[str]):
+    await record_changes(db, [(user_id, collection, doc_id, DELETE) for doc_id in doc_ids])
+
+
+async def current_version(db, user_id: str) -> int:
+    counter = await db.sync_versions.find_one({"_id": user_id}, {"version": 1})
+    return counter["version"] if counter else 0
+
+
+async def collection_version(db, user_id: str, collection: str) -> int:
+    """Number of changes recorded so far to the user's documents in `collection`"""
+    counter = await db.sync_versions.find_one({"_id": user_id}, {f"collections.{collection}": 1})
+    return (counter or {}).get("collections", {}).get(collection, 0)
+
+
+async def pruned_after(db, user_id: str, since: int, now: datetime) -> bool:
+    """Whether the change after `since` was recorded and has since expired.
+
+    A missing version younger than GAP_TIMEOUT may still be being recorded,
+    so only an older gap counts as pruned.
+    """
+    oldest = await db.user_changes.find_one({"user_id": user_id}, {"version": 1, "at": 1}, sort=[("version", 1)])
+    if oldest is not None:
+        return oldest["version"] > since + 1 and now - oldest["at"] >= GAP_TIMEOUT
+    counter = await db.sync_versions.find_one({"_id": user_id}, {"version": 1, "updated_at": 1})
+    if not counter or counter["version"] <= since:
+        return False
+    # Counters written before updated_at existed are long past any gap
+    return now - counter.get("updated_at", datetime.min) >= GAP_TIMEOUT
+
+
+async def changes_since(db, user_id: str, since: int, limit: int, now: Optional[datetime] = None) -> Tuple[Dict[Tuple[str, str], str], int, bool]:
+    """Latest operation per (collection, document id) recorded after `since`.
+
+    Returns the operations, the version the client has caught up to and
+    whether more changes are waiting beyond `limit` log entries. Raises
+    ResyncRequired when the change right after `since` has expired.
+    """
+    now = now or datetime.utcnow()
+    entries = await db.user_changes.find(
+        {"user_id": user_id, "version": {"$gt": since}}
+    ).sort("version", 1).limit(limit + 1).to_list(limit + 1)
+    if (not entries or entries[0]["version"] != since + 1) and await pruned_after(db, user_id, since, now):
+        raise ResyncRequired(since)
+
+    operations: Dict[Tuple[str, str], str] = {}
+    version = since
+    for entry in entries[:limit]:
+        if entry["version"] != version + 1 and now - entry["at"] < GAP_TIMEOUT:
+            # An earlier change is still being recorded; the next sync picks it up
+            return operations, version, False
+        operations[(entry["collection"], entry["doc_id"])] = entry["op"]
+        version = entry["version"]
+    return operations, version, len(entries) > limit
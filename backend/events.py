@@ -0,0 +1,110 @@
+"""Per-user event fan-out for the push channel.
+
+Write paths publish typed events (``level_up``, ``quest_failed``...) for a
+user and every open ``/users/{user_id}/events`` stream of that user receives
+them. ``EventBus`` fans out within this process; a deployment with several
+API workers (or a standalone quest scheduler) swaps it for a subclass that
+relays ``publish`` through a broker and delivers what the broker sends back
+with ``deliver``, keeping the same interface for the write paths.
+
+Events are notifications, not the source of truth: a client that was
+disconnected or fell behind catches up with delta sync.
+"""
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+
+logger = logging.getLogger(__name__)
+
+QUEST_FAILED = "quest_failed"
+QUEST_RESET = "quest_reset"
+LEVEL_UP = "level_up"
+POWER_EVOLVED = "power_evolved"
+INVENTORY_CHANGED = "inventory_changed"
+
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+class Event:
+    def __init__(self, event_id: int, event_type: str, data: dict):
+        self.id = event_id
+        self.type = event_type
+        self.data = data
+
+    def encode(self) -> str:
+        """Server-Sent Events wire format"""
+        data = json.dumps(self.data, default=_json_default, separators=(",", ":"))
+        return f"id: {self.id}\nevent: {self.type}\ndata: {data}\n\n"
+
+
+class Subscription:
+    """One open stream; buffers events until the stream writes them out"""
+
+    def __init__(self, bus: "EventBus", user_id: str, max_pending: int):
+        self.bus = bus
+        self.user_id = user_id
+        self.closed = False
+        self._queue: "asyncio.Queue[Optional[Event]]" = asyncio.Queue(max_pending)
+
+    def push(self, event: Event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client this far behind resyncs anyway; end its stream so it reconnects
+            logger.warning("Event stream of user %s fell behind, closing it", self.user_id)
+            self.close()
+
+    async def get(self) -> Optional[Event]:
+        """Next event, or None once the subscription is closed"""
+        if self.closed:
+            return None
+        return await self._queue.get()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.bus.unsubscribe(self)
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+
+class EventBus:
+    """In-process pub/sub keyed by user id"""
+
+    def __init__(self, max_pending: int = 100):
+        self.max_pending = max_pending
+        self._subscriptions: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._last_id = 0
+
+    def subscribe(self, user_id: str) -> Subscription:
+        subscription = Subscription(self, user_id, self.max_pending)
+        self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.user_id]
+
+    async def publish(self, user_id: str, event_type: str, data: dict):
+        self.deliver(user_id, event_type, {**data, "at": datetime.utcnow()})
+
+    def deliver(self, user_id: str, event_type: str, data: dict):
+        """Hand an event to this process's subscribers of the user"""
+        subscriptions = self._subscriptions.get(user_id)
+        if not subscriptions:
+            return
+        self._last_id += 1
+        event = Event(self._last_id, event_type, data)
+        for subscription in list(subscriptions):
+            subscription.push(event)
@@ -0,0 +1,119 @@
+"""Idempotency keys for the economy endpoints.
+
+A client that sends an ``Idempotency-Key`` header with a purchase, an item
+use, a power level-up or a quest completion can retry it safely: the first
+request claims the key in the ``idempotency`` collection and stores its
+response, and every retry with the same key gets that stored response back
+without running the operation again. Keys are scoped to the method and path,
+expire after ``IDEMPOTENCY_TTL_SECONDS`` through a TTL index, and are bound to
+the request body, so reusing a key for a different request is rejected.
+
+While the first request runs, its claim is a lease: retries get 409 until it
+finishes, but once the lease is ``IDEMPOTENCY_LEASE_SECONDS`` old (the worker
+died before storing a response) the next retry takes the key over and runs
+the operation itself.
+"""
+import hashlib
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from pymongo.errors import DuplicateKeyError
+
+from serialization import dumps, json_response
+
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+IDEMPOTENCY_LEASE_SECONDS = 60
+MAX_KEY_LENGTH = 255
+
+
+def _fingerprint(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+def _stored_response(record: dict) -> Response:
+    return Response(
+        content=record["body"],
+        status_code=record["status_code"],
+        media_type="application/json",
+        headers={REPLAYED_HEADER: "true"},
+    )
+
+
+class IdempotencyStore:
+    def __init__(self, db):
+        self.collection = db.idempotency
+
+    async def _claim(self, record_id: str, fingerprint: str, now: datetime) -> Optional[dict]:
+        """Claim the key, or return the existing record if another request already has"""
+        try:
+            await self.collection.insert_one({
+                "_id": record_id,
+                "fingerprint": fingerprint,
+                "status_code": None,
+                "created_at": now,
+                "claimed_at": now,
+            })
+            return None
+        except DuplicateKeyError:
+            existing = await self.collection.find_one({"_id": record_id})
+            # The record can expire between the insert and the read; treat that as a conflict too
+            if existing is None:
+                return {"fingerprint": fingerprint, "status_code": None}
+            if existing["status_code"] is not None or existing["fingerprint"] != fingerprint:
+                return existing
+
+            # Take over an unfinished claim whose lease ran out; only one retry can win it.
+            # Records claimed before leases existed have only created_at.
+            expired = now - timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+            taken = await self.collection.update_one(
+                {"_id": record_id, "status_code": None, "$or": [
+                    {"claimed_at": {"$lt": expired}},
+                    {"claimed_at": {"$exists": False}, "created_at": {"$lt": expired}},
+                ]},
+                {"$set": {"claimed_at": now}}
+            )
+            return None if taken.modified_count else existing
+
+    async def run(self, request: Request, operation: Callable[[], Awaitable]) -> Response:
+        """Run `operation` at most once per idempotency key and return its (stored) response"""
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return json_response(jsonable_encoder(await operation()))
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} must be 1-{MAX_KEY_LENGTH} characters")
+
+        record_id = f"{request.method} {request.url.path} {key}"
+        fingerprint = _fingerprint(await request.body())
+        now = datetime.utcnow()
+        existing = await self._claim(record_id, fingerprint, now)
+        if existing is not None:
+            if existing["fingerprint"] != fingerprint:
+                raise HTTPException(status_code=422, detail=f"{IDEMPOTENCY_HEADER} was already used for a different request")
+            if existing["status_code"] is None:
+                raise HTTPException(status_code=409, detail="A request with this idempotency key is still in progress")
+            return _stored_response(existing)
+
+        # Writes below only apply while this request still holds the lease
+        lease = {"_id": record_id, "claimed_at": now}
+        try:
+            content = jsonable_encoder(await operation())
+            status_code = 200
+        except HTTPException as e:
+            # Client errors are part of the outcome (e.g. not enough gold) and replay like successes
+            if e.status_code >= 500:
+                await self.collection.delete_one(lease)
+                raise
+            content, status_code = {"detail": e.detail}, e.status_code
+        except BaseException:
+            # Release the key so the client can retry after an unexpected failure
+            await self.collection.delete_one(lease)
+            raise
+
+        body = dumps(content)
+        await self.collection.update_one(lease, {"$set": {"status_code": status_code, "body": body}})
+        return Response(content=body, status_code=status_code, media_type="application/json")
@@ -0,0 +1,139 @@
+"""Content-addressed image storage for shop items.
+
+Images are stored once in the ``images`` collection keyed by the SHA-256 of
+their decoded bytes, so shop documents only carry a list of hashes and the
+same picture uploaded twice is kept a single time.  Thumbnails are generated
+on first request and cached on the image document.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import re
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+
+# Sizes (longest edge, in pixels) that may be requested as thumbnails
+THUMBNAIL_SIZES = (128, 256, 512)
+DEFAULT_THUMBNAIL_SIZE = 256
+
+DATA_URI_RE = re.compile(r"^data:(?P<mime>[^;,]*)(?:;[^;,]*)*;base64,(?P<data>.*)$", re.DOTALL)
+IMAGE_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+IMAGE_URL_RE = re.compile(r"/api/images/(?P<hash>[0-9a-f]{64})")
+
+
+def image_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def sniff_content_type(data: bytes, fallback: str = "application/octet-stream") -> str:
+    """Detect the image MIME type from its bytes, ignoring what the client claimed"""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return Image.MIME.get(img.format, fallback)
+    except Exception:
+        return fallback
+
+
+def decode_data_uri(value: str) -> Tuple[bytes, str]:
+    """Decode a ``data:<mime>;base64,<payload>`` URI (or bare base64) into bytes and a MIME type"""
+    match = DATA_URI_RE.match(value)
+    payload = match.group("data") if match else value
+    claimed_type = (match.group("mime") if match else "") or "application/octet-stream"
+    try:
+        data = base64.b64decode(payload, validate=False)
+    except (binascii.Error, ValueError):
+        raise ValueError("Image is not valid base64 data")
+    if not data:
+        raise ValueError("Image is empty")
+    return data, sniff_content_type(data, claimed_type)
+
+
+def make_thumbnail(data: bytes, size: int) -> Tuple[bytes, str]:
+    """Downscale an image so its longest edge is at most ``size`` pixels.
+
+    Animated images keep only their first frame. Images with transparency are
+    written as PNG, everything else as JPEG.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        img.seek(0)
+        has_alpha = img.mode in ("RGBA", "LA", "P") and (
+            img.mode != "P" or "transparency" in img.info
+        )
+        thumb = img.convert("RGBA" if has_alpha else "RGB")
+        thumb.thumbnail((size, size))
+        out = io.BytesIO()
+        if has_alpha:
+            thumb.save(out, format="PNG", optimize=True)
+            return out.getvalue(), "image/png"
+        thumb.save(out, format="JPEG", quality=80, optimize=True)
+        return out.getvalue(), "image/jpeg"
+
+
+class ImageStore:
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def put(self, data: bytes, content_type: str) -> str:
+        """Store image bytes and return their hash. Storing the same bytes twice is a no-op."""
+        digest = image_hash(data)
+        await self.collection.update_one(
+            {"_id": digest},
+            {"$setOnInsert": {
+                "_id": digest,
+                "content_type": content_type,
+                "size": len(data),
+                "data": data,
+            }},
+            upsert=True
+        )
+        return digest
+
+    async def get(self, digest: str) -> Optional[dict]:
+        return await self.collection.find_one({"_id": digest}, {"thumbnails": 0})
+
+    async def get_thumbnail(self, digest: str, size: int) -> Optional[dict]:
+        """Return ``{"data", "content_type"}`` for a thumbnail, generating and caching it on first use"""
+        field = f"thumbnails.{size}"
+        cached = await self.collection.find_one({"_id": digest}, {field: 1})
+        if not cached:
+            return None
+        thumbnail = (cached.get("thumbnails") or {}).get(str(size))
+        if thumbnail:
+            return thumbnail
+
+        original = await self.get(digest)
+        try:
+            data, content_type = await asyncio.to_thread(make_thumbnail, original["data"], size)
+        except Exception:
+            # Not something Pillow can decode - serve the original instead
+            return {"data": original["data"], "content_type": original["content_type"]}
+
+        thumbnail = {"data": data, "content_type": content_type}
+        await self.collection.update_one({"_id": digest}, {"$set": {field: thumbnail}})
+        return thumbnail
+
+    async def ingest(self, images: Optional[List[str]]) -> List[str]:
+        """Turn a client-supplied image list into image hashes.
+
+        Entries may be base64 data URIs (new uploads), URLs previously handed
+        out by ``GET /api/images/{hash}`` or bare hashes, so clients can send
+        back the list they received when editing an item.
+        """
+        digests = []
+        for value in images or []:
+            if not value:
+                continue
+            if IMAGE_HASH_RE.match(value):
+                digests.append(value)
+                continue
+            url_match = IMAGE_URL_RE.search(value)
+            if url_match and not value.startswith("data:"):
+                digests.append(url_match.group("hash"))
+                continue
+            data, content_type = decode_data_uri(value)
+            digests.append(await self.put(data, content_type))
+        return digests
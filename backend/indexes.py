@@ -0,0 +1,187 @@
+"""Index declarations for the game collections.
+
+``INDEXES`` lists the indexes every hot query relies on and ``QUERY_SHAPES``
+lists those queries, so the startup hook can create the former and the index
+report can check that each of the latter is actually served by an index.
+"""
+import logging
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+from change_log import CHANGE_LOG_TTL_SECONDS
+from idempotency import IDEMPOTENCY_TTL_SECONDS
+from quest_schedule import FAILURE_NOTICE_TTL_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+
+def _id_index() -> IndexModel:
+    return IndexModel([("id", ASCENDING)], name="id_unique", unique=True)
+
+
+def _user_page_index() -> IndexModel:
+    # Serves both the user_id filter and the _id keyset sort of paginated listings
+    return IndexModel([("user_id", ASCENDING), ("_id", ASCENDING)], name="user_id_page")
+
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        _id_index(),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+    ],
+    "quests": [
+        _id_index(),
+        _user_page_index(),
+        # Time-ordered indexes the quest scheduler uses to find due quests
+        IndexModel([("next_reset_at", ASCENDING)], name="next_reset_at"),
+        IndexModel([("next_deadline_at", ASCENDING)], name="next_deadline_at"),
+    ],
+    "quest_failure_notices": [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        # Notices for clients that never call check-failures don't pile up
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=FAILURE_NOTICE_TTL_SECONDS),
+    ],
+    "shop_items": [
+        _id_index(),
+        IndexModel([("name", ASCENDING), ("is_power", ASCENDING)], name="name_is_power"),
+        # Shop search: equality filters first, then the sort field, then the _id tie-breaker
+        IndexModel([("is_power", ASCENDING), ("power_category", ASCENDING), ("power_tier", ASCENDING), ("name", ASCENDING), ("_id", ASCENDING)], name="power_browse"),
+        IndexModel([("category", ASCENDING), ("item_type", ASCENDING), ("price", ASCENDING), ("_id", ASCENDING)], name="category_item_type_price"),
+        IndexModel([("is_synthesis_material", ASCENDING), ("name", ASCENDING), ("_id", ASCENDING)], name="synthesis_material_name"),
+        IndexModel([("price", ASCENDING), ("_id", ASCENDING)], name="price_page"),
+        IndexModel([("name", TEXT), ("description", TEXT)], name="name_description_text", weights={"name": 5}),
+    ],
+    "inventory": [
+        _id_index(),
+        _user_page_index(),
+        # One stack per item; purchases and rewards upsert into it
+        IndexModel([("user_id", ASCENDING), ("item_id", ASCENDING)], name="user_id_item_id", unique=True),
+        # Rows referencing a shop item, for its edits and deletion
+        IndexModel([("item_id", ASCENDING)], name="item_id"),
+    ],
+    "powers": [
+        _id_index(),
+        _user_page_index(),
+        IndexModel([("shop_item_id", ASCENDING)], name="shop_item_id"),
+    ],
+    "custom_stats": [
+        _id_index(),
+        _user_page_index(),
+        # Rewards are granted by stat name, so names are unique per user
+        IndexModel([("user_id", ASCENDING), ("name", ASCENDING)], name="user_id_name", unique=True),
+    ],
+    "recipes": [
+        _id_index(),
+    ],
+    "user_changes": [
+        IndexModel([("user_id", ASCENDING), ("version", ASCENDING)], name="user_id_version", unique=True),
+        # Clients further behind than this resync from a snapshot
+        IndexModel([("at", ASCENDING)], name="at_ttl", expireAfterSeconds=CHANGE_LOG_TTL_SECONDS),
+    ],
+    "idempotency": [
+        # Stored responses are dropped once a retry is no longer plausible
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS),
+    ],
+}
+
+# Representative query shapes issued by server.py. Values are placeholders;
+# only the shape matters to the query planner.
+QUERY_SHAPES: List[dict] = [
+    {"collection": "users", "filter": {"id": "?"}},
+    {"collection": "users", "filter": {"username": "?"}},
+    {"collection": "quests", "filter": {"id": "?"}},
+    {"collection": "quests", "filter": {"user_id": "?"}, "sort": [("_id", ASCENDING)]},
+    {"collection": "quests", "filter": {"next_reset_at": {"$lte": "?"}}},
+    {"collection": "quests", "filter": {"next_deadline_at": {"$lte": "?"}}},
+    {"collection": "quest_failure_notices", "filter": {"user_id": "?"}},
+    {"collection": "shop_items", "filter": {"id": "?"}},
+    {"collection": "shop_items", "filter": {}, "sort": [("_id", ASCENDING)]},
+    {"collection": "shop_items", "filter": {"name": "?", "is_power": True}},
+    {"collection": "shop_items", "filter": {"is_power": True, "power_category": "?", "power_tier": "?"}, "sort": [("name", ASCENDING), ("_id", ASCENDING)]},
+    {"collection": "shop_items", "filter": {"category": "?", "item_type": "?", "price": {"$lte": 0}}, "sort": [("price", ASCENDING), ("_id", ASCENDING)]},
+    {"collection": "shop_items", "filter": {"is_synthesis_material": True}, "sort": [("name", ASCENDING), ("_id", ASCENDING)]},
+    {"collection": "shop_items", "filter": {}, "sort": [("price", DESCENDING), ("_id", DESCENDING)]},
+    {"collection": "shop_items", "filter": {"$text": {"$search": "?"}}},
+    {"collection": "inventory", "filter": {"id": "?"}},
+    {"collection": "inventory", "filter": {"user_id": "?"}, "sort": [("_id", ASCENDING)]},
+    {"collection": "inventory", "filter": {"user_id": "?", "item_id": "?"}},
+    {"collection": "inventory", "filter": {"item_id": "?"}},
+    {"collection": "powers", "filter": {"id": "?"}},
+    {"collection": "powers", "filter": {"user_id": "?"}, "sort": [("_id", ASCENDING)]},
+    {"collection": "powers", "filter": {"shop_item_id": "?"}},
+    {"collection": "custom_stats", "filter": {"id": "?", "user_id": "?"}},
+    {"collection": "custom_stats", "filter": {"user_id": "?", "name": "?"}},
+    {"collection": "custom_stats", "filter": {"user_id": "?"}, "sort": [("_id", ASCENDING)]},
+    {"collection": "recipes", "filter": {"id": "?"}},
+    {"collection": "recipes", "filter": {}, "sort": [("_id", ASCENDING)]},
+    {"collection": "user_changes", "filter": {"user_id": "?", "version": {"$gt": 0}}, "sort": [("version", ASCENDING)]},
+]
+
+
+async def ensure_indexes(db) -> Dict[str, List[str]]:
+    """Create every declared index. Safe to run on each startup.
+
+    A failure on one collection (typically duplicate data blocking a unique
+    index) is logged and does not prevent the others from being created.
+    """
+    created = {}
+    for collection_name, indexes in INDEXES.items():
+        try:
+            created[collection_name] = await db[collection_name].create_indexes(indexes)
+        except OperationFailure as e:
+            logger.error("Could not create indexes on %s: %s", collection_name, e)
+            created[collection_name] = []
+    return created
+
+
+def _plan_stages(plan: dict) -> List[str]:
+    """Flatten the stage names of an explain() plan tree"""
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if isinstance(plan.get(key), dict):
+            stages += _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return [stage for stage in stages if stage]
+
+
+async def index_report(db) -> List[dict]:
+    """Explain each registered query shape and flag those that still scan the collection"""
+    report = []
+    for shape in QUERY_SHAPES:
+        cursor = db[shape["collection"]].find(shape["filter"])
+        if shape.get("sort"):
+            cursor = cursor.sort(shape["sort"])
+        entry = {
+            "collection": shape["collection"],
+            "filter": sorted(shape["filter"]),
+            "sort": [field for field, _ in shape.get("sort", [])],
+        }
+        try:
+            explain = await cursor.explain()
+        except OperationFailure as e:
+            report.append({**entry, "error": str(e), "collscan": None})
+            continue
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        stages = _plan_stages(winning_plan)
+        report.append({
+            **entry,
+            "stages": stages,
+            "index": _index_name(winning_plan),
+            "collscan": "COLLSCAN" in stages,
+        })
+    return report
+
+
+def _index_name(plan: dict):
+    if plan.get("indexName"):
+        return plan["indexName"]
+    for child in [plan.get("inputStage"), plan.get("queryPlan"), *plan.get("inputStages", [])]:
+        if isinstance(child, dict):
+            name = _index_name(child)
+            if name:
+                return name
+    return None
@@ -0,0 +1,66 @@
+"""Leveling curves shared by quests, consumable items and custom stats.
+
+Player XP follows a triangular curve: reaching level ``L + 1`` from ``L``
+costs ``100 * L`` XP, so the XP spent to reach level ``L`` from level 1 is
+``50 * L * (L - 1)`` and the level reached by a given amount of XP is the
+root of a quadratic.
+
+Custom stats follow a geometric curve: the bar starts at ``max`` and grows by
+10% (rounded down) with every level. Because of the rounding there is no
+exact closed form, but the bar grows geometrically, so the levels gained by
+a reward are found in O(log n) steps. The one case where the bar stops
+growing (a bar under 10 points) is solved with a single division.
+"""
+import math
+from typing import Tuple
+
+
+XP_PER_LEVEL = 100
+CUSTOM_STAT_GROWTH = 1.1
+
+
+def xp_for_level(level: int) -> int:
+    """XP needed to go from `level` to `level + 1`"""
+    return level * XP_PER_LEVEL
+
+
+def total_xp_for_level(level: int) -> int:
+    """XP spent to climb from level 1 to `level`"""
+    return XP_PER_LEVEL * level * (level - 1) // 2
+
+
+def level_up(level: int, xp: int) -> Tuple[int, int, int]:
+    """Resolve pending level-ups in O(1).
+
+    Returns (new_level, remaining_xp, levels_gained), the same result as
+    repeatedly subtracting xp_for_level(level) while xp covers it.
+    """
+    if xp < xp_for_level(level):
+        return level, xp, 0
+    total = total_xp_for_level(level) + xp
+    # Largest L with 50 * L * (L - 1) <= total, i.e. L * (L - 1) <= total // 50
+    new_level = max(level, (1 + math.isqrt(4 * (total // (XP_PER_LEVEL // 2)) + 1)) // 2)
+    return new_level, total - total_xp_for_level(new_level), new_level - level
+
+
+def custom_stat_level_up(current: int, max_value: int, level: int) -> Tuple[int, int, int]:
+    """Level a custom stat up while its value fills the bar.
+
+    Returns (current, max_value, level) after every level-up the value pays
+    for, the same result as subtracting the bar and growing it one level at
+    a time.
+    """
+    if max_value <= 0:
+        # An empty bar can't be filled meaningfully; leave the stat alone
+        return current, max_value, level
+
+    while current >= max_value:
+        grown = int(max_value * CUSTOM_STAT_GROWTH)
+        if grown == max_value:
+            # The bar no longer grows, so every remaining level costs the same
+            levels, current = divmod(current, max_value)
+            return current, max_value, level + levels
+        current -= max_value
+        level += 1
+        max_value = grown
+    return current, max_value, level
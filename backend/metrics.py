@@ -0,0 +1,238 @@
+"""Request and MongoDB metrics, exposed in the Prometheus text format.
+
+``MetricsMiddleware`` times every HTTP request and records its status,
+request and response sizes against the matched route template, so
+``/api/quests/{user_id}`` is one series however many users there are.
+``MongoCommandMetrics`` is a pymongo ``CommandListener`` passed to the Motor
+client: it attributes every command (its time and how many documents came
+back) to the request that issued it. Motor runs the driver in a thread pool
+but copies the caller's context, so a context variable carries the request
+across. Commands sent outside a request, from the scheduler or the startup
+hooks, are recorded under the ``background`` route.
+
+Requests slower than ``slow_request_ms`` are logged with their command
+breakdown, which is usually enough to spot an endpoint doing N+1 reads.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_ROUTE = "background"
+UNMATCHED_ROUTE = "unmatched"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def lines(self, name: str, labels: str) -> list:
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class CommandStats:
+    """Commands one request (or the background work) sent, by command name"""
+
+    def __init__(self):
+        self.commands: Dict[str, int] = defaultdict(int)
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.documents: Dict[str, int] = defaultdict(int)
+        self.failures: Dict[str, int] = defaultdict(int)
+
+    def summary(self) -> str:
+        return ", ".join(
+            f"{name}={count} ({self.seconds[name] * 1000:.1f}ms, {self.documents[name]} docs)"
+            for name, count in sorted(self.commands.items(), key=lambda item: -item[1])
+        ) or "no mongo commands"
+
+
+_current_request: ContextVar[Optional[CommandStats]] = ContextVar("metrics_request", default=None)
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _returned_documents(reply: dict) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    # findAndModify returns its document under "value"; plain writes return none
+    if "value" in reply:
+        return 1 if reply["value"] is not None else 0
+    return 0
+
+
+class Metrics:
+    def __init__(self, slow_request_ms: float = 500):
+        self.slow_request_ms = slow_request_ms
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests: Dict[Tuple[str, str, int], int] = defaultdict(int)
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.request_size: Dict[Tuple[str, str], Histogram] = {}
+        self.response_size: Dict[Tuple[str, str], Histogram] = {}
+        self.mongo: Dict[str, CommandStats] = defaultdict(CommandStats)
+        # Other sources of Prometheus lines, such as the connection pool listener
+        self.collectors: List[Callable[[], List[str]]] = []
+
+    def record_command(self, command: str, seconds: float, documents: int = 0, failed: bool = False):
+        # Commands of a request are folded into its route once the route is known
+        with self._lock:
+            stats = _current_request.get() or self.mongo[BACKGROUND_ROUTE]
+            stats.commands[command] += 1
+            stats.seconds[command] += seconds
+            stats.documents[command] += documents
+            if failed:
+                stats.failures[command] += 1
+
+    def record_request(self, method: str, route: str, status: int, seconds: float,
+                       request_bytes: int, response_bytes: int, commands: CommandStats):
+        key = (method, route)
+        with self._lock:
+            self.requests[(method, route, status)] += 1
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.request_size.setdefault(key, Histogram(SIZE_BUCKETS)).observe(request_bytes)
+            self.response_size.setdefault(key, Histogram(SIZE_BUCKETS)).observe(response_bytes)
+            route_stats = self.mongo[route]
+            for name, count in commands.commands.items():
+                route_stats.commands[name] += count
+                route_stats.seconds[name] += commands.seconds[name]
+                route_stats.documents[name] += commands.documents[name]
+                route_stats.failures[name] += commands.failures[name]
+
+        if seconds * 1000 >= self.slow_request_ms:
+            logger.warning(
+                "Slow request %s %s -> %d in %.0fms: %s",
+                method, route, status, seconds * 1000, commands.summary()
+            )
+
+    def render(self) -> str:
+        """Everything recorded so far in the Prometheus text exposition format"""
+        with self._lock:
+            lines = [
+                "# HELP http_requests_in_flight Requests currently being served.",
+                "# TYPE http_requests_in_flight gauge",
+                f"http_requests_in_flight {self.in_flight}",
+                "# HELP http_requests_total Requests served, by route template and status.",
+                "# TYPE http_requests_total counter",
+            ]
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{_label(route)}",status="{status}"}} {count}')
+
+            for name, help_text, histograms in (
+                ("http_request_duration_seconds", "Request latency.", self.latency),
+                ("http_request_size_bytes", "Request body size.", self.request_size),
+                ("http_response_size_bytes", "Response body size.", self.response_size),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for (method, route), histogram in sorted(histograms.items()):
+                    lines += histogram.lines(name, f'method="{method}",route="{_label(route)}"')
+
+            for name, help_text, field in (
+                ("mongodb_commands_total", "MongoDB commands sent, by route and command.", "commands"),
+                ("mongodb_command_seconds_total", "Time spent in MongoDB commands.", "seconds"),
+                ("mongodb_documents_returned_total", "Documents returned by MongoDB commands.", "documents"),
+                ("mongodb_command_failures_total", "MongoDB commands that failed.", "failures"),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for route, stats in sorted(self.mongo.items()):
+                    for command, value in sorted(getattr(stats, field).items()):
+                        lines.append(f'{name}{{route="{_label(route)}",command="{command}"}} {value}')
+        for collect in self.collectors:
+            lines += collect()
+        return "\n".join(lines) + "\n"
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.metrics.record_command(
+            event.command_name, event.duration_micros / 1e6, _returned_documents(event.reply)
+        )
+
+    def failed(self, event):
+        self.metrics.record_command(event.command_name, event.duration_micros / 1e6, failed=True)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streaming responses are timed until their last chunk"""
+
+    def __init__(self, app, metrics: Metrics, exclude_paths: Tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.metrics = metrics
+        self.exclude_paths = exclude_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        commands = CommandStats()
+        token = _current_request.set(commands)
+        sizes = {"request": 0, "response": 0}
+        status = 500
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        self.metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            self.metrics.in_flight -= 1
+            _current_request.reset(token)
+            route = scope.get("route")
+            self.metrics.record_request(
+                scope["method"],
+                getattr(route, "path", UNMATCHED_ROUTE),
+                status,
+                time.perf_counter() - started,
+                sizes["request"],
+                sizes["response"],
+                commands,
+            )
@@ -0,0 +1,159 @@
+"""Motor client construction and connection pool statistics.
+
+Pool settings come from the environment so they can be sized per uvicorn
+worker (each worker has its own pool, so the server sees workers times
+``MONGO_MAX_POOL_SIZE`` connections at most):
+
+    MONGO_MAX_POOL_SIZE           maxPoolSize (driver default 100)
+    MONGO_MIN_POOL_SIZE           minPoolSize, connections kept open while idle
+    MONGO_MAX_CONNECTING          maxConnecting, connections opened in parallel
+    MONGO_MAX_IDLE_TIME_MS        maxIdleTimeMS
+    MONGO_WAIT_QUEUE_TIMEOUT_MS   waitQueueTimeoutMS, how long a checkout may wait
+    MONGO_COMPRESSORS             e.g. "zstd,snappy,zlib"; zstd and snappy need the
+                                  zstandard / python-snappy packages installed
+    MONGO_READ_PREFERENCE         e.g. "primaryPreferred"
+
+Unset variables keep the driver defaults. ``PoolStats`` is a pymongo
+``ConnectionPoolListener`` that tracks open and checked-out connections and
+how long checkouts waited, rendered alongside the request metrics.
+"""
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Mapping
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+from metrics import LATENCY_BUCKETS, Histogram
+
+
+POOL_ENV = {
+    "MONGO_MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MONGO_MIN_POOL_SIZE": ("minPoolSize", int),
+    "MONGO_MAX_CONNECTING": ("maxConnecting", int),
+    "MONGO_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int),
+    "MONGO_COMPRESSORS": ("compressors", str),
+    "MONGO_READ_PREFERENCE": ("readPreference", str),
+}
+
+
+def pool_options(environ: Mapping[str, str]) -> dict:
+    """MongoClient keyword arguments for the pool variables that are set"""
+    options = {}
+    for variable, (option, convert) in POOL_ENV.items():
+        value = environ.get(variable, "").strip()
+        if not value:
+            continue
+        try:
+            options[option] = convert(value)
+        except ValueError:
+            raise ValueError(f"{variable} must be an integer, got {value!r}")
+    return options
+
+
+def create_client(mongo_url: str, environ: Mapping[str, str], event_listeners: List = ()) -> AsyncIOMotorClient:
+    """A Motor client configured from the environment.
+
+    Motor clients don't connect until the first operation, so this does no I/O;
+    the app's lifespan opens the pool and closes it on shutdown.
+    """
+    return AsyncIOMotorClient(mongo_url, event_listeners=list(event_listeners), **pool_options(environ))
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Checkout start times; a checkout starts and finishes on the same driver thread
+        self._checkout = threading.local()
+        self.open: Dict[str, int] = defaultdict(int)
+        self.checked_out: Dict[str, int] = defaultdict(int)
+        self.created: Dict[str, int] = defaultdict(int)
+        self.cleared: Dict[str, int] = defaultdict(int)
+        self.checkout_failures: Dict[tuple, int] = defaultdict(int)
+        self.wait: Dict[str, Histogram] = {}
+
+    @staticmethod
+    def _address(event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.cleared[self._address(event)] += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created[self._address(event)] += 1
+            self.open[self._address(event)] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open[self._address(event)] -= 1
+
+    def connection_check_out_started(self, event):
+        self._checkout.started = time.perf_counter()
+
+    def _waited(self, address: str):
+        started = getattr(self._checkout, "started", None)
+        if started is not None:
+            self._checkout.started = None
+            self.wait.setdefault(address, Histogram(LATENCY_BUCKETS)).observe(time.perf_counter() - started)
+
+    def connection_check_out_failed(self, event):
+        address = self._address(event)
+        with self._lock:
+            self._waited(address)
+            self.checkout_failures[(address, event.reason)] += 1
+
+    def connection_checked_out(self, event):
+        address = self._address(event)
+        with self._lock:
+            self._waited(address)
+            self.checked_out[address] += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out[self._address(event)] -= 1
+
+    def lines(self) -> List[str]:
+        """Prometheus text lines, collected by ``Metrics.render``"""
+        with self._lock:
+            lines = []
+            for name, kind, help_text, values in (
+                ("mongodb_pool_connections", "gauge", "Open pooled connections.", self.open),
+                ("mongodb_pool_checked_out", "gauge", "Connections checked out of the pool.", self.checked_out),
+                ("mongodb_pool_connections_created_total", "counter", "Connections opened.", self.created),
+                ("mongodb_pool_cleared_total", "counter", "Times the pool was cleared after an error.", self.cleared),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                for address, value in sorted(values.items()):
+                    lines.append(f'{name}{{address="{address}"}} {value}')
+
+            lines += [
+                "# HELP mongodb_pool_checkout_failures_total Checkouts that failed, by reason.",
+                "# TYPE mongodb_pool_checkout_failures_total counter",
+            ]
+            for (address, reason), value in sorted(self.checkout_failures.items()):
+                lines.append(f'mongodb_pool_checkout_failures_total{{address="{address}",reason="{reason}"}} {value}')
+
+            lines += [
+                "# HELP mongodb_pool_checkout_wait_seconds Time spent waiting for a pooled connection.",
+                "# TYPE mongodb_pool_checkout_wait_seconds histogram",
+            ]
+            for address, histogram in sorted(self.wait.items()):
+                lines += histogram.lines("mongodb_pool_checkout_wait_seconds", f'address="{address}"')
+        return lines
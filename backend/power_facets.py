@@ -0,0 +1,82 @@
+"""Power category facets, computed in MongoDB and cached.
+
+The powers tab and the shop only need the category names and how many
+powers sit in each category, subcategory and tier, so the counting is one
+``$group`` in the database rather than a scan of every power document in
+Python. Results are cached: per user until the change log shows their powers
+changed, and across all users until a power write bumps a shared version
+document (the same scheme the shop catalog cache uses).
+"""
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from change_log import collection_version
+
+
+VERSION_KEY = "power_facets"
+
+
+async def compute_facets(db, user_id: Optional[str] = None) -> dict:
+    match = {"power_category": {"$nin": [None, ""]}}
+    if user_id:
+        match["user_id"] = user_id
+    groups = await db.powers.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"category": "$power_category", "subcategory": "$power_subcategory", "tier": "$power_tier"},
+            "count": {"$sum": 1},
+        }},
+    ]).to_list(None)
+
+    facets = {}
+    for group in groups:
+        key, count = group["_id"], group["count"]
+        facet = facets.setdefault(key["category"], {"category": key["category"], "count": 0, "subcategories": {}, "tiers": {}})
+        facet["count"] += count
+        for field, name in (("subcategories", key.get("subcategory")), ("tiers", key.get("tier"))):
+            if name:
+                facet[field][name] = facet[field].get(name, 0) + count
+
+    return {
+        "categories": sorted(facets),
+        "facets": [
+            {
+                **facet,
+                "subcategories": [{"name": name, "count": count} for name, count in sorted(facet["subcategories"].items())],
+                "tiers": [{"tier": tier, "count": count} for tier, count in sorted(facet["tiers"].items())],
+            }
+            for _, facet in sorted(facets.items())
+        ],
+    }
+
+
+class PowerFacetCache:
+    def __init__(self, db, max_entries: int = 1024):
+        self.db = db
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Optional[str], Tuple[int, dict]]" = OrderedDict()
+
+    async def _version(self, user_id: Optional[str]) -> int:
+        if user_id:
+            return await collection_version(self.db, user_id, "powers")
+        doc = await self.db.cache_versions.find_one({"_id": VERSION_KEY})
+        return doc["version"] if doc else 0
+
+    async def get(self, user_id: Optional[str] = None) -> dict:
+        # Read the version before the facets, so a concurrent write can only cause a recount
+        version = await self._version(user_id)
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+        facets = await compute_facets(self.db, user_id)
+        self._entries[user_id] = (version, facets)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return facets
+
+    async def bump(self):
+        """Invalidate the all-users facets after powers were added, removed or re-tiered"""
+        await self.db.cache_versions.update_one({"_id": VERSION_KEY}, {"$inc": {"version": 1}}, upsert=True)
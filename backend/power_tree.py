@@ -0,0 +1,123 @@
+"""Evolution graph of a user's powers.
+
+A power links to its evolutions in two ways: by id (``evolved_abilities`` on
+the parent, ``evolved_from`` on the evolved power) and by name
+(``evolved_ability_names``, added from the shop before the evolved power is
+owned). ``PowerGraph`` resolves both kinds of link into parent/child edges,
+drops any edge that would close a cycle, and materializes the forest the
+powers tab renders. ``PowerTreeCache`` keeps each user's graph until the
+change log shows that one of their powers changed.
+"""
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from change_log import collection_version
+
+
+class PowerGraph:
+    def __init__(self, powers: List[dict], render: Callable[[dict], dict]):
+        self.powers: Dict[str, dict] = {power["id"]: power for power in powers}
+        self.render = render
+        self.children: Dict[str, List[str]] = {power_id: [] for power_id in self.powers}
+        self.parents: Dict[str, List[str]] = {power_id: [] for power_id in self.powers}
+        # Name links that don't match any power the user owns yet
+        self.pending: Dict[str, List[dict]] = defaultdict(list)
+        # (parent id, child id) links dropped because they closed a cycle
+        self.cycles: List[Tuple[str, str]] = []
+        self._forest: Optional[List[dict]] = None
+
+        by_name: Dict[str, List[str]] = defaultdict(list)
+        for power in powers:
+            by_name[power.get("name")].append(power["id"])
+
+        for power_id, power in self.powers.items():
+            for child_id in power.get("evolved_abilities") or []:
+                self._link(power_id, child_id)
+            for link in power.get("evolved_ability_names") or []:
+                matches = by_name.get(link.get("name"))
+                if not matches:
+                    self.pending[power_id].append(link)
+                for child_id in matches or []:
+                    self._link(power_id, child_id)
+            if power.get("evolved_from"):
+                self._link(power["evolved_from"], power_id)
+        self._break_cycles()
+
+    def _link(self, parent_id: str, child_id: str):
+        if parent_id == child_id or parent_id not in self.powers or child_id not in self.powers:
+            return
+        if child_id not in self.children[parent_id]:
+            self.children[parent_id].append(child_id)
+            self.parents[child_id].append(parent_id)
+
+    def _unlink(self, parent_id: str, child_id: str):
+        self.children[parent_id].remove(child_id)
+        self.parents[child_id].remove(parent_id)
+        self.cycles.append((parent_id, child_id))
+
+    def _break_cycles(self):
+        """Depth-first search from the roots (then anything left), dropping back edges"""
+        visiting, done = set(), set()
+
+        def visit(power_id: str):
+            visiting.add(power_id)
+            for child_id in list(self.children[power_id]):
+                if child_id in visiting:
+                    self._unlink(power_id, child_id)
+                elif child_id not in done:
+                    visit(child_id)
+            visiting.discard(power_id)
+            done.add(power_id)
+
+        roots = [power_id for power_id in self.powers if not self.parents[power_id]]
+        for power_id in roots + list(self.powers):
+            if power_id not in done:
+                visit(power_id)
+
+    def is_maxed(self, power_id: str) -> bool:
+        power = self.powers[power_id]
+        return power.get("current_level", 1) >= power.get("max_level", 5)
+
+    def locked(self, power_id: str) -> bool:
+        """An evolved power can't be levelled until every power it evolves from is maxed"""
+        return any(not self.is_maxed(parent_id) for parent_id in self.parents.get(power_id, []))
+
+    def forest(self) -> List[dict]:
+        """Root powers with their evolutions nested under `children`"""
+        if self._forest is None:
+            self._forest = [self._node(power_id) for power_id in self.powers if not self.parents[power_id]]
+        return self._forest
+
+    def _node(self, power_id: str) -> dict:
+        return {
+            **self.render(self.powers[power_id]),
+            "locked": self.locked(power_id),
+            "children": [self._node(child_id) for child_id in self.children[power_id]],
+            "pending_evolutions": self.pending.get(power_id, []),
+        }
+
+
+class PowerTreeCache:
+    """Per-user evolution graphs, rebuilt when the user's powers change"""
+
+    def __init__(self, db, render: Callable[[dict], dict], max_entries: int = 1024):
+        self.db = db
+        self.render = render
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[int, PowerGraph]]" = OrderedDict()
+
+    async def get(self, user_id: str) -> PowerGraph:
+        # Read the version before the powers, so a concurrent write can only cause a rebuild
+        version = await collection_version(self.db, user_id, "powers")
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+        powers = await self.db.powers.find({"user_id": user_id}).sort("_id", 1).to_list(None)
+        graph = PowerGraph(powers, self.render)
+        self._entries[user_id] = (version, graph)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return graph
@@ -0,0 +1,405 @@
+"""Server-side scheduling of repeating-quest resets and deadline failures.
+
+Every quest carries two instants maintained by the write paths:
+
+- ``next_reset_at``: when a completed daily/weekly/monthly quest becomes
+  available again.
+- ``next_deadline_at``: when the quest's deadline must next be evaluated.
+
+Both fields are indexed, so each scheduler tick only touches quests that are
+actually due instead of walking every quest of every user. The scheduler runs
+as a task in the API's event loop, or standalone with
+``python quest_schedule.py`` when it should live in its own worker process.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from change_log import UPSERT, Change, record_changes
+from events import QUEST_FAILED, QUEST_RESET
+
+
+logger = logging.getLogger(__name__)
+
+REPEATING_FREQUENCIES = ("daily", "weekly", "monthly")
+BUILTIN_ATTRIBUTES = ("strength", "intelligence", "vitality")
+
+# A claimed batch whose worker died is picked up again after this long
+CLAIM_TIMEOUT = timedelta(minutes=5)
+# Undelivered failure notices are dropped after this long; the failures themselves stay on the quests
+FAILURE_NOTICE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+
+def start_of_day(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def reset_due_at(frequency: Optional[str], last_completed: Optional[datetime]) -> Optional[datetime]:
+    """Instant at which a quest completed at `last_completed` resets"""
+    if not last_completed or frequency not in REPEATING_FREQUENCIES:
+        return None
+    if frequency == "daily":
+        # Next midnight UTC
+        return start_of_day(last_completed) + timedelta(days=1)
+    if frequency == "weekly":
+        return last_completed + timedelta(days=7)
+    # Monthly: first day of the next month
+    if last_completed.month == 12:
+        return datetime(last_completed.year + 1, 1, 1)
+    return datetime(last_completed.year, last_completed.month + 1, 1)
+
+
+def parse_deadline(deadline_time: Optional[str]) -> Tuple[int, int]:
+    try:
+        deadline_hour, deadline_minute = map(int, (deadline_time or "00:00").split(":"))
+    except ValueError:
+        deadline_hour, deadline_minute = 0, 0
+    return deadline_hour, deadline_minute
+
+
+def deadline_on(day: datetime, deadline_time: Optional[str]) -> datetime:
+    deadline_hour, deadline_minute = parse_deadline(deadline_time)
+    return day.replace(hour=deadline_hour, minute=deadline_minute, second=0, microsecond=0)
+
+
+def failed_today(quest: dict, now: datetime) -> bool:
+    last_failed = quest.get("last_failed")
+    return bool(last_failed and last_failed >= start_of_day(now))
+
+
+def deadline_missed(quest: dict, now: datetime) -> bool:
+    """Whether the quest has missed today's deadline and should fail now"""
+    # Completed, limitless and deadline-less quests never fail
+    if quest.get("completed"):
+        return False
+    if quest.get("repeat_frequency") == "limitless":
+        return False
+    if not quest.get("has_deadline"):
+        return False
+
+    # Only fail once per day
+    if failed_today(quest, now):
+        return False
+
+    today_deadline = deadline_on(now, quest.get("deadline_time"))
+    if now <= today_deadline:
+        return False
+
+    # Repeating quests fail whenever today's deadline has passed. Non-repeating
+    # quests only fail if they were created before the deadline, so a quest
+    # can't be created with a deadline that has already gone by.
+    if quest.get("repeat_frequency") in REPEATING_FREQUENCIES:
+        return True
+    return quest.get("created_at", now) < today_deadline
+
+
+def next_deadline_check(quest: dict, now: datetime) -> Optional[datetime]:
+    """Next instant at which `deadline_missed` could become true for the quest"""
+    if quest.get("completed") or quest.get("repeat_frequency") == "limitless" or not quest.get("has_deadline"):
+        # Resetting a repeating quest re-arms its deadline
+        return None
+    today_deadline = deadline_on(now, quest.get("deadline_time"))
+    if now <= today_deadline and not failed_today(quest, now):
+        return today_deadline
+    return today_deadline + timedelta(days=1)
+
+
+def schedule_fields(quest: dict, now: datetime) -> dict:
+    """Scheduling fields for a quest that was just created, completed or edited"""
+    next_reset_at = None
+    if quest.get("completed"):
+        next_reset_at = reset_due_at(quest.get("repeat_frequency"), quest.get("last_completed"))
+
+    # Deadlines are evaluated straight away so the scheduler decides, using the
+    # same rules as every later check, whether today's deadline already applies
+    next_deadline_at = None
+    if quest.get("has_deadline") and not quest.get("completed") and quest.get("repeat_frequency") != "limitless":
+        next_deadline_at = now
+
+    return {"next_reset_at": next_reset_at, "next_deadline_at": next_deadline_at}
+
+
+def empty_demerits() -> dict:
+    return {"xp": 0, "gold": 0, "ap": 0, "attributes": {}}
+
+
+def add_demerits(total: dict, quest: dict):
+    total["xp"] += quest.get("xp_reward", 0)
+    total["gold"] += quest.get("gold_reward", 0)
+    total["ap"] += quest.get("ap_reward", 0)
+    for attr, value in (quest.get("attribute_rewards") or {}).items():
+        total["attributes"][attr] = total["attributes"].get(attr, 0) + value
+
+
+def merge_failure_reports(reports: List[dict]) -> dict:
+    """Combine several failure reports into the shape returned by check-failures"""
+    merged = {"failed_quests": [], "total_demerits": empty_demerits()}
+    for report in reports:
+        merged["failed_quests"] += report["failed_quests"]
+        for key in ("xp", "gold", "ap"):
+            merged["total_demerits"][key] += report["total_demerits"][key]
+        for attr, value in report["total_demerits"]["attributes"].items():
+            attributes = merged["total_demerits"]["attributes"]
+            attributes[attr] = attributes.get(attr, 0) + value
+    return merged
+
+
+async def reset_due_quests(db, now: datetime) -> List[dict]:
+    """Make every completed repeating quest whose reset instant has passed available again.
+
+    Returns the `id` and `user_id` of the quests that were due.
+    """
+    due = await db.quests.find({"next_reset_at": {"$lte": now}}, {"_id": 1, "id": 1, "user_id": 1}).to_list(None)
+    if not due:
+        return []
+    due_ids = {"$in": [quest["_id"] for quest in due]}
+
+    # Quests with a deadline get it re-armed for evaluation right away
+    await db.quests.update_many(
+        {"_id": due_ids, "next_reset_at": {"$lte": now}, "has_deadline": True},
+        {"$set": {"completed": False, "next_reset_at": None, "next_deadline_at": now}}
+    )
+    await db.quests.update_many(
+        {"_id": due_ids, "next_reset_at": {"$lte": now}},
+        {"$set": {"completed": False, "next_reset_at": None}}
+    )
+    await record_changes(db, [(quest["user_id"], "quests", quest["id"], UPSERT) for quest in due])
+    return due
+
+
+def floored_decrement(field: str, amount: int) -> dict:
+    """Pipeline `$set` stage body that lowers a field by `amount` without going below zero"""
+    return {field: {"$max": [0, {"$subtract": [{"$ifNull": [f"${field}", 0]}, amount]}]}}
+
+
+async def apply_demerits(db, demerits_by_user: Dict[str, dict]) -> List[Change]:
+    """Subtract accumulated demerits from users and their custom stats.
+
+    Each user and each custom stat is decremented in place by a pipeline
+    update, so the whole pass is one bulk write per collection no matter how
+    many quests failed, and concurrent rewards are never overwritten.
+    Returns the changes to record in the change log.
+    """
+    user_operations = []
+    stat_operations = []
+    stat_filters = []
+    for user_id, total_demerits in demerits_by_user.items():
+        user_operations.append(UpdateOne({"id": user_id}, [{"$set": {
+            **floored_decrement("xp", total_demerits["xp"]),
+            **floored_decrement("gold", total_demerits["gold"]),
+            **floored_decrement("ability_points", total_demerits["ap"]),
+        }}]))
+        # Built-in attributes are not penalised; custom stats are keyed by {user_id, name}
+        for attr, value in total_demerits["attributes"].items():
+            if attr not in BUILTIN_ATTRIBUTES:
+                stat_filters.append({"user_id": user_id, "name": attr})
+                stat_operations.append(UpdateOne(
+                    stat_filters[-1],
+                    [{"$set": floored_decrement("current", value)}]
+                ))
+
+    changes = [(user_id, "users", user_id, UPSERT) for user_id in demerits_by_user]
+    if user_operations:
+        await db.users.bulk_write(user_operations, ordered=False)
+    if stat_operations:
+        await db.custom_stats.bulk_write(stat_operations, ordered=False)
+        stats = await db.custom_stats.find({"$or": stat_filters}, {"id": 1, "user_id": 1}).to_list(None)
+        changes += [(stat["user_id"], "custom_stats", stat["id"], UPSERT) for stat in stats]
+    return changes
+
+
+async def fail_due_quests(db, now: datetime, user_id: Optional[str] = None) -> Dict[str, dict]:
+    """Evaluate every quest whose deadline check is due and fail those that missed it.
+
+    Due quests are first claimed with a token so concurrent schedulers (and the
+    check-failures endpoint) never fail the same quest twice. Returns the
+    failure report of each affected user; the reports are also stored as
+    notices for the user's next check-failures call.
+    """
+    query = {
+        "next_deadline_at": {"$lte": now},
+        "$or": [{"deadline_claim": None}, {"deadline_claim.at": {"$lt": now - CLAIM_TIMEOUT}}],
+    }
+    if user_id:
+        query["user_id"] = user_id
+
+    # Find the due quests through the next_deadline_at index, then claim and read them back by _id
+    due = await db.quests.find(query, {"_id": 1}).to_list(None)
+    if not due:
+        return {}
+    due_ids = {"$in": [quest["_id"] for quest in due]}
+    token = str(uuid.uuid4())
+    claimed = await db.quests.update_many(
+        {**query, "_id": due_ids},
+        {"$set": {"deadline_claim": {"token": token, "at": now}}}
+    )
+    if not claimed.modified_count:
+        return {}
+    quests = await db.quests.find({"_id": due_ids, "deadline_claim.token": token}).to_list(None)
+    if not quests:
+        return {}
+
+    operations = []
+    failing = {}
+    for quest in quests:
+        updates = {}
+        if deadline_missed(quest, now):
+            updates = {"failed": True, "last_failed": now}
+            # Daily quests stay open so they can still be done today
+            if quest.get("repeat_frequency") != "daily":
+                updates["completed"] = True
+                updates["next_reset_at"] = reset_due_at(quest.get("repeat_frequency"), quest.get("last_completed"))
+            failing[quest["_id"]] = quest
+
+        updates["next_deadline_at"] = next_deadline_check({**quest, **updates}, now)
+        # A quest completed since it was read must not be failed (or rescheduled) from the stale copy
+        operations.append(UpdateOne(
+            {"_id": quest["_id"], "deadline_claim.token": token, "completed": {"$ne": True}},
+            {"$set": updates, "$unset": {"deadline_claim": ""}}
+        ))
+
+    await db.quests.bulk_write(operations, ordered=False)
+    # Claims still held belong to quests completed since they were read. Completed
+    # quests have no deadline check, so clear it too or they would be claimed again
+    unmatched = {
+        quest["_id"]
+        for quest in await db.quests.find({"_id": due_ids, "deadline_claim.token": token}, {"_id": 1}).to_list(None)
+    }
+    if unmatched:
+        await db.quests.update_many(
+            {"_id": {"$in": list(unmatched)}, "deadline_claim.token": token},
+            {"$set": {"next_deadline_at": None}, "$unset": {"deadline_claim": ""}}
+        )
+    # Their completion recorded its own change
+    changes = [(quest["user_id"], "quests", quest["id"], UPSERT) for quest in quests if quest["_id"] not in unmatched]
+
+    # Only the quests whose failure was actually written cost demerits
+    if failing:
+        failed = await db.quests.find({"_id": {"$in": list(failing)}, "last_failed": now}, {"_id": 1}).to_list(None)
+        failing = {quest["_id"]: failing[quest["_id"]] for quest in failed}
+    reports: Dict[str, dict] = {}
+    for quest in failing.values():
+        report = reports.setdefault(quest["user_id"], {"failed_quests": [], "total_demerits": empty_demerits()})
+        add_demerits(report["total_demerits"], quest)
+        report["failed_quests"].append({
+            "id": quest["id"],
+            "title": quest["title"],
+            "xp_demerit": quest.get("xp_reward", 0),
+            "gold_demerit": quest.get("gold_reward", 0),
+            "ap_demerit": quest.get("ap_reward", 0),
+            "attribute_demerits": quest.get("attribute_rewards", {})
+        })
+
+    if reports:
+        changes += await apply_demerits(db, {
+            failed_user_id: report["total_demerits"] for failed_user_id, report in reports.items()
+        })
+        await db.quest_failure_notices.insert_many([
+            {"id": str(uuid.uuid4()), "user_id": failed_user_id, "created_at": now, **report}
+            for failed_user_id, report in reports.items()
+        ])
+    await record_changes(db, changes)
+    return reports
+
+
+async def publish_schedule_events(events, reset_quests: List[dict], reports: Dict[str, dict]):
+    """Push quest_reset and quest_failed events for a scheduler pass"""
+    reset_ids: Dict[str, List[str]] = {}
+    for quest in reset_quests:
+        reset_ids.setdefault(quest["user_id"], []).append(quest["id"])
+    for user_id, quest_ids in reset_ids.items():
+        await events.publish(user_id, QUEST_RESET, {"quest_ids": quest_ids})
+    for user_id, report in reports.items():
+        await events.publish(user_id, QUEST_FAILED, report)
+
+
+async def drain_failure_notices(db, user_id: str) -> dict:
+    """Pop every undelivered failure notice of a user, merged into one report"""
+    notices = await db.quest_failure_notices.find({"user_id": user_id}).to_list(None)
+    if notices:
+        await db.quest_failure_notices.delete_many({"_id": {"$in": [notice["_id"] for notice in notices]}})
+    return merge_failure_reports(notices)
+
+
+async def backfill_schedule(db, now: datetime):
+    """Give quests created before scheduling existed their scheduling fields"""
+    # Deadlines are simply evaluated on the next tick, which reschedules them
+    await db.quests.update_many(
+        {"next_deadline_at": {"$exists": False}, "has_deadline": True, "completed": {"$ne": True}},
+        {"$set": {"next_deadline_at": now}}
+    )
+    await db.quests.update_many({"next_deadline_at": {"$exists": False}}, {"$set": {"next_deadline_at": None}})
+
+    operations = []
+    async for quest in db.quests.find(
+        {"next_reset_at": {"$exists": False}},
+        {"_id": 1, "completed": 1, "repeat_frequency": 1, "last_completed": 1}
+    ):
+        next_reset_at = None
+        if quest.get("completed"):
+            next_reset_at = reset_due_at(quest.get("repeat_frequency"), quest.get("last_completed"))
+        operations.append(UpdateOne({"_id": quest["_id"]}, {"$set": {"next_reset_at": next_reset_at}}))
+    if operations:
+        await db.quests.bulk_write(operations, ordered=False)
+
+
+class QuestScheduler:
+    """Periodically resets due repeating quests and fails quests past their deadline"""
+
+    def __init__(self, db, interval: float = 30.0, events=None):
+        self.db = db
+        self.interval = interval
+        self.events = events
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self, now: Optional[datetime] = None):
+        now = now or datetime.utcnow()
+        resets = await reset_due_quests(self.db, now)
+        reports = await fail_due_quests(self.db, now)
+        if resets or reports:
+            failures = sum(len(report["failed_quests"]) for report in reports.values())
+            logger.info("Quest scheduler: %d resets, %d failures", len(resets), failures)
+            if self.events is not None:
+                await publish_schedule_events(self.events, resets, reports)
+
+    async def run_forever(self):
+        await backfill_schedule(self.db, datetime.utcnow())
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Quest scheduler tick failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    worker_db = AsyncIOMotorClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']]
+    interval = float(os.environ.get('QUEST_SCHEDULER_INTERVAL', '30'))
+    asyncio.run(QuestScheduler(worker_db, interval).run_forever())
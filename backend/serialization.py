@@ -0,0 +1,56 @@
+"""Fast JSON rendering of documents read back from MongoDB.
+
+Documents in the game collections were validated by their Pydantic model on
+the way in, so read paths don't need to validate them again. ``DocumentEncoder``
+trims a raw document to its model's fields (filling defaults for fields
+added after the document was written) and ``json_response`` renders the
+result with orjson, skipping both ``Model(**doc)`` and FastAPI's
+``response_model`` pass over the same data.
+"""
+from typing import Dict, Iterable, List, Optional, Type
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+
+class DocumentEncoder:
+    def __init__(self, model: Type[BaseModel]):
+        self.model = model
+        self.defaults: Dict[str, object] = {}
+        self.factories: Dict[str, object] = {}
+        for name, field in model.model_fields.items():
+            if field.default_factory is not None:
+                self.factories[name] = field.default_factory
+            elif field.is_required():
+                self.defaults[name] = None
+            else:
+                self.defaults[name] = field.default
+        self.names = list(model.model_fields)
+
+    def row(self, doc: dict, names: Optional[List[str]] = None) -> dict:
+        """The document as the model would serialize it, limited to `names` if given"""
+        row = {}
+        for name in names or self.names:
+            if name in doc:
+                row[name] = doc[name]
+            elif name in self.factories:
+                row[name] = self.factories[name]()
+            else:
+                row[name] = self.defaults[name]
+        return row
+
+    def rows(self, docs: Iterable[dict], names: Optional[List[str]] = None) -> List[dict]:
+        return [self.row(doc, names) for doc in docs]
+
+
+def loads(data: bytes):
+    return orjson.loads(data)
+
+
+def dumps(content, sort_keys: bool = False) -> bytes:
+    return orjson.dumps(content, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+
+
+def json_response(content, headers: Optional[dict] = None, status_code: int = 200) -> Response:
+    return Response(content=dumps(content), media_type="application/json", headers=headers, status_code=status_code)
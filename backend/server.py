@@ -1,26 +1,112 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, ValidationError
+from typing import Dict, List, Optional, Tuple, Type
+from bson import ObjectId
+from bson.errors import InvalidId
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
 import uuid
 from datetime import datetime
 
+from catalog_cache import CatalogCache
+from change_log import (
+    DELETE,
+    UPSERT,
+    ResyncRequired,
+    changes_since,
+    current_version,
+    record_changes,
+    record_deletes,
+    record_upserts,
+)
+from events import INVENTORY_CHANGED, LEVEL_UP, POWER_EVOLVED, EventBus
+from idempotency import REPLAYED_HEADER, IdempotencyStore
+from image_store import ImageStore, THUMBNAIL_SIZES, DEFAULT_THUMBNAIL_SIZE
+from indexes import ensure_indexes, index_report
+from leveling import custom_stat_level_up, level_up, total_xp_for_level
+from metrics import Metrics, MetricsMiddleware, MongoCommandMetrics
+from mongo_pool import PoolStats, create_client, pool_options
+from power_facets import PowerFacetCache
+from power_tree import PowerTreeCache
+from quest_schedule import (
+    BUILTIN_ATTRIBUTES,
+    REPEATING_FREQUENCIES,
+    QuestScheduler,
+    drain_failure_notices,
+    fail_due_quests,
+    publish_schedule_events,
+    reset_due_at,
+    schedule_fields,
+)
+from serialization import DocumentEncoder, dumps, json_response, loads
+from shop_refs import REFERENCES, edited_collections, frozen_updates, hydrate, referenced_ids, slim
+from shop_search import (
+    RELEVANCE,
+    SEARCH_PAGE_SIZE_DEFAULT,
+    SORTS,
+    decode_cursor,
+    encode_cursor,
+    search_filter,
+    sort_keys,
+)
+from synthesis import RecipeIndexCache, ingredient_totals
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# Request, MongoDB command and connection pool metrics, served at /metrics
+metrics = Metrics(slow_request_ms=float(os.environ.get('SLOW_REQUEST_MS', '500')))
+pool_stats = PoolStats()
+metrics.collectors.append(pool_stats.lines)
+
+# MongoDB connection; pool settings come from MONGO_* variables (see mongo_pool.py)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = create_client(mongo_url, os.environ, event_listeners=[MongoCommandMetrics(metrics), pool_stats])
 db = client[os.environ['DB_NAME']]
+image_store = ImageStore(db.images)
+catalog_cache = CatalogCache(
+    db,
+    invalidation=os.environ.get('SHOP_CACHE_INVALIDATION', 'auto'),
+    poll_interval=float(os.environ.get('SHOP_CACHE_POLL_INTERVAL', '2'))
+)
+power_facets = PowerFacetCache(db)
+idempotency = IdempotencyStore(db)
+event_bus = EventBus()
+quest_scheduler = QuestScheduler(db, interval=float(os.environ.get('QUEST_SCHEDULER_INTERVAL', '30')), events=event_bus)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("MongoDB pool options for worker %d: %s", os.getpid(), pool_options(os.environ) or "driver defaults")
+    # The client connects lazily; open the pool here so a bad URL fails the boot, not the first request
+    await client.admin.command("ping")
+    # Before the indexes, which include the unique (user_id, item_id) one on inventory
+    await migrate_inventory_stacks()
+    await migrate_custom_stat_names()
+    await ensure_indexes(db)
+    await migrate_inline_shop_images()
+    catalog_cache.start()
+    # Set QUEST_SCHEDULER_ENABLED=false when the scheduler runs as its own worker
+    if os.environ.get('QUEST_SCHEDULER_ENABLED', 'true').lower() != 'false':
+        quest_scheduler.start()
+    try:
+        yield
+    finally:
+        await quest_scheduler.stop()
+        await catalog_cache.stop()
+        client.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -67,6 +153,8 @@ class Quest(BaseModel):
     deadline_time: str = "00:00"  # Time of day for deadline (HH:MM format)
     last_completed: Optional[datetime] = None
     last_failed: Optional[datetime] = None  # Track when quest was last failed
+    next_reset_at: Optional[datetime] = None  # When a completed repeating quest becomes available again
+    next_deadline_at: Optional[datetime] = None  # When the scheduler next checks the deadline
     created_at: datetime = Field(default_factory=datetime.utcnow)
     completed_at: Optional[datetime] = None
 
@@ -91,7 +179,9 @@ class ShopItem(BaseModel):
     price: int
     stock: Optional[int] = None
     category: str = "general"  # Category for filtering
-    images: Optional[List[str]] = None  # List of Base64 encoded images (supports multiple GIF/PNG)
+    image_ids: Optional[List[str]] = None  # Content hashes of the item's images in the image store
+    images: Optional[List[str]] = None  # URLs of the full-size images (never stored on the document)
+    thumbnail: Optional[str] = None  # URL of a server-generated thumbnail of the first image
     is_power: bool = False  # Whether this item appears in Powers tab
     power_category: Optional[str] = None  # Category in Powers tab (e.g., "Physical Abilities")
     power_subcategory: Optional[str] = None  # Subcategory in Powers tab (e.g., "Strength", "Speed")
@@ -112,7 +202,7 @@ class ShopItemCreate(BaseModel):
     price: int
     stock: Optional[int] = None
     category: str = "general"
-    images: Optional[List[str]] = None
+    images: Optional[List[str]] = None  # Base64 data URIs for new uploads, or image URLs/hashes to keep
     is_power: bool = False
     power_category: Optional[str] = None
     power_subcategory: Optional[str] = None
@@ -141,6 +231,7 @@ class InventoryItem(BaseModel):
     gold_amount: Optional[int] = None
     ap_amount: Optional[int] = None
     is_synthesis_material: Optional[bool] = False
+    quantity: int = 1  # Identical items stack into one row per (user_id, item_id)
     acquired_at: datetime = Field(default_factory=datetime.utcnow)
 
 class PurchaseRequest(BaseModel):
@@ -188,10 +279,40 @@ class CustomStatCreate(BaseModel):
     level: Optional[int] = 1
     icon: Optional[str] = None
 
+class RecipeIngredient(BaseModel):
+    item_id: str  # Shop item id of a synthesis material
+    quantity: int = Field(1, ge=1)
+
+class Recipe(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    ingredients: List[RecipeIngredient]
+    result_item_id: str  # Shop item id of what the recipe makes
+    result_quantity: int = 1
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class RecipeCreate(BaseModel):
+    name: Optional[str] = None  # Defaults to the result item's name
+    ingredients: List[RecipeIngredient]
+    result_item_id: str
+    result_quantity: int = Field(1, ge=1)
+
+class CraftRequest(BaseModel):
+    user_id: str
+    recipe_id: str
+    times: int = Field(1, ge=1)
+
+
+# Read paths render stored documents directly instead of re-validating them
+user_encoder = DocumentEncoder(User)
+quest_encoder = DocumentEncoder(Quest)
+inventory_encoder = DocumentEncoder(InventoryItem)
+power_encoder = DocumentEncoder(PowerItem)
+custom_stat_encoder = DocumentEncoder(CustomStat)
+recipe_encoder = DocumentEncoder(Recipe)
+power_trees = PowerTreeCache(db, power_encoder.row)
+recipe_index = RecipeIndexCache(db)
 
-# Helper function to calculate XP needed for next level
-def xp_for_level(level: int) -> int:
-    return level * 100
 
 # Helper function to calculate quest rewards based on difficulty
 def calculate_rewards(difficulty: str) -> tuple:
@@ -203,6 +324,63 @@ def calculate_rewards(difficulty: str) -> tuple:
     return rewards.get(difficulty.lower(), (50, 10))
 
 
+# Pagination helpers for list endpoints
+# Pages are keyed on Mongo's _id so results keep their insertion order and
+# each page is an index range scan instead of a skip over earlier documents.
+PAGE_SIZE_DEFAULT = 1000
+PAGE_SIZE_MAX = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[List[str]]:
+    """Parse a comma separated `fields=` query parameter into a list of model field names"""
+    if fields is None:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in model.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    if "id" not in names:
+        names.insert(0, "id")
+    return names
+
+def field_projection(names: Optional[List[str]], *required: str) -> Optional[dict]:
+    """Mongo projection for the requested fields plus any the endpoint itself needs"""
+    if names is None:
+        return None
+    return {name: 1 for name in [*names, *required]}
+
+async def fetch_page(collection, query: dict, after: Optional[str], limit: int, projection: Optional[dict] = None) -> Tuple[List[dict], Optional[str]]:
+    """Fetch up to `limit` documents after the `after` cursor, plus the cursor of the next page"""
+    if after:
+        try:
+            query = {**query, "_id": {"$gt": ObjectId(after)}}
+        except (InvalidId, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    # Read one extra document to learn whether another page exists
+    docs = await collection.find(query, projection).sort("_id", 1).limit(limit + 1).to_list(limit + 1)
+    next_cursor = str(docs[limit - 1]["_id"]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+async def hydrate_rows(collection: str, docs: List[dict]) -> List[dict]:
+    """Fill in the shop item fields that inventory and power rows reference instead of copying"""
+    if collection not in REFERENCES or not docs:
+        return docs
+    items = await catalog_cache.items(referenced_ids(collection, docs))
+    return hydrate(collection, docs, items)
+
+async def slim_rows(collection: str, docs: List[dict]) -> List[dict]:
+    """New inventory or power rows, without the fields their shop item already holds"""
+    items = await catalog_cache.items(referenced_ids(collection, docs))
+    reference = REFERENCES[collection][0]
+    return [slim(collection, doc) if items.get(doc.get(reference)) else doc for doc in docs]
+
+def page_response(docs: List[dict], encoder: DocumentEncoder, next_cursor: Optional[str], fields: Optional[List[str]]) -> Response:
+    """Render a page of documents, trimmed to `fields` when a projection was requested"""
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return json_response(encoder.rows(docs, fields), headers)
+
+
 # User endpoints
 @api_router.post("/users", response_model=User)
 async def create_user(user: UserCreate):
@@ -211,8 +389,9 @@ async def create_user(user: UserCreate):
     if existing:
         return User(**existing)
     
-    user_obj = User(**user.dict())
-    await db.users.insert_one(user_obj.dict())
+    user_obj = User(**user.model_dump())
+    await db.users.insert_one(user_obj.model_dump())
+    await record_upserts(db, user_obj.id, "users", [user_obj.id])
     return user_obj
 
 @api_router.get("/users/{user_id}", response_model=User)
@@ -252,6 +431,7 @@ async def reset_user_stats(user_id: str):
             "title": "Novice"
         }}
     )
+    await record_upserts(db, user_id, "users", [user_id])
     
     updated_user = await db.users.find_one({"id": user_id})
     return {"message": "User stats reset to default", "user": User(**updated_user)}
@@ -287,6 +467,7 @@ async def update_user_status(user_id: str, status: UserStatusUpdate):
     
     if update_fields:
         await db.users.update_one({"id": user_id}, {"$set": update_fields})
+        await record_upserts(db, user_id, "users", [user_id])
     
     updated_user = await db.users.find_one({"id": user_id})
     return User(**updated_user)
@@ -295,7 +476,7 @@ async def update_user_status(user_id: str, status: UserStatusUpdate):
 # Quest endpoints
 @api_router.post("/quests", response_model=Quest)
 async def create_quest(quest: QuestCreate):
-    quest_dict = quest.dict()
+    quest_dict = quest.model_dump()
     
     # If rewards not specified, calculate based on difficulty
     if quest_dict.get("xp_reward") is None and quest_dict.get("difficulty"):
@@ -313,308 +494,397 @@ async def create_quest(quest: QuestCreate):
     if not quest_dict.get("difficulty"):
         quest_dict["difficulty"] = "custom"
     
+    quest_dict.update(schedule_fields(quest_dict, datetime.utcnow()))
     quest_obj = Quest(**quest_dict)
-    await db.quests.insert_one(quest_obj.dict())
+    await db.quests.insert_one(quest_obj.model_dump())
+    await record_upserts(db, quest_obj.user_id, "quests", [quest_obj.id])
     return quest_obj
 
 @api_router.get("/quests/{user_id}", response_model=List[Quest])
-async def get_user_quests(user_id: str):
-    quests = await db.quests.find({"user_id": user_id}).to_list(1000)
-    
-    # Check and reset repeating quests that are due
-    now = datetime.utcnow()
-    for quest in quests:
-        if quest.get("completed") and quest.get("repeat_frequency") not in ["none", "limitless", None]:
-            last_completed = quest.get("last_completed")
-            if last_completed:
-                # Calculate if reset is due based on frequency
-                should_reset = False
-                frequency = quest.get("repeat_frequency")
-                
-                if frequency == "daily":
-                    # Reset if last completed was before today (midnight UTC)
-                    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-                    should_reset = last_completed < today_start
-                elif frequency == "weekly":
-                    # Reset if last completed was more than 7 days ago
-                    days_since = (now - last_completed).days
-                    should_reset = days_since >= 7
-                elif frequency == "monthly":
-                    # Reset if last completed was in a different month
-                    should_reset = (last_completed.year != now.year or last_completed.month != now.month)
-                
-                if should_reset:
-                    # Reset the quest
-                    await db.quests.update_one(
-                        {"id": quest["id"]},
-                        {"$set": {"completed": False}}
-                    )
-                    quest["completed"] = False
-    
-    return [Quest(**quest) for quest in quests]
+async def get_user_quests(
+    user_id: str,
+    after: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    fields: Optional[str] = None,
+):
+    # Resets of repeating quests are applied by the quest scheduler, so this is a pure read
+    field_names = parse_fields(fields, Quest)
+    quests, next_cursor = await fetch_page(db.quests, {"user_id": user_id}, after, limit, field_projection(field_names))
+    return page_response(quests, quest_encoder, next_cursor, field_names)
 
 @api_router.post("/quests/{user_id}/check-failures")
 async def check_quest_failures(user_id: str):
-    """Check for quests that have missed their deadline and apply demerits"""
-    now = datetime.utcnow()
-    quests = await db.quests.find({"user_id": user_id}).to_list(1000)
-    
-    failed_quests = []
-    total_demerits = {
-        "xp": 0,
-        "gold": 0,
-        "ap": 0,
-        "attributes": {}
-    }
-    
-    for quest in quests:
-        # Skip if quest is already completed or already failed today
-        if quest.get("completed"):
-            continue
-        
-        # Skip limitless quests
-        if quest.get("repeat_frequency") == "limitless":
-            continue
+    """Report quests that have missed their deadline and the demerits applied.
+    
+    Failures are normally applied by the quest scheduler; this also processes
+    any of the user's quests that are due but not yet picked up, then returns
+    every failure the user hasn't been told about yet.
+    """
+    reports = await fail_due_quests(db, datetime.utcnow(), user_id)
+    await publish_schedule_events(event_bus, [], reports)
+    return await drain_failure_notices(db, user_id)
+
+def incremented(field: str, amount: int, default: int = 0) -> dict:
+    """Aggregation expression for `field + amount`, treating a missing field as `default`"""
+    return {"$add": [{"$ifNull": [f"${field}", default]}, amount]}
+
+async def apply_user_level_ups(user: dict, ap_per_level: int, gold_per_level: int = 0) -> Tuple[dict, int]:
+    """Level the user up for any XP above their threshold, granting per-level rewards.
+    
+    The level-up is a conditional $inc on the level and XP that were read, so
+    rewards landing concurrently from another device are never lost or
+    counted twice: if the user changed in between, recompute and try again.
+    Returns the updated user and the number of levels gained.
+    """
+    total_gained = 0
+    while True:
+        new_level, _, levels_gained = level_up(user["level"], user.get("xp", 0))
+        if levels_gained == 0:
+            return user, total_gained
+        xp_consumed = total_xp_for_level(new_level) - total_xp_for_level(user["level"])
         
-        # Skip quests without deadlines
-        if not quest.get("has_deadline"):
-            continue
-        
-        # Check if deadline has passed
-        deadline_time_str = quest.get("deadline_time", "00:00")
-        try:
-            deadline_hour, deadline_minute = map(int, deadline_time_str.split(":"))
-        except:
-            deadline_hour, deadline_minute = 0, 0
-        
-        # Determine if the quest deadline has passed
-        today_deadline = now.replace(hour=deadline_hour, minute=deadline_minute, second=0, microsecond=0)
-        
-        # For daily quests, check if we've passed today's deadline
-        # For non-repeating quests, check if we've passed the deadline after creation
-        quest_created = quest.get("created_at", now)
-        last_failed = quest.get("last_failed")
+        # Increase HP and MP on level up (HP +10, MP +5 per level) and fully restore them
+        updated = await db.users.find_one_and_update(
+            {"id": user["id"], "level": user["level"], "xp": {"$gte": xp_consumed}},
+            [{"$set": {
+                "level": new_level,
+                "xp": incremented("xp", -xp_consumed),
+                "gold": incremented("gold", gold_per_level * levels_gained),
+                "ability_points": incremented("ability_points", ap_per_level * levels_gained),
+                "max_hp": incremented("max_hp", 10 * levels_gained, 100),
+                "hp": incremented("max_hp", 10 * levels_gained, 100),
+                "max_mp": incremented("max_mp", 5 * levels_gained, 50),
+                "mp": incremented("max_mp", 5 * levels_gained, 50),
+            }}],
+            return_document=ReturnDocument.AFTER
+        )
+        if updated:
+            return updated, total_gained + levels_gained
         
-        # Skip if already failed today
-        if last_failed:
-            today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            if last_failed >= today_start:
+        user = await db.users.find_one({"id": user["id"]})
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+async def publish_level_up(user: dict, old_level: int, levels_gained: int):
+    if levels_gained > 0:
+        await event_bus.publish(user["id"], LEVEL_UP, {
+            "old_level": old_level,
+            "new_level": user["level"],
+            "levels_gained": levels_gained,
+        })
+
+async def grant_custom_stat_rewards(user_id: str, rewards: dict) -> List[str]:
+    """Add attribute rewards to the user's custom stats and level them up.
+    
+    Values are added with one $inc bulk write; level-ups are then applied as
+    conditional updates on the values read back, retrying any stat that was
+    changed concurrently. Returns the ids of the rewarded stats.
+    """
+    if not rewards:
+        return []
+    await db.custom_stats.bulk_write([
+        UpdateOne({"user_id": user_id, "name": name}, {"$inc": {"current": value}})
+        for name, value in rewards.items()
+    ], ordered=False)
+    
+    names = list(rewards)
+    stat_ids = set()
+    while names:
+        stats = await db.custom_stats.find(
+            {"user_id": user_id, "name": {"$in": names}},
+            {"_id": 1, "id": 1, "name": 1, "current": 1, "max": 1, "level": 1}
+        ).to_list(None)
+        stat_ids.update(stat["id"] for stat in stats)
+        operations = []
+        for stat in stats:
+            current, max_value, level = stat.get("current", 0), stat.get("max", 100), stat.get("level", 1)
+            new_current, new_max, new_level = custom_stat_level_up(current, max_value, level)
+            if new_level == level:
                 continue
-        
-        should_fail = False
-        
-        if quest.get("repeat_frequency") == "daily":
-            # Daily quest: fail if we've passed today's deadline and not completed
-            if now > today_deadline:
-                should_fail = True
-        elif quest.get("repeat_frequency") in ["weekly", "monthly"]:
-            # Weekly/monthly: fail if we've passed today's deadline
-            if now > today_deadline:
-                should_fail = True
-        else:
-            # Non-repeating quest: fail if deadline passed since creation
-            # Only fail if the quest was created before today's deadline
-            if quest_created < today_deadline and now > today_deadline:
-                should_fail = True
-        
-        if should_fail:
-            # Mark quest as failed
-            fail_updates = {
-                "failed": True,
-                "last_failed": now
-            }
-            
-            # For daily quests, don't delete, just mark failed
-            if quest.get("repeat_frequency") != "daily":
-                fail_updates["completed"] = True  # Mark as done (failed)
-            
-            await db.quests.update_one(
-                {"id": quest["id"]},
-                {"$set": fail_updates}
-            )
-            
-            # Calculate demerits
-            total_demerits["xp"] += quest.get("xp_reward", 0)
-            total_demerits["gold"] += quest.get("gold_reward", 0)
-            total_demerits["ap"] += quest.get("ap_reward", 0)
-            
-            if quest.get("attribute_rewards"):
-                for attr, value in quest["attribute_rewards"].items():
-                    if attr in total_demerits["attributes"]:
-                        total_demerits["attributes"][attr] += value
-                    else:
-                        total_demerits["attributes"][attr] = value
-            
-            failed_quests.append({
-                "id": quest["id"],
-                "title": quest["title"],
-                "xp_demerit": quest.get("xp_reward", 0),
-                "gold_demerit": quest.get("gold_reward", 0),
-                "ap_demerit": quest.get("ap_reward", 0),
-                "attribute_demerits": quest.get("attribute_rewards", {})
-            })
-    
-    # Apply demerits to user
-    if failed_quests:
-        user = await db.users.find_one({"id": user_id})
-        if user:
-            new_xp = max(0, user.get("xp", 0) - total_demerits["xp"])
-            new_gold = max(0, user.get("gold", 0) - total_demerits["gold"])
-            new_ap = max(0, user.get("ability_points", 0) - total_demerits["ap"])
-            
-            updates = {
-                "xp": new_xp,
-                "gold": new_gold,
-                "ability_points": new_ap
-            }
-            
-            await db.users.update_one({"id": user_id}, {"$set": updates})
-            
-            # Apply attribute demerits to custom stats
-            for attr, value in total_demerits["attributes"].items():
-                if attr not in ["strength", "intelligence", "vitality"]:
-                    custom_stat = await db.custom_stats.find_one({
-                        "user_id": user_id,
-                        "name": attr
-                    })
-                    if custom_stat:
-                        new_current = max(0, custom_stat.get("current", 0) - value)
-                        await db.custom_stats.update_one(
-                            {"id": custom_stat["id"]},
-                            {"$set": {"current": new_current}}
-                        )
-    
-    return {
-        "failed_quests": failed_quests,
-        "total_demerits": total_demerits
+            operations.append(UpdateOne(
+                {"_id": stat["_id"], "current": current, "max": max_value, "level": level},
+                {"$set": {"current": new_current, "max": new_max, "level": new_level}}
+            ))
+        if not operations:
+            break
+        result = await db.custom_stats.bulk_write(operations, ordered=False)
+        if result.matched_count == len(operations):
+            break
+        # Some stats changed under us; re-read those that still need levelling
+        names = [stat["name"] for stat in stats]
+    return list(stat_ids)
+
+# Open quests can be completed, and limitless quests can be completed again and again
+COMPLETABLE_QUEST = {"$or": [{"completed": False}, {"repeat_frequency": "limitless"}]}
+
+def quest_completion_update(now: datetime, **extra) -> list:
+    """Pipeline update marking a quest completed; limitless quests stay open"""
+    return [{"$set": {
+        "completed": {"$ne": ["$repeat_frequency", "limitless"]},
+        "completed_at": now,
+        "last_completed": now,
+        # Completed and limitless quests have no deadline; a reset schedules the next check
+        "next_deadline_at": None,
+        "next_reset_at": {"$switch": {
+            "branches": [
+                {"case": {"$eq": ["$repeat_frequency", frequency]}, "then": reset_due_at(frequency, now)}
+                for frequency in REPEATING_FREQUENCIES
+            ],
+            "default": None
+        }},
+        **extra
+    }}]
+
+def quest_rewards(quests: List[dict]) -> dict:
+    """Sum the XP, gold, AP and attribute rewards of the given quests"""
+    totals = {"xp": 0, "gold": 0, "ap": 0, "attributes": {}}
+    for quest in quests:
+        totals["xp"] += quest["xp_reward"]
+        totals["gold"] += quest["gold_reward"]
+        totals["ap"] += quest.get("ap_reward", 0)
+        for attr, value in (quest.get("attribute_rewards") or {}).items():
+            totals["attributes"][attr] = totals["attributes"].get(attr, 0) + value
+    return totals
+
+async def grant_quest_rewards(user_id: str, rewards: dict) -> dict:
+    """Add summed quest rewards to the user in place and return the updated user.
+    
+    Completing quests also restores HP and MP to their maximum. Level-ups are
+    left to apply_user_level_ups.
+    """
+    user_rewards = {
+        "xp": incremented("xp", rewards["xp"]),
+        "gold": incremented("gold", rewards["gold"]),
+        "ability_points": incremented("ability_points", rewards["ap"], 5),
+        "hp": {"$ifNull": ["$max_hp", 100]},
+        "mp": {"$ifNull": ["$max_mp", 50]},
     }
-
-@api_router.post("/quests/{quest_id}/complete")
-async def complete_quest(quest_id: str):
-    quest = await db.quests.find_one({"id": quest_id})
-    if not quest:
-        raise HTTPException(status_code=404, detail="Quest not found")
+    for attr, value in rewards["attributes"].items():
+        if attr in BUILTIN_ATTRIBUTES:
+            user_rewards[attr] = incremented(attr, value, 10)
     
-    # For limitless quests, allow re-completion. For others, check if already completed
-    if quest["completed"] and quest.get("repeat_frequency") != "limitless":
-        raise HTTPException(status_code=400, detail="Quest already completed")
-    
-    # Update quest - For limitless quests, keep completed as False so it can be done again
-    is_limitless = quest.get("repeat_frequency") == "limitless"
-    await db.quests.update_one(
-        {"id": quest_id},
-        {"$set": {
-            "completed": False if is_limitless else True, 
-            "completed_at": datetime.utcnow(),
-            "last_completed": datetime.utcnow()
-        }}
+    user = await db.users.find_one_and_update(
+        {"id": user_id},
+        [{"$set": user_rewards}],
+        return_document=ReturnDocument.AFTER
     )
-    
-    # Update user XP, gold, and AP
-    user = await db.users.find_one({"id": quest["user_id"]})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+def custom_stat_rewards(rewards: dict) -> dict:
+    return {attr: value for attr, value in rewards["attributes"].items() if attr not in BUILTIN_ATTRIBUTES}
+
+# Quest reward items have no shop item; their item_id is derived from the name so they stack
+QUEST_REWARD_NAMESPACE = uuid.UUID("0b7d4d3e-5f1c-4e0a-9a57-3c2f6f1d8a42")
+
+def quest_reward_item_id(name: str) -> str:
+    return str(uuid.uuid5(QUEST_REWARD_NAMESPACE, name))
+
+def quest_reward_item(quest: dict) -> InventoryItem:
+    """Custom inventory item granted by a quest's item reward"""
+    return InventoryItem(
+        user_id=quest["user_id"],
+        item_id=quest_reward_item_id(quest["item_reward"]),
+        item_name=quest["item_reward"],
+        item_description="Quest reward item",
+        item_type="quest_reward",
+        stat_boost=quest.get("attribute_rewards")
+    )
+
+async def add_to_inventory(user_id: str, items: List[dict]) -> List[str]:
+    """Add items to the user's stacks, creating rows for new item_ids. Returns the stack row ids.
+    
+    Each stack is an upsert that $inc's the quantity and only writes the rest
+    of the item on insert. A single stack (the usual purchase or reward) is
+    one find_one_and_update; several are one bulk write plus a read of the ids.
+    """
+    stacks = {}
+    for item in items:
+        stack = stacks.setdefault(item["item_id"], {**item, "quantity": 0})
+        stack["quantity"] += item.get("quantity", 1)
+    
+    def upsert(stack: dict) -> Tuple[dict, dict]:
+        fields = {key: value for key, value in stack.items() if key not in ("user_id", "item_id", "quantity")}
+        return {"user_id": user_id, "item_id": stack["item_id"]}, {"$inc": {"quantity": stack["quantity"]}, "$setOnInsert": fields}
+    
+    if len(stacks) == 1:
+        row = await db.inventory.find_one_and_update(
+            *upsert(next(iter(stacks.values()))),
+            projection={"id": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return [row["id"]]
     
-    new_xp = user["xp"] + quest["xp_reward"]
-    new_gold = user["gold"] + quest["gold_reward"]
-    new_level = user["level"]
-    new_ability_points = user.get("ability_points", 5) + quest.get("ap_reward", 0)
-    
-    # Check for level up
-    levels_gained = 0
-    while new_xp >= xp_for_level(new_level):
-        new_xp -= xp_for_level(new_level)
-        new_level += 1
-        levels_gained += 1
-    
-    # Give 2 ability points per level gained
-    new_ability_points += levels_gained * 2
-    
-    # Increase HP and MP on level up (HP +10, MP +5 per level)
-    new_max_hp = user.get("max_hp", 100) + (levels_gained * 10)
-    new_max_mp = user.get("max_mp", 50) + (levels_gained * 5)
-    new_hp = new_max_hp  # Fully restore HP on level up
-    new_mp = new_max_mp  # Fully restore MP on level up
-    
-    updates = {
-        "xp": new_xp, 
-        "gold": new_gold, 
-        "level": new_level, 
-        "ability_points": new_ability_points,
-        "hp": new_hp,
-        "max_hp": new_max_hp,
-        "mp": new_mp,
-        "max_mp": new_max_mp
-    }
-    
-    # Apply attribute rewards if specified
-    if quest.get("attribute_rewards"):
-        for attr, value in quest["attribute_rewards"].items():
-            if attr in ["strength", "intelligence", "vitality"]:
-                # Built-in attributes go to user document
-                updates[attr] = user.get(attr, 10) + value
-            else:
-                # Custom stats - update in custom_stats collection with leveling system
-                custom_stat = await db.custom_stats.find_one({
-                    "user_id": quest["user_id"],
-                    "name": attr
-                })
-                if custom_stat:
-                    current_value = custom_stat.get("current", 0)
-                    max_value = custom_stat.get("max", 100)
-                    current_level = custom_stat.get("level", 1)
-                    
-                    # Add the reward value
-                    new_current = current_value + value
-                    new_level = current_level
-                    
-                    # Check for level ups (like XP system)
-                    while new_current >= max_value:
-                        new_current -= max_value
-                        new_level += 1
-                        # Optionally increase max for next level (scaling)
-                        max_value = int(max_value * 1.1)  # 10% increase per level
-                    
-                    await db.custom_stats.update_one(
-                        {"id": custom_stat["id"]},
-                        {"$set": {
-                            "current": new_current,
-                            "level": new_level,
-                            "max": max_value
-                        }}
-                    )
-    
-    await db.users.update_one(
-        {"id": quest["user_id"]},
-        {"$set": updates}
+    await db.inventory.bulk_write([UpdateOne(*upsert(stack), upsert=True) for stack in stacks.values()], ordered=False)
+    rows = await db.inventory.find({"user_id": user_id, "item_id": {"$in": list(stacks)}}, {"id": 1}).to_list(None)
+    return [row["id"] for row in rows]
+
+@api_router.post("/quests/{quest_id}/complete")
+async def complete_quest(quest_id: str, request: Request):
+    return await idempotency.run(request, lambda: complete_quest_once(quest_id))
+
+async def complete_quest_once(quest_id: str):
+    # Atomically mark the quest completed, unless it already is
+    quest = await db.quests.find_one_and_update(
+        {"id": quest_id, **COMPLETABLE_QUEST},
+        quest_completion_update(datetime.utcnow()),
+        return_document=ReturnDocument.BEFORE
     )
+    if not quest:
+        if await db.quests.find_one({"id": quest_id}, {"_id": 1}):
+            raise HTTPException(status_code=400, detail="Quest already completed")
+        raise HTTPException(status_code=404, detail="Quest not found")
+    
+    rewards = quest_rewards([quest])
+    user = await grant_quest_rewards(quest["user_id"], rewards)
+    old_level = user["level"]
     
     # Handle item reward if specified
     item_reward_name = None
+    changes = [(quest["user_id"], "quests", quest_id, UPSERT), (quest["user_id"], "users", quest["user_id"], UPSERT)]
+    pending = [grant_custom_stat_rewards(quest["user_id"], custom_stat_rewards(rewards))]
     if quest.get("item_reward"):
-        # Create a custom inventory item for the quest reward
-        inventory_item = InventoryItem(
-            user_id=quest["user_id"],
-            item_id=str(uuid.uuid4()),
-            item_name=quest["item_reward"],
-            item_description="Quest reward item",
-            item_type="quest_reward",
-            stat_boost=quest.get("attribute_rewards")
-        )
-        await db.inventory.insert_one(inventory_item.dict())
+        pending.append(add_to_inventory(quest["user_id"], [quest_reward_item(quest).model_dump()]))
         item_reward_name = quest["item_reward"]
     
-    updated_user = await db.users.find_one({"id": quest["user_id"]})
+    # Give 2 ability points per level gained
+    (updated_user, levels_gained), stat_ids, *added = await asyncio.gather(
+        apply_user_level_ups(user, ap_per_level=2),
+        *pending
+    )
+    inventory_ids = added[0] if added else []
+    changes += [(quest["user_id"], "custom_stats", stat_id, UPSERT) for stat_id in stat_ids]
+    changes += [(quest["user_id"], "inventory", item_id, UPSERT) for item_id in inventory_ids]
+    await record_changes(db, changes)
+    await publish_level_up(updated_user, old_level, levels_gained)
+    if inventory_ids:
+        await event_bus.publish(quest["user_id"], INVENTORY_CHANGED, {"added": inventory_ids})
+    
     return {
         "quest": Quest(**{**quest, "completed": True}),
         "user": User(**updated_user),
         "item_reward": item_reward_name,
         "levels_gained": levels_gained,
-        "old_level": user["level"],
+        "old_level": old_level,
         "xp_reward": quest["xp_reward"],
         "gold_reward": quest["gold_reward"]
     }
 
+class QuestBatchComplete(BaseModel):
+    user_id: str
+    quest_ids: List[str]
+
+@api_router.post("/quests/complete-batch")
+async def complete_quests_batch(batch: QuestBatchComplete):
+    """Complete several of a user's quests at once.
+    
+    Quests are claimed with one bulk update and all rewards are applied with
+    one user update, so clearing a checklist costs the same few round trips
+    as completing a single quest. Rewards accumulate in request order.
+    """
+    quest_ids = list(dict.fromkeys(batch.quest_ids))
+    if not quest_ids:
+        raise HTTPException(status_code=400, detail="quest_ids must not be empty")
+    if len(quest_ids) > PAGE_SIZE_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {PAGE_SIZE_MAX} quests can be completed at once")
+    
+    now = datetime.utcnow()
+    quests = {
+        quest["id"]: quest
+        for quest in await db.quests.find({"id": {"$in": quest_ids}, "user_id": batch.user_id}).to_list(None)
+    }
+    claimable = [
+        quest_id for quest_id in quest_ids
+        if quest_id in quests and (not quests[quest_id]["completed"] or quests[quest_id].get("repeat_frequency") == "limitless")
+    ]
+    
+    # Claim every completable quest in one write. The token tells which ones
+    # this request claimed if another device completed some in between.
+    claimed = set()
+    if claimable:
+        token = str(uuid.uuid4())
+        result = await db.quests.update_many(
+            {"id": {"$in": claimable}, **COMPLETABLE_QUEST},
+            quest_completion_update(now, completion_token=token)
+        )
+        if result.matched_count == len(claimable):
+            claimed = set(claimable)
+        else:
+            current = await db.quests.find({"id": {"$in": claimable}}, {"id": 1, "completion_token": 1}).to_list(None)
+            # A concurrent completion may overwrite the token on a limitless quest, which both requests complete
+            claimed = {
+                quest["id"] for quest in current
+                if quest.get("completion_token") == token or quests[quest["id"]].get("repeat_frequency") == "limitless"
+            }
+            # Quests deleted since they were read are reported as not found and earn nothing
+            for quest_id in set(claimable) - {quest["id"] for quest in current}:
+                del quests[quest_id]
+    
+    completed = [quests[quest_id] for quest_id in quest_ids if quest_id in claimed]
+    rewards = quest_rewards(completed)
+    if completed:
+        user = await grant_quest_rewards(batch.user_id, rewards)
+    else:
+        user = await db.users.find_one({"id": batch.user_id})
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+    old_level = user["level"]
+    levels_gained = 0
+    
+    # Replay the rewards in order to report the level reached after each quest
+    level, xp = old_level, user.get("xp", 0) - rewards["xp"]
+    results = []
+    for quest_id in quest_ids:
+        quest = quests.get(quest_id)
+        if quest is None:
+            results.append({"quest_id": quest_id, "status": "not_found"})
+            continue
+        if quest_id not in claimed:
+            results.append({"quest_id": quest_id, "status": "already_completed"})
+            continue
+        level, xp, _ = level_up(level, xp + quest["xp_reward"])
+        results.append({
+            "quest_id": quest_id,
+            "status": "completed",
+            "xp_reward": quest["xp_reward"],
+            "gold_reward": quest["gold_reward"],
+            "ap_reward": quest.get("ap_reward", 0),
+            "item_reward": quest.get("item_reward"),
+            "level_after": level,
+        })
+    
+    if completed:
+        items = [quest_reward_item(quest).model_dump() for quest in completed if quest.get("item_reward")]
+        pending = [grant_custom_stat_rewards(batch.user_id, custom_stat_rewards(rewards))]
+        if items:
+            pending.append(add_to_inventory(batch.user_id, items))
+        # Give 2 ability points per level gained
+        (user, levels_gained), stat_ids, *added = await asyncio.gather(
+            apply_user_level_ups(user, ap_per_level=2),
+            *pending
+        )
+        inventory_ids = added[0] if added else []
+        await record_changes(db, [
+            (batch.user_id, "users", batch.user_id, UPSERT),
+            *[(batch.user_id, "quests", quest["id"], UPSERT) for quest in completed],
+            *[(batch.user_id, "inventory", item_id, UPSERT) for item_id in inventory_ids],
+            *[(batch.user_id, "custom_stats", stat_id, UPSERT) for stat_id in stat_ids],
+        ])
+        await publish_level_up(user, old_level, levels_gained)
+        if inventory_ids:
+            await event_bus.publish(batch.user_id, INVENTORY_CHANGED, {"added": inventory_ids})
+    
+    return {
+        "results": results,
+        "user": User(**user),
+        "levels_gained": levels_gained,
+        "old_level": old_level,
+        "total_rewards": rewards,
+        "item_rewards": [quest["item_reward"] for quest in completed if quest.get("item_reward")]
+    }
+
 @api_router.put("/quests/{quest_id}")
 async def update_quest(quest_id: str, quest_update: QuestCreate):
     existing_quest = await db.quests.find_one({"id": quest_id})
@@ -632,89 +902,338 @@ async def update_quest(quest_id: str, quest_update: QuestCreate):
         "repeat_frequency": quest_update.repeat_frequency,
     }
     
+    # The repeat frequency may have changed, so reschedule resets and deadline checks
+    update_data.update(schedule_fields({**existing_quest, **update_data}, datetime.utcnow()))
+    
     await db.quests.update_one(
         {"id": quest_id},
         {"$set": update_data}
     )
+    await record_upserts(db, existing_quest["user_id"], "quests", [quest_id])
     
     updated_quest = await db.quests.find_one({"id": quest_id})
     return Quest(**updated_quest)
 
 @api_router.delete("/quests/{quest_id}")
 async def delete_quest(quest_id: str):
-    result = await db.quests.delete_one({"id": quest_id})
-    if result.deleted_count == 0:
+    quest = await db.quests.find_one_and_delete({"id": quest_id}, {"user_id": 1})
+    if not quest:
         raise HTTPException(status_code=404, detail="Quest not found")
+    await record_deletes(db, quest["user_id"], "quests", [quest_id])
     return {"message": "Quest deleted"}
 
 
+# Image endpoints
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def image_url(request: Request, image_hash: str, size: Optional[int] = None) -> str:
+    url = request.url_for("get_image", image_hash=image_hash)
+    if size:
+        url = url.include_query_params(size=size)
+    return str(url)
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+@api_router.get("/images/{image_hash}", name="get_image")
+async def get_image(image_hash: str, request: Request, size: Optional[int] = None):
+    """Serve a stored image, or a server-generated thumbnail when `size` is given"""
+    if size is not None and size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {list(THUMBNAIL_SIZES)}")
+    
+    # Content is addressed by hash, so the ETag never changes for a given URL
+    etag = f'"{image_hash}-{size}"' if size else f'"{image_hash}"'
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    if size:
+        image = await image_store.get_thumbnail(image_hash, size)
+    else:
+        image = await image_store.get(image_hash)
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    return Response(content=image["data"], media_type=image["content_type"], headers=headers)
+
+async def ingest_shop_images(images: Optional[List[str]]) -> List[str]:
+    try:
+        return await image_store.ingest(images)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def shop_item_response(item: dict, request: Request, partial: bool = False) -> ShopItem:
+    """Build the API view of a shop item, replacing stored image hashes with URLs"""
+    image_ids = item.get("image_ids") or []
+    to_model = ShopItem.model_construct if partial else ShopItem
+    return to_model(**{
+        **item,
+        "images": [image_url(request, image_id) for image_id in image_ids],
+        "thumbnail": image_url(request, image_ids[0], DEFAULT_THUMBNAIL_SIZE) if image_ids else None,
+    })
+
+async def migrate_inventory_stacks():
+    """Collapse inventory rows written before stacking into one row per (user_id, item_id).
+    
+    Only runs while rows without a quantity remain. Extra rows are claimed one
+    by one with find_one_and_delete before their quantity is added to the
+    oldest row, so workers running this concurrently can't double count.
+    """
+    legacy = {"quantity": {"$exists": False}}
+    if not await db.inventory.find_one(legacy, {"_id": 1}):
+        return
+    
+    # Quest rewards used to get a random item_id; give them the name-derived one so they stack
+    for name in await db.inventory.distinct("item_name", {**legacy, "item_type": "quest_reward"}):
+        await db.inventory.update_many(
+            {**legacy, "item_type": "quest_reward", "item_name": name},
+            {"$set": {"item_id": quest_reward_item_id(name)}}
+        )
+    
+    changes = []
+    groups = db.inventory.aggregate([
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": {"user_id": "$user_id", "item_id": "$item_id"}, "rows": {"$push": {"_id": "$_id", "id": "$id"}}}},
+        {"$match": {"rows.1": {"$exists": True}}},
+    ], allowDiskUse=True)
+    async for group in groups:
+        user_id, (keep, *extra) = group["_id"]["user_id"], group["rows"]
+        added = 0
+        for row in extra:
+            deleted = await db.inventory.find_one_and_delete({"_id": row["_id"]}, {"quantity": 1})
+            if deleted:
+                added += deleted.get("quantity", 1)
+                changes.append((user_id, "inventory", row["id"], DELETE))
+        if added:
+            await db.inventory.update_one({"_id": keep["_id"]}, [{"$set": {"quantity": incremented("quantity", added, 1)}}])
+            changes.append((user_id, "inventory", keep["id"], UPSERT))
+    await db.inventory.update_many(legacy, {"$set": {"quantity": 1}})
+    
+    if changes:
+        await record_changes(db, changes)
+        logger.info("Collapsed %d duplicate inventory rows into stacks", sum(1 for change in changes if change[3] == DELETE))
+
+async def migrate_custom_stat_names():
+    """Make custom stat names unique per user, so the unique (user_id, name) index can be built.
+    
+    Stats are rewarded by name, so a duplicate only ever received part of the
+    rewards; every copy after the oldest is renamed "<name> (2)", "<name> (3)"...
+    """
+    indexes = await db.custom_stats.index_information()
+    if indexes.get("user_id_name", {}).get("unique"):
+        return
+    if "user_id_name" in indexes:
+        # Replaced by the unique index of the same name
+        await db.custom_stats.drop_index("user_id_name")
+    
+    changes = []
+    groups = db.custom_stats.aggregate([
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": {"user_id": "$user_id", "name": "$name"}, "rows": {"$push": {"_id": "$_id", "id": "$id"}}}},
+        {"$match": {"rows.1": {"$exists": True}}},
+    ], allowDiskUse=True)
+    async for group in groups:
+        user_id, name = group["_id"]["user_id"], group["_id"]["name"]
+        taken = set(await db.custom_stats.distinct("name", {"user_id": user_id}))
+        suffix = 2
+        for row in group["rows"][1:]:
+            while f"{name} ({suffix})" in taken:
+                suffix += 1
+            taken.add(f"{name} ({suffix})")
+            await db.custom_stats.update_one({"_id": row["_id"]}, {"$set": {"name": f"{name} ({suffix})"}})
+            changes.append((user_id, "custom_stats", row["id"], UPSERT))
+    if changes:
+        await record_changes(db, changes)
+        logger.info("Renamed %d custom stats whose names were duplicated", len(changes))
+
+async def migrate_inline_shop_images():
+    """Move base64 images still embedded in shop_items documents into the image store"""
+    migrated = 0
+    async for item in db.shop_items.find({"images": {"$exists": True}}, {"id": 1, "images": 1, "image_ids": 1}):
+        try:
+            image_ids = await image_store.ingest(item.get("images"))
+        except ValueError:
+            logger.warning("Dropping undecodable images from shop item %s", item.get("id"))
+            image_ids = []
+        await db.shop_items.update_one(
+            {"_id": item["_id"]},
+            {"$set": {"image_ids": (item.get("image_ids") or []) + image_ids}, "$unset": {"images": ""}}
+        )
+        migrated += 1
+    if migrated:
+        await catalog_cache.bump()
+        logger.info("Moved inline images of %d shop items into the image store", migrated)
+
+
 # Shop endpoints
+async def cached_shop_page(request: Request, cache_key: tuple, field_names: Optional[List[str]], load) -> Response:
+    """Serve a rendered catalog page from the cache, or `load(projection)` and render it.
+    
+    `load` returns the page's shop item documents and the next page's cursor.
+    """
+    cached = catalog_cache.get(cache_key)
+    if cached is None:
+        generation = catalog_cache.generation
+        projection = field_projection(field_names, "image_ids")
+        # Never ship image blobs with the listing, even from documents not yet migrated
+        if projection is None:
+            projection = {"images": 0}
+        else:
+            projection.pop("images", None)
+            projection.pop("thumbnail", None)
+        items, next_cursor = await load(projection)
+        rows = [shop_item_response(item, request, partial=bool(field_names)) for item in items]
+        content = [row.model_dump(include=set(field_names) if field_names else None) for row in rows]
+        headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+        cached = catalog_cache.put(cache_key, generation, JSONResponse(jsonable_encoder(content)).body, headers)
+    
+    headers = {**cached.headers, "ETag": cached.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, cached.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached.body, media_type="application/json", headers=headers)
+
 @api_router.get("/shop", response_model=List[ShopItem])
-async def get_shop_items():
-    items = await db.shop_items.find().to_list(1000)
-    return [ShopItem(**item) for item in items]
+async def get_shop_items(
+    request: Request,
+    after: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    fields: Optional[str] = None,
+):
+    field_names = parse_fields(fields, ShopItem)
+    
+    # The catalog rarely changes, so rendered pages are cached until a shop write
+    cache_key = (str(request.base_url), after, limit, tuple(field_names) if field_names else None)
+    return await cached_shop_page(
+        request, cache_key, field_names,
+        lambda projection: fetch_page(db.shop_items, {}, after, limit, projection),
+    )
+
+@api_router.get("/shop/search", response_model=List[ShopItem])
+async def search_shop_items(
+    request: Request,
+    q: Optional[str] = Query(None, max_length=200),
+    category: Optional[str] = None,
+    item_type: Optional[str] = None,
+    is_power: Optional[bool] = None,
+    power_category: Optional[str] = None,
+    power_tier: Optional[str] = None,
+    is_synthesis_material: Optional[bool] = None,
+    min_price: Optional[int] = Query(None, ge=0),
+    max_price: Optional[int] = Query(None, ge=0),
+    sort: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(SEARCH_PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    fields: Optional[str] = None,
+):
+    field_names = parse_fields(fields, ShopItem)
+    q = q.strip() if q else None
+    # Text matches are ranked by relevance unless another order is asked for
+    sort = sort or (RELEVANCE if q else "name")
+    if sort not in SORTS and sort != RELEVANCE:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join([*SORTS, RELEVANCE])}")
+    if sort == RELEVANCE and not q:
+        raise HTTPException(status_code=400, detail="sort=relevance needs a search query q")
+    query = search_filter(
+        category, item_type, is_power, power_category, power_tier, is_synthesis_material,
+        min_price, max_price, q,
+    )
+    try:
+        after_filter, skip = decode_cursor(sort, after) if after else ({}, 0)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    async def load(projection: dict):
+        # The cursor needs the sort field even when fields= leaves it out
+        if field_names:
+            projection.update({field: 1 for field, _ in sort_keys(sort) if field != "score"})
+        cursor = db.shop_items.find({**query, **after_filter}, projection).sort(sort_keys(sort))
+        # Read one extra document to learn whether another page exists
+        docs = await cursor.skip(skip).limit(limit + 1).to_list(limit + 1)
+        next_cursor = encode_cursor(sort, docs[limit - 1], skip + limit) if len(docs) > limit else None
+        return docs[:limit], next_cursor
+    
+    cache_key = ("search", str(request.base_url), str(request.query_params))
+    return await cached_shop_page(request, cache_key, field_names, load)
 
 @api_router.post("/shop", response_model=ShopItem)
-async def create_shop_item(item: ShopItemCreate):
-    item_obj = ShopItem(**item.dict())
-    await db.shop_items.insert_one(item_obj.dict())
-    return item_obj
+async def create_shop_item(item: ShopItemCreate, request: Request):
+    item_dict = item.model_dump()
+    item_dict["image_ids"] = await ingest_shop_images(item_dict.pop("images"))
+    item_obj = ShopItem(**item_dict)
+    item_doc = item_obj.model_dump(exclude={"images", "thumbnail"})
+    await db.shop_items.insert_one(item_doc)
+    await catalog_cache.bump()
+    return shop_item_response(item_doc, request)
 
 @api_router.put("/shop/{item_id}", response_model=ShopItem)
-async def update_shop_item(item_id: str, item: ShopItemCreate):
-    existing = await db.shop_items.find_one({"id": item_id})
+async def update_shop_item(item_id: str, item: ShopItemCreate, request: Request):
+    existing = await db.shop_items.find_one({"id": item_id}, {"_id": 0, "images": 0})
     if not existing:
         raise HTTPException(status_code=404, detail="Shop item not found")
     
+    item_dict = item.model_dump()
+    item_dict["image_ids"] = await ingest_shop_images(item_dict.pop("images"))
     await db.shop_items.update_one(
         {"id": item_id},
-        {"$set": item.dict()}
+        {"$set": item_dict, "$unset": {"images": ""}}
     )
+    await catalog_cache.bump()
     
     updated_item = await db.shop_items.find_one({"id": item_id})
-    return ShopItem(**updated_item)
+    await record_shop_reference_changes(item_id, edited_collections(existing, updated_item))
+    return shop_item_response(updated_item, request)
+
+SHOP_REFERENCE_BATCH_SIZE = 500
+
+async def record_shop_reference_changes(item_id: str, collections: List[str]):
+    """Record a change for every row of `collections` whose shared fields come from the edited shop item"""
+    changes = []
+    for collection in collections:
+        reference = REFERENCES[collection][0]
+        async for row in db[collection].find({reference: item_id}, {"_id": 0, "id": 1, "user_id": 1}):
+            changes.append((row["user_id"], collection, row["id"], UPSERT))
+            if len(changes) == SHOP_REFERENCE_BATCH_SIZE:
+                await record_changes(db, changes)
+                changes = []
+    await record_changes(db, changes)
+
+async def freeze_shop_references(item: dict):
+    """Copy a shop item onto the inventory and power rows referencing it, before it is deleted"""
+    await asyncio.gather(*(
+        db[collection].update_many(query, update)
+        for collection, (query, update) in frozen_updates(item).items()
+    ))
 
 @api_router.delete("/shop/clear-all")
 async def clear_all_shop_items():
+    async for item in db.shop_items.find({}, {"_id": 0, "images": 0}):
+        await freeze_shop_references(item)
     result = await db.shop_items.delete_many({})
+    await catalog_cache.bump()
     return {"message": f"Deleted {result.deleted_count} items from shop"}
 
 @api_router.delete("/shop/{item_id}")
 async def delete_shop_item(item_id: str):
-    result = await db.shop_items.delete_one({"id": item_id})
-    if result.deleted_count == 0:
+    item = await db.shop_items.find_one({"id": item_id}, {"_id": 0, "images": 0})
+    if not item:
         raise HTTPException(status_code=404, detail="Shop item not found")
+    await freeze_shop_references(item)
+    await db.shop_items.delete_one({"id": item_id})
+    await catalog_cache.bump()
     return {"message": "Shop item deleted"}
 
 @api_router.post("/shop/purchase")
-async def purchase_item(purchase: PurchaseRequest):
-    # Get user
-    user = await db.users.find_one({"id": purchase.user_id})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    # Get item
-    item = await db.shop_items.find_one({"id": purchase.item_id})
-    if not item:
-        raise HTTPException(status_code=404, detail="Item not found")
-    
-    # Check if user has enough gold
-    if user["gold"] < item["price"]:
-        raise HTTPException(status_code=400, detail="Not enough gold")
-    
-    # Deduct gold and update stats
-    new_gold = user["gold"] - item["price"]
-    updates = {"gold": new_gold}
-    
-    if item.get("stat_boost"):
-        for stat, boost in item["stat_boost"].items():
-            updates[stat] = user.get(stat, 0) + boost
-    
-    await db.users.update_one({"id": purchase.user_id}, {"$set": updates})
-    
-    # Add to inventory
+async def purchase_item(purchase: PurchaseRequest, request: Request):
+    return await idempotency.run(request, lambda: purchase_item_once(purchase, request))
+
+def shop_inventory_row(user_id: str, item: dict, quantity: int = 1) -> dict:
+    """A new inventory row for a shop item, referencing rather than copying the item"""
     inventory_item = InventoryItem(
-        user_id=purchase.user_id,
+        user_id=user_id,
         item_id=item["id"],
         item_name=item["name"],
         item_description=item["description"],
@@ -724,9 +1243,34 @@ async def purchase_item(purchase: PurchaseRequest):
         exp_amount=item.get("exp_amount"),
         gold_amount=item.get("gold_amount"),
         ap_amount=item.get("ap_amount"),
-        is_synthesis_material=item.get("is_synthesis_material", False)
+        is_synthesis_material=item.get("is_synthesis_material", False),
+        quantity=quantity
+    )
+    return slim("inventory", inventory_item.model_dump())
+
+async def purchase_item_once(purchase: PurchaseRequest, request: Request):
+    # Get item
+    item = await db.shop_items.find_one({"id": purchase.item_id}, {"images": 0})
+    if not item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    
+    # Deduct gold and apply stat boosts in one update, only if the user can still afford it
+    updates = dict(item.get("stat_boost") or {})
+    updates["gold"] = updates.get("gold", 0) - item["price"]
+    updated_user = await db.users.find_one_and_update(
+        {"id": purchase.user_id, "gold": {"$gte": item["price"]}},
+        {"$inc": updates},
+        return_document=ReturnDocument.AFTER
     )
-    await db.inventory.insert_one(inventory_item.dict())
+    if not updated_user:
+        if await db.users.find_one({"id": purchase.user_id}, {"_id": 1}):
+            raise HTTPException(status_code=400, detail="Not enough gold")
+        raise HTTPException(status_code=404, detail="User not found")
+    changes = [(purchase.user_id, "users", purchase.user_id, UPSERT)]
+    
+    # Add to inventory
+    inventory_ids = await add_to_inventory(purchase.user_id, [shop_inventory_row(purchase.user_id, item)])
+    changes += [(purchase.user_id, "inventory", item_id, UPSERT) for item_id in inventory_ids]
     
     # If this is a power item, also add to powers collection
     if item.get("is_power") and item.get("power_category"):
@@ -744,27 +1288,63 @@ async def purchase_item(purchase: PurchaseRequest):
             image=item.get("image"),
             stat_boost=item.get("stat_boost")
         )
-        await db.powers.insert_one(power_item.dict())
+        await db.powers.insert_one(slim("powers", power_item.model_dump()))
+        changes.append((purchase.user_id, "powers", power_item.id, UPSERT))
+        await power_facets.bump()
+    await record_changes(db, changes)
+    await event_bus.publish(purchase.user_id, INVENTORY_CHANGED, {"added": inventory_ids})
     
-    updated_user = await db.users.find_one({"id": purchase.user_id})
-    return {"user": User(**updated_user), "item": ShopItem(**item)}
+    return {"user": User(**updated_user), "item": shop_item_response(item, request)}
 
 
 # Inventory endpoints
 @api_router.get("/inventory/{user_id}", response_model=List[InventoryItem])
-async def get_user_inventory(user_id: str):
-    items = await db.inventory.find({"user_id": user_id}).to_list(1000)
-    return [InventoryItem(**item) for item in items]
+async def get_user_inventory(
+    user_id: str,
+    after: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    fields: Optional[str] = None,
+):
+    field_names = parse_fields(fields, InventoryItem)
+    items, next_cursor = await fetch_page(db.inventory, {"user_id": user_id}, after, limit, field_projection(field_names, "item_id"))
+    return page_response(await hydrate_rows("inventory", items), inventory_encoder, next_cursor, field_names)
 
 @api_router.delete("/inventory/{item_id}")
-async def delete_inventory_item(item_id: str):
-    result = await db.inventory.delete_one({"id": item_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Inventory item not found")
-    return {"message": "Inventory item deleted"}
+async def delete_inventory_item(item_id: str, quantity: int = Query(1, ge=1)):
+    """Discard `quantity` items from a stack; the row goes once the stack is empty"""
+    stack = await db.inventory.find_one_and_update(
+        {"id": item_id, "quantity": {"$gte": quantity}},
+        {"$inc": {"quantity": -quantity}},
+        projection={"user_id": 1, "quantity": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not stack:
+        existing = await db.inventory.find_one({"id": item_id}, {"quantity": 1})
+        if not existing:
+            raise HTTPException(status_code=404, detail="Inventory item not found")
+        raise HTTPException(status_code=400, detail=f"Only {existing['quantity']} of this item in the stack")
+    
+    # Unless another one was added meanwhile
+    emptied = False
+    if stack["quantity"] == 0:
+        deleted = await db.inventory.delete_one({"id": item_id, "quantity": {"$lte": 0}})
+        emptied = deleted.deleted_count == 1
+    await record_changes(db, [(stack["user_id"], "inventory", item_id, DELETE if emptied else UPSERT)])
+    await event_bus.publish(stack["user_id"], INVENTORY_CHANGED, {"removed" if emptied else "updated": [item_id]})
+    return {"message": "Inventory item deleted", "remaining": stack["quantity"]}
+
+# Consumable item types and the user field each one adds its amount to
+CONSUMABLE_EFFECTS = {
+    "exp": ("exp_amount", "xp", "exp_gained"),
+    "gold": ("gold_amount", "gold", "gold_gained"),
+    "ability_points": ("ap_amount", "ability_points", "ap_gained"),
+}
 
 @api_router.post("/inventory/{item_id}/use")
-async def use_inventory_item(item_id: str, request: dict):
+async def use_inventory_item(item_id: str, request: dict, http_request: Request):
+    return await idempotency.run(http_request, lambda: use_inventory_item_once(item_id, request))
+
+async def use_inventory_item_once(item_id: str, request: dict):
     user_id = request.get("user_id")
     if not user_id:
         raise HTTPException(status_code=400, detail="user_id is required")
@@ -773,100 +1353,340 @@ async def use_inventory_item(item_id: str, request: dict):
     item = await db.inventory.find_one({"id": item_id})
     if not item:
         raise HTTPException(status_code=404, detail="Inventory item not found")
+    item = (await hydrate_rows("inventory", [item]))[0]
     
-    # Get user
-    user = await db.users.find_one({"id": user_id})
+    effect = CONSUMABLE_EFFECTS.get(item.get("item_type"))
+    if not effect or not item.get(effect[0]):
+        raise HTTPException(status_code=400, detail="Item is not consumable or has no effect")
+    amount_field, user_field, result_key = effect
+    
+    # Take one from the stack first, so a double tap can't use more items than there are
+    stack = await db.inventory.find_one_and_update(
+        {"id": item_id, "quantity": {"$gte": 1}},
+        {"$inc": {"quantity": -1}},
+        projection={"quantity": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not stack:
+        raise HTTPException(status_code=404, detail="Inventory item not found")
+    
+    user = await db.users.find_one_and_update(
+        {"id": user_id},
+        {"$inc": {user_field: item[amount_field]}},
+        return_document=ReturnDocument.AFTER
+    )
     if not user:
+        # Give the item back rather than losing it to a bad user id
+        await db.inventory.update_one({"id": item_id}, {"$inc": {"quantity": 1}})
         raise HTTPException(status_code=404, detail="User not found")
+    result = {result_key: item[amount_field], "remaining": stack["quantity"]}
     
-    result = {}
-    old_level = user.get("level", 1)
-    new_xp = user.get("xp", 0)
-    
-    # Apply consumable effects based on item type
-    if item.get("item_type") == "exp" and item.get("exp_amount"):
-        # Add EXP to user
-        new_xp = user.get("xp", 0) + item["exp_amount"]
-        await db.users.update_one({"id": user_id}, {"$set": {"xp": new_xp}})
-        result["exp_gained"] = item["exp_amount"]
-        
-    elif item.get("item_type") == "gold" and item.get("gold_amount"):
-        # Add Gold to user
-        new_gold = user.get("gold", 0) + item["gold_amount"]
-        await db.users.update_one({"id": user_id}, {"$set": {"gold": new_gold}})
-        result["gold_gained"] = item["gold_amount"]
-        
-    elif item.get("item_type") == "ability_points" and item.get("ap_amount"):
-        # Add AP to user
-        new_ap = user.get("ability_points", 0) + item["ap_amount"]
-        await db.users.update_one({"id": user_id}, {"$set": {"ability_points": new_ap}})
-        result["ap_gained"] = item["ap_amount"]
-    else:
-        raise HTTPException(status_code=400, detail="Item is not consumable or has no effect")
+    # Using the last item of a stack removes the row, unless another one was added meanwhile
+    emptied = False
+    if stack["quantity"] == 0:
+        deleted = await db.inventory.delete_one({"id": item_id, "quantity": {"$lte": 0}})
+        emptied = deleted.deleted_count == 1
     
-    # Check for level up (XP threshold: level * 100)
-    new_level = old_level
-    levels_gained = 0
-    while new_xp >= (new_level * 100):
-        new_xp -= (new_level * 100)
-        new_level += 1
-        levels_gained += 1
+    # Level up for any XP above the threshold: 50 gold and 5 AP per level
+    old_level = user.get("level", 1)
+    user, levels_gained = await apply_user_level_ups(user, ap_per_level=5, gold_per_level=50)
     
     if levels_gained > 0:
-        # User leveled up! Update level and grant rewards
-        gold_reward = 50 * levels_gained
-        ap_reward = 5 * levels_gained
-        
-        # Increase HP and MP on level up (HP +10, MP +5 per level)
-        new_max_hp = user.get("max_hp", 100) + (levels_gained * 10)
-        new_max_mp = user.get("max_mp", 50) + (levels_gained * 5)
-        
-        await db.users.update_one(
-            {"id": user_id},
-            {"$set": {
-                "level": new_level,
-                "xp": new_xp,
-                "gold": user.get("gold", 0) + gold_reward,
-                "ability_points": user.get("ability_points", 0) + ap_reward,
-                "hp": new_max_hp,  # Fully restore HP on level up
-                "max_hp": new_max_hp,
-                "mp": new_max_mp,  # Fully restore MP on level up
-                "max_mp": new_max_mp
-            }}
-        )
-        
         result["level_up"] = True
-        result["new_level"] = new_level
+        result["new_level"] = user["level"]
         result["levels_gained"] = levels_gained
-        result["gold_reward"] = gold_reward
-        result["ap_reward"] = ap_reward
-        result["new_max_hp"] = new_max_hp
-        result["new_max_mp"] = new_max_mp
+        result["gold_reward"] = 50 * levels_gained
+        result["ap_reward"] = 5 * levels_gained
+        result["new_max_hp"] = user["max_hp"]
+        result["new_max_mp"] = user["max_mp"]
     
-    # Remove the item from inventory after use
-    await db.inventory.delete_one({"id": item_id})
+    await record_changes(db, [(user_id, "users", user_id, UPSERT), (item["user_id"], "inventory", item_id, DELETE if emptied else UPSERT)])
+    await publish_level_up(user, old_level, levels_gained)
+    await event_bus.publish(item["user_id"], INVENTORY_CHANGED, {"removed" if emptied else "updated": [item_id]})
     
     return result
 
 
+class InventoryUseBatch(BaseModel):
+    user_id: str
+    items: Dict[str, int]  # inventory row id -> how many to use
+
+@api_router.post("/inventory/use-batch")
+async def use_inventory_items_batch(batch: InventoryUseBatch, request: Request):
+    return await idempotency.run(request, lambda: use_inventory_items_batch_once(batch))
+
+async def use_inventory_items_batch_once(batch: InventoryUseBatch):
+    """Use several consumables, or many of one stack, at once.
+    
+    The effects of every item are summed and applied with one user update
+    (plus the conditional level-up write when XP crosses a threshold), however
+    many items are used. A count larger than the stack uses the whole stack.
+    """
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="items must not be empty")
+    if len(batch.items) > PAGE_SIZE_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {PAGE_SIZE_MAX} different items can be used at once")
+    if any(count < 1 for count in batch.items.values()):
+        raise HTTPException(status_code=400, detail="Item counts must be at least 1")
+    
+    stacks = {
+        item["id"]: item
+        for item in await hydrate_rows(
+            "inventory",
+            await db.inventory.find({"id": {"$in": list(batch.items)}, "user_id": batch.user_id}).to_list(None)
+        )
+    }
+    results, usable = {}, {}
+    for item_id, count in batch.items.items():
+        item = stacks.get(item_id)
+        effect = CONSUMABLE_EFFECTS.get(item.get("item_type")) if item else None
+        if not item or item.get("quantity", 0) < 1:
+            results[item_id] = {"status": "not_found"}
+        elif not effect or not item.get(effect[0]):
+            results[item_id] = {"status": "not_consumable"}
+        else:
+            usable[item_id] = min(count, item["quantity"])
+    
+    # Take the items from their stacks, each guarded so concurrent use can't go below zero
+    claimed = await asyncio.gather(*(
+        db.inventory.find_one_and_update(
+            {"id": item_id, "quantity": {"$gte": count}},
+            {"$inc": {"quantity": -count}},
+            projection={"quantity": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        for item_id, count in usable.items()
+    ))
+    totals = {user_field: 0 for _, user_field, _ in CONSUMABLE_EFFECTS.values()}
+    gained = {result_key: 0 for _, _, result_key in CONSUMABLE_EFFECTS.values()}
+    used = {}
+    for (item_id, count), stack in zip(usable.items(), claimed):
+        if not stack:
+            results[item_id] = {"status": "unavailable"}
+            continue
+        amount_field, user_field, result_key = CONSUMABLE_EFFECTS[stacks[item_id]["item_type"]]
+        totals[user_field] += stacks[item_id][amount_field] * count
+        gained[result_key] += stacks[item_id][amount_field] * count
+        used[item_id] = stack["quantity"]
+        results[item_id] = {"status": "used", "used": count, "remaining": stack["quantity"]}
+    
+    # Report in request order, like complete-batch
+    results = [{"item_id": item_id, **results[item_id]} for item_id in batch.items]
+    if not used:
+        return {"results": results, **gained, "levels_gained": 0}
+    
+    user = await db.users.find_one_and_update(
+        {"id": batch.user_id},
+        {"$inc": {field: amount for field, amount in totals.items() if amount}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not user:
+        # Give the items back rather than losing them to a bad user id
+        await db.inventory.bulk_write([
+            UpdateOne({"id": item_id}, {"$inc": {"quantity": usable[item_id]}}) for item_id in used
+        ], ordered=False)
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    # Level up for any XP above the threshold: 50 gold and 5 AP per level
+    old_level = user.get("level", 1)
+    user, levels_gained = await apply_user_level_ups(user, ap_per_level=5, gold_per_level=50)
+    
+    # Drop the stacks that were used up, unless more were added meanwhile
+    emptied = {item_id for item_id, remaining in used.items() if remaining == 0}
+    if emptied:
+        deleted = await db.inventory.delete_many({"id": {"$in": list(emptied)}, "quantity": {"$lte": 0}})
+        if deleted.deleted_count < len(emptied):
+            emptied -= {
+                item["id"] for item in await db.inventory.find({"id": {"$in": list(emptied)}}, {"id": 1}).to_list(None)
+            }
+    updated = [item_id for item_id in used if item_id not in emptied]
+    
+    await record_changes(db, [
+        (batch.user_id, "users", batch.user_id, UPSERT),
+        *[(batch.user_id, "inventory", item_id, DELETE if item_id in emptied else UPSERT) for item_id in used],
+    ])
+    await publish_level_up(user, old_level, levels_gained)
+    await event_bus.publish(batch.user_id, INVENTORY_CHANGED, {
+        key: item_ids for key, item_ids in (("removed", sorted(emptied)), ("updated", updated)) if item_ids
+    })
+    
+    return {
+        "results": results,
+        **gained,
+        "user": User(**user),
+        "old_level": old_level,
+        "levels_gained": levels_gained,
+        "gold_reward": 50 * levels_gained,
+        "ap_reward": 5 * levels_gained,
+    }
+
+
+# Synthesis endpoints
+@api_router.post("/synthesis/recipes", response_model=Recipe)
+async def create_recipe(recipe: RecipeCreate):
+    totals = ingredient_totals(ingredient.model_dump() for ingredient in recipe.ingredients)
+    if not totals:
+        raise HTTPException(status_code=400, detail="A recipe needs at least one ingredient")
+    if recipe.result_item_id in totals:
+        raise HTTPException(status_code=400, detail="Result item cannot be one of the ingredients")
+    
+    items = await catalog_cache.items([*totals, recipe.result_item_id])
+    unknown = sorted(item_id for item_id, item in items.items() if item is None)
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Shop items not found: {', '.join(unknown)}")
+    not_materials = [items[item_id]["name"] for item_id in totals if not items[item_id].get("is_synthesis_material")]
+    if not_materials:
+        raise HTTPException(status_code=400, detail=f"Not synthesis materials: {', '.join(not_materials)}")
+    
+    recipe_obj = Recipe(
+        name=recipe.name or items[recipe.result_item_id]["name"],
+        ingredients=[RecipeIngredient(item_id=item_id, quantity=quantity) for item_id, quantity in totals.items()],
+        result_item_id=recipe.result_item_id,
+        result_quantity=recipe.result_quantity,
+    )
+    await db.recipes.insert_one(recipe_obj.model_dump())
+    await recipe_index.bump()
+    return recipe_obj
+
+@api_router.get("/synthesis/recipes", response_model=List[Recipe])
+async def get_recipes(
+    after: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+):
+    recipes, next_cursor = await fetch_page(db.recipes, {}, after, limit)
+    return page_response(recipes, recipe_encoder, next_cursor, None)
+
+@api_router.delete("/synthesis/recipes/{recipe_id}")
+async def delete_recipe(recipe_id: str):
+    result = await db.recipes.delete_one({"id": recipe_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+    await recipe_index.bump()
+    return {"message": "Recipe deleted"}
+
+@api_router.get("/synthesis/craftable/{user_id}")
+async def get_craftable_recipes(user_id: str):
+    """The recipes the user holds enough ingredients for, and how many times each can be crafted"""
+    index = await recipe_index.get()
+    stacks = await db.inventory.find({"user_id": user_id}, {"_id": 0, "item_id": 1, "quantity": 1}).to_list(None)
+    craftable = index.craftable({stack["item_id"]: stack.get("quantity", 1) for stack in stacks})
+    return [
+        {"recipe": recipe_encoder.row(index.recipes[recipe_id]), "times": times}
+        for recipe_id, times in sorted(craftable.items(), key=lambda entry: index.recipes[entry[0]]["name"])
+    ]
+
+@api_router.post("/synthesis/craft")
+async def craft(craft_request: CraftRequest, request: Request):
+    return await idempotency.run(request, lambda: craft_once(craft_request))
+
+async def craft_once(craft_request: CraftRequest):
+    """Consume a recipe's ingredients from the user's stacks and add its result.
+    
+    Every ingredient stack is taken with a guarded $inc, so concurrent crafts
+    and item uses can't take more than the user holds. If any ingredient is
+    short, the stacks already taken are given back and nothing is crafted.
+    """
+    user_id, times = craft_request.user_id, craft_request.times
+    index = await recipe_index.get()
+    recipe = index.recipes.get(craft_request.recipe_id)
+    if not recipe:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+    result_item = (await catalog_cache.items([recipe["result_item_id"]]))[recipe["result_item_id"]]
+    if not result_item:
+        raise HTTPException(status_code=409, detail="The recipe's result item is no longer in the shop")
+    if not await db.users.find_one({"id": user_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    needed = {item_id: quantity * times for item_id, quantity in ingredient_totals(recipe["ingredients"]).items()}
+    claimed = await asyncio.gather(*(
+        db.inventory.find_one_and_update(
+            {"user_id": user_id, "item_id": item_id, "quantity": {"$gte": quantity}},
+            {"$inc": {"quantity": -quantity}},
+            projection={"id": 1, "quantity": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        for item_id, quantity in needed.items()
+    ))
+    stacks = dict(zip(needed, claimed))
+    missing = [item_id for item_id, stack in stacks.items() if not stack]
+    if missing:
+        taken = [UpdateOne({"_id": stack["_id"]}, {"$inc": {"quantity": needed[item_id]}}) for item_id, stack in stacks.items() if stack]
+        if taken:
+            await db.inventory.bulk_write(taken, ordered=False)
+        items = await catalog_cache.items(missing)
+        names = [items[item_id]["name"] if items[item_id] else item_id for item_id in missing]
+        raise HTTPException(status_code=400, detail=f"Not enough ingredients: {', '.join(names)}")
+    
+    result_ids = await add_to_inventory(user_id, [shop_inventory_row(user_id, result_item, recipe.get("result_quantity", 1) * times)])
+    
+    # Drop the ingredient stacks that were used up, unless more were added meanwhile
+    emptied = {stack["id"] for stack in stacks.values() if stack["quantity"] == 0}
+    if emptied:
+        deleted = await db.inventory.delete_many({"id": {"$in": list(emptied)}, "quantity": {"$lte": 0}})
+        if deleted.deleted_count < len(emptied):
+            emptied -= {
+                item["id"] for item in await db.inventory.find({"id": {"$in": list(emptied)}}, {"id": 1}).to_list(None)
+            }
+    updated = [stack["id"] for stack in stacks.values() if stack["id"] not in emptied]
+    
+    await record_changes(db, [
+        *[(user_id, "inventory", item_id, UPSERT) for item_id in [*result_ids, *updated]],
+        *[(user_id, "inventory", item_id, DELETE) for item_id in sorted(emptied)],
+    ])
+    await event_bus.publish(user_id, INVENTORY_CHANGED, {
+        key: item_ids for key, item_ids in (("added", result_ids), ("removed", sorted(emptied)), ("updated", updated)) if item_ids
+    })
+    
+    result_rows = await db.inventory.find({"id": {"$in": result_ids}}).to_list(None)
+    return {
+        "recipe": recipe_encoder.row(recipe),
+        "times": times,
+        "consumed": needed,
+        "items": [InventoryItem(**row) for row in await hydrate_rows("inventory", result_rows)],
+    }
+
+
 # Powers endpoints
 @api_router.get("/powers/{user_id}", response_model=List[PowerItem])
-async def get_user_powers(user_id: str):
-    powers = await db.powers.find({"user_id": user_id}).to_list(1000)
-    return [PowerItem(**power) for power in powers]
+async def get_user_powers(
+    user_id: str,
+    after: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    fields: Optional[str] = None,
+):
+    field_names = parse_fields(fields, PowerItem)
+    powers, next_cursor = await fetch_page(db.powers, {"user_id": user_id}, after, limit, field_projection(field_names, "shop_item_id"))
+    return page_response(await hydrate_rows("powers", powers), power_encoder, next_cursor, field_names)
+
+@api_router.get("/powers/{user_id}/tree")
+async def get_power_tree(user_id: str):
+    """The user's powers as an evolution forest, following both id and name links"""
+    graph = await power_trees.get(user_id)
+    items = await catalog_cache.items(referenced_ids("powers", graph.powers.values()))
+    
+    def hydrated(nodes: List[dict]) -> List[dict]:
+        return [{**hydrate("powers", [node], items)[0], "children": hydrated(node["children"])} for node in nodes]
+    
+    return json_response({
+        "roots": hydrated(graph.forest()),
+        "cycles": [{"parent_id": parent_id, "child_id": child_id} for parent_id, child_id in graph.cycles],
+    })
 
 @api_router.get("/powers/categories/all")
-async def get_all_power_categories():
-    """Get all unique power categories from powers collection"""
-    powers = await db.powers.find().to_list(10000)
-    categories = list(set([power["power_category"] for power in powers if power.get("power_category")]))
-    return {"categories": sorted(categories)}
+async def get_all_power_categories(user_id: Optional[str] = None):
+    """Power categories, with power counts per category, subcategory and tier.
+    
+    Pass `user_id` to count only that user's powers.
+    """
+    return json_response(await power_facets.get(user_id))
 
 @api_router.delete("/powers/{power_id}")
 async def delete_power(power_id: str):
-    result = await db.powers.delete_one({"id": power_id})
-    if result.deleted_count == 0:
+    power = await db.powers.find_one_and_delete({"id": power_id}, {"user_id": 1})
+    if not power:
         raise HTTPException(status_code=404, detail="Power not found")
+    await record_deletes(db, power["user_id"], "powers", [power_id])
+    await power_facets.bump()
     return {"message": "Power deleted"}
 
 class LinkEvolvedAbility(BaseModel):
@@ -900,6 +1720,9 @@ async def link_evolved_ability(power_id: str, data: LinkEvolvedAbility):
         {"id": power_id},
         {"$set": {"evolved_abilities": existing_evolved}}
     )
+    await record_changes(db, [
+        (power["user_id"], "powers", power["id"], UPSERT) for power in (parent_power, evolved_power)
+    ])
     
     return {"message": "Evolution linked successfully", "parent_id": power_id, "evolved_id": data.evolved_power_id}
 
@@ -935,6 +1758,7 @@ async def link_evolved_ability_by_name(power_id: str, data: LinkEvolutionByName)
         {"id": power_id},
         {"$set": {"evolved_ability_names": existing_evolved_names}}
     )
+    await record_upserts(db, parent_power["user_id"], "powers", [power_id])
     
     return {"message": "Evolution linked successfully", "parent_id": power_id, "evolved_name": data.evolved_power_name}
 
@@ -962,6 +1786,10 @@ async def unlink_evolved_ability(power_id: str, data: LinkEvolvedAbility):
         {"id": power_id},
         {"$set": {"evolved_abilities": existing_evolved}}
     )
+    evolved_power = await db.powers.find_one({"id": data.evolved_power_id}, {"user_id": 1})
+    await record_changes(db, [
+        (power["user_id"], "powers", power["id"], UPSERT) for power in (parent_power, evolved_power) if power
+    ])
     
     return {"message": "Evolution unlinked successfully"}
 
@@ -978,9 +1806,12 @@ async def update_power(power_id: str, power_update: dict):
     
     if update_data:
         await db.powers.update_one({"id": power_id}, {"$set": update_data})
+        await record_upserts(db, power["user_id"], "powers", [power_id])
+        if "power_tier" in update_data:
+            await power_facets.bump()
     
     updated_power = await db.powers.find_one({"id": power_id})
-    return PowerItem(**updated_power)
+    return PowerItem(**(await hydrate_rows("powers", [updated_power]))[0])
 
 # User Categories endpoints
 @api_router.post("/users/{user_id}/categories")
@@ -990,6 +1821,7 @@ async def save_user_categories(user_id: str, categories: dict):
         {"id": user_id},
         {"$set": {"custom_categories": categories}}
     )
+    await record_upserts(db, user_id, "users", [user_id])
     return {"message": "Categories saved", "categories": categories}
 
 @api_router.get("/users/{user_id}/categories")
@@ -1001,7 +1833,28 @@ async def get_user_categories(user_id: str):
     return user.get("custom_categories", {})
 
 @api_router.post("/powers/{power_id}/levelup")
-async def level_up_power(power_id: str):
+async def level_up_power(power_id: str, request: Request):
+    return await idempotency.run(request, lambda: level_up_power_once(power_id))
+
+async def power_locked(power: dict) -> bool:
+    """Whether a power evolved from parents that aren't maxed yet.
+    
+    Reads only the powers linking to this one. The full graph, which drops
+    links that close a cycle, is only consulted when one of them isn't maxed.
+    """
+    links = [{"evolved_abilities": power["id"]}, {"evolved_ability_names.name": power["name"]}]
+    if power.get("evolved_from"):
+        links.append({"id": power["evolved_from"]})
+    parents = await db.powers.find(
+        {"user_id": power["user_id"], "id": {"$ne": power["id"]}, "$or": links},
+        {"_id": 0, "current_level": 1, "max_level": 1}
+    ).to_list(None)
+    if all(parent.get("current_level", 1) >= parent.get("max_level", 5) for parent in parents):
+        return False
+    graph = await power_trees.get(power["user_id"])
+    return graph.locked(power["id"])
+
+async def level_up_power_once(power_id: str):
     power = await db.powers.find_one({"id": power_id})
     if not power:
         raise HTTPException(status_code=404, detail="Power not found")
@@ -1009,37 +1862,35 @@ async def level_up_power(power_id: str):
     if power["current_level"] >= power["max_level"]:
         raise HTTPException(status_code=400, detail="Power is already at max level")
     
-    # Check if this is an evolved power that is locked
-    if power.get("evolved_from") or power.get("is_evolved"):
-        # Find the parent power
-        parent_power = await db.powers.find_one({"evolved_abilities": power_id})
-        if parent_power:
-            # Check if parent is maxed
-            if parent_power["current_level"] < parent_power["max_level"]:
-                raise HTTPException(status_code=400, detail="Parent ability must be maxed before leveling this evolved power")
-    
-    # Check if user has enough ability points
-    user = await db.users.find_one({"id": power["user_id"]})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    if user.get("ability_points", 0) < 1:
-        raise HTTPException(status_code=400, detail="Not enough ability points")
+    # Evolved powers stay locked until the powers they evolve from are maxed
+    if await power_locked(power):
+        raise HTTPException(status_code=400, detail="Parent ability must be maxed before leveling this evolved power")
     
-    # Consume 1 ability point and level up the power
-    new_level = power["current_level"] + 1
-    await db.powers.update_one(
-        {"id": power_id},
-        {"$set": {"current_level": new_level}}
+    # Consume 1 ability point, only if the user still has one
+    user = await db.users.find_one_and_update(
+        {"id": power["user_id"], "ability_points": {"$gte": 1}},
+        {"$inc": {"ability_points": -1}},
+        projection={"_id": 1}
     )
+    if not user:
+        if await db.users.find_one({"id": power["user_id"]}, {"_id": 1}):
+            raise HTTPException(status_code=400, detail="Not enough ability points")
+        raise HTTPException(status_code=404, detail="User not found")
     
-    # Deduct 1 ability point from user
-    await db.users.update_one(
-        {"id": power["user_id"]},
-        {"$set": {"ability_points": user["ability_points"] - 1}}
+    # Level up the power unless a concurrent level-up already maxed it, refunding the point if so
+    updated_power = await db.powers.find_one_and_update(
+        {"id": power_id, "$expr": {"$lt": ["$current_level", "$max_level"]}},
+        {"$inc": {"current_level": 1}},
+        return_document=ReturnDocument.AFTER
     )
+    if not updated_power:
+        await db.users.update_one({"id": power["user_id"]}, {"$inc": {"ability_points": 1}})
+        raise HTTPException(status_code=400, detail="Power is already at max level")
+    new_level = updated_power["current_level"]
+    changes = [(power["user_id"], "powers", power_id, UPSERT), (power["user_id"], "users", power["user_id"], UPSERT)]
+    next_power = None
     
-    # Check if power reached max level and has next tier ability
+    # Check if power reached max level and has next tier ability; only the update that maxed it gets here
     if new_level >= power["max_level"] and power.get("next_tier_ability"):
         # Search for the next tier item in shop
         next_tier_item = await db.shop_items.find_one({
@@ -1061,10 +1912,19 @@ async def level_up_power(power_id: str):
             image=next_tier_item.get("image") if next_tier_item else power.get("image"),
             stat_boost=next_tier_item.get("stat_boost") if next_tier_item else power.get("stat_boost")
         )
-        await db.powers.insert_one(next_power.dict())
+        next_power_doc = next_power.model_dump()
+        await db.powers.insert_one(slim("powers", next_power_doc) if next_tier_item else next_power_doc)
+        changes.append((power["user_id"], "powers", next_power.id, UPSERT))
+        await power_facets.bump()
+    await record_changes(db, changes)
+    if next_power is not None:
+        await event_bus.publish(power["user_id"], POWER_EVOLVED, {
+            "power_id": power_id,
+            "evolved_power_id": next_power.id,
+            "evolved_power_name": next_power.name,
+        })
     
-    updated_power = await db.powers.find_one({"id": power_id})
-    return PowerItem(**updated_power)
+    return PowerItem(**(await hydrate_rows("powers", [updated_power]))[0])
 
 @api_router.put("/powers/{power_id}")
 async def update_power(power_id: str, updates: dict):
@@ -1081,27 +1941,38 @@ async def update_power(power_id: str, updates: dict):
             {"id": power_id},
             {"$set": update_data}
         )
+        await record_upserts(db, power["user_id"], "powers", [power_id])
     
     updated_power = await db.powers.find_one({"id": power_id})
-    return PowerItem(**updated_power)
+    return PowerItem(**(await hydrate_rows("powers", [updated_power]))[0])
 
 
 # Custom Stats endpoints
 @api_router.get("/users/{user_id}/stats", response_model=List[CustomStat])
-async def get_user_stats(user_id: str):
-    """Get all custom stats for a user"""
-    stats = await db.custom_stats.find({"user_id": user_id}).to_list(1000)
-    return [CustomStat(**stat) for stat in stats]
+async def get_user_stats(
+    user_id: str,
+    after: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    fields: Optional[str] = None,
+):
+    """Get a page of custom stats for a user"""
+    field_names = parse_fields(fields, CustomStat)
+    stats, next_cursor = await fetch_page(db.custom_stats, {"user_id": user_id}, after, limit, field_projection(field_names))
+    return page_response(stats, custom_stat_encoder, next_cursor, field_names)
 
 @api_router.post("/users/{user_id}/stats", response_model=CustomStat)
 async def create_custom_stat(user_id: str, stat: CustomStatCreate):
     """Create a new custom stat"""
-    stat_dict = stat.dict()
+    stat_dict = stat.model_dump()
     stat_dict["user_id"] = user_id
     stat_dict["id"] = str(uuid.uuid4())
     stat_dict["created_at"] = datetime.utcnow()
     
-    await db.custom_stats.insert_one(stat_dict)
+    try:
+        await db.custom_stats.insert_one(stat_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail=f"A stat named {stat.name!r} already exists")
+    await record_upserts(db, user_id, "custom_stats", [stat_dict["id"]])
     return CustomStat(**stat_dict)
 
 @api_router.put("/users/{user_id}/stats/{stat_id}")
@@ -1116,10 +1987,14 @@ async def update_custom_stat(user_id: str, stat_id: str, updates: dict):
     update_data = {k: v for k, v in updates.items() if k in allowed_fields}
     
     if update_data:
-        await db.custom_stats.update_one(
-            {"id": stat_id, "user_id": user_id},
-            {"$set": update_data}
-        )
+        try:
+            await db.custom_stats.update_one(
+                {"id": stat_id, "user_id": user_id},
+                {"$set": update_data}
+            )
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail=f"A stat named {update_data['name']!r} already exists")
+        await record_upserts(db, user_id, "custom_stats", [stat_id])
     
     updated_stat = await db.custom_stats.find_one({"id": stat_id})
     return CustomStat(**updated_stat)
@@ -1130,9 +2005,376 @@ async def delete_custom_stat(user_id: str, stat_id: str):
     result = await db.custom_stats.delete_one({"id": stat_id, "user_id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Custom stat not found")
+    await record_deletes(db, user_id, "custom_stats", [stat_id])
     return {"message": "Custom stat deleted successfully"}
 
 
+# Snapshot and sync endpoints
+SNAPSHOT_SECTIONS = ("user", "quests", "inventory", "powers", "stats", "categories", "failures")
+
+def section_version(content) -> str:
+    """Short content hash of a rendered snapshot section"""
+    return hashlib.sha256(dumps(content, sort_keys=True)).hexdigest()[:16]
+
+def parse_section_versions(versions: Optional[str]) -> dict:
+    """Parse `section:version,...` stamps the client received from an earlier snapshot"""
+    known = {}
+    for pair in (versions or "").split(","):
+        section, _, version = pair.strip().partition(":")
+        if section and version:
+            known[section] = version
+    return known
+
+async def list_for_user(collection, user_id: str, encoder: DocumentEncoder) -> List[dict]:
+    """Every document of the user, read page by page so a section is never cut off"""
+    rows, after = [], None
+    while True:
+        docs, after = await fetch_page(collection, {"user_id": user_id}, after, PAGE_SIZE_MAX)
+        rows += encoder.rows(await hydrate_rows(collection.name, docs))
+        if after is None:
+            return rows
+
+@api_router.get("/users/{user_id}/snapshot")
+async def get_user_snapshot(user_id: str, include: Optional[str] = None, versions: Optional[str] = None):
+    """Everything the app loads on launch, in one request.
+    
+    `include` picks sections (default: all of SNAPSHOT_SECTIONS). Each
+    returned section is stamped in `versions`; pass those stamps back as
+    `versions=quests:<stamp>,...` and sections that haven't changed are left
+    out of the body, keeping only their stamp. `sync_version` is where delta
+    sync through /changes picks up from.
+    """
+    sections = SNAPSHOT_SECTIONS if include is None else [name.strip() for name in include.split(",") if name.strip()]
+    unknown = [name for name in sections if name not in SNAPSHOT_SECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sections: {', '.join(unknown)}")
+    
+    # Read before anything else so changes made during the snapshot are synced again
+    sync_version = await current_version(db, user_id)
+    snapshot = {}
+    if "failures" in sections:
+        # Failing quests changes them, so this runs before the quests are read
+        reports = await fail_due_quests(db, datetime.utcnow(), user_id)
+        await publish_schedule_events(event_bus, [], reports)
+        snapshot["failures"] = await drain_failure_notices(db, user_id)
+    
+    reads = {}
+    if "user" in sections or "categories" in sections:
+        reads["user"] = db.users.find_one({"id": user_id})
+    if "quests" in sections:
+        reads["quests"] = list_for_user(db.quests, user_id, quest_encoder)
+    if "inventory" in sections:
+        reads["inventory"] = list_for_user(db.inventory, user_id, inventory_encoder)
+    if "powers" in sections:
+        reads["powers"] = list_for_user(db.powers, user_id, power_encoder)
+    if "stats" in sections:
+        reads["stats"] = list_for_user(db.custom_stats, user_id, custom_stat_encoder)
+    results = dict(zip(reads, await asyncio.gather(*reads.values())))
+    
+    user = results.pop("user", None)
+    if user is None and ("user" in sections or "categories" in sections):
+        raise HTTPException(status_code=404, detail="User not found")
+    if "user" in sections:
+        snapshot["user"] = user_encoder.row(user)
+    if "categories" in sections:
+        snapshot["categories"] = user.get("custom_categories", {})
+    snapshot.update(results)
+    
+    known = parse_section_versions(versions)
+    body = {"sync_version": sync_version, "versions": {}}
+    for name in sections:
+        body["versions"][name] = section_version(snapshot[name])
+        if known.get(name) != body["versions"][name]:
+            body[name] = snapshot[name]
+    return json_response(body)
+
+# Synced collections and the snapshot section each one belongs to
+SYNC_SECTIONS = {
+    "users": ("user", user_encoder),
+    "quests": ("quests", quest_encoder),
+    "inventory": ("inventory", inventory_encoder),
+    "powers": ("powers", power_encoder),
+    "custom_stats": ("stats", custom_stat_encoder),
+}
+
+@api_router.get("/users/{user_id}/changes")
+async def get_user_changes(
+    user_id: str,
+    since: int = Query(0, ge=0),
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+):
+    """Documents written and deleted since the client's last sync.
+    
+    Start from the `sync_version` of a snapshot and pass back the returned
+    `version` as `since` next time; keep going while `has_more` is true.
+    A 410 means changes after `since` have expired: load a new snapshot.
+    """
+    try:
+        operations, version, has_more = await changes_since(db, user_id, since, limit)
+    except ResyncRequired:
+        raise HTTPException(status_code=410, detail=f"Changes after version {since} have expired; load a fresh snapshot")
+    
+    upserted = {collection: [] for collection in SYNC_SECTIONS}
+    deleted = {collection: [] for collection in SYNC_SECTIONS}
+    for (collection, doc_id), operation in operations.items():
+        (upserted if operation == UPSERT else deleted)[collection].append(doc_id)
+    
+    async def fetch(collection: str, doc_ids: List[str]) -> List[dict]:
+        query = {"id": {"$in": doc_ids}}
+        if collection != "users":
+            query["user_id"] = user_id
+        return await hydrate_rows(collection, await db[collection].find(query).to_list(None))
+    
+    reads = {collection: fetch(collection, doc_ids) for collection, doc_ids in upserted.items() if doc_ids}
+    results = dict(zip(reads, await asyncio.gather(*reads.values())))
+    
+    body = {"version": version, "has_more": has_more, "upserts": {}, "tombstones": {}}
+    for collection, (section, encoder) in SYNC_SECTIONS.items():
+        docs = results.get(collection, [])
+        # Anything deleted after its change was recorded is reported as deleted
+        found = {doc["id"] for doc in docs}
+        tombstones = deleted[collection] + [doc_id for doc_id in upserted[collection] if doc_id not in found]
+        if docs:
+            body["upserts"][section] = encoder.rows(docs)
+        if tombstones:
+            body["tombstones"][section] = tombstones
+    return json_response(body)
+
+EVENT_KEEPALIVE_SECONDS = 15
+
+@api_router.get("/users/{user_id}/events")
+async def stream_user_events(user_id: str, request: Request):
+    """Server-Sent Events stream of the user's quest, level, power and inventory events.
+    
+    Events only announce changes; after reconnecting, catch up with /changes.
+    """
+    subscription = event_bus.subscribe(user_id)
+    
+    async def stream():
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), EVENT_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    # Comment lines keep proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield event.encode()
+        finally:
+            subscription.close()
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
+# Export and import endpoints
+# One JSON document per line: a header, the user, their categories, then one
+# line per document of each exported collection.
+EXPORT_FORMAT = "brave-new-world/user-export"
+EXPORT_FORMAT_VERSION = 1
+EXPORT_BATCH_SIZE = 500
+EXPORTED_COLLECTIONS = {
+    "quests": (Quest, quest_encoder),
+    "inventory": (InventoryItem, inventory_encoder),
+    "powers": (PowerItem, power_encoder),
+    "custom_stats": (CustomStat, custom_stat_encoder),
+}
+# User fields an import may overwrite; identity fields stay the target user's own
+IMPORTED_USER_FIELDS = [name for name in User.model_fields if name not in ("id", "username", "created_at")]
+
+def export_line(record_type: str, data) -> bytes:
+    return dumps({"type": record_type, "data": data}) + b"\n"
+
+async def export_lines(collection: str, encoder: DocumentEncoder, docs: List[dict]) -> bytes:
+    # Exports are self-contained, so shop item fields are written out in full
+    return b"".join(export_line(collection, encoder.row(doc)) for doc in await hydrate_rows(collection, docs))
+
+@api_router.get("/users/{user_id}/export")
+async def export_user(user_id: str):
+    """Stream the user's full game state as NDJSON, one batch of documents at a time"""
+    user = await db.users.find_one({"id": user_id})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    async def stream():
+        yield export_line("header", {
+            "format": EXPORT_FORMAT,
+            "version": EXPORT_FORMAT_VERSION,
+            "exported_at": datetime.utcnow(),
+        })
+        yield export_line("user", user_encoder.row(user))
+        yield export_line("categories", user.get("custom_categories", {}))
+        for collection, (_, encoder) in EXPORTED_COLLECTIONS.items():
+            docs = []
+            cursor = db[collection].find({"user_id": user_id}).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+            async for doc in cursor:
+                docs.append(doc)
+                if len(docs) == EXPORT_BATCH_SIZE:
+                    yield await export_lines(collection, encoder, docs)
+                    docs = []
+            if docs:
+                yield await export_lines(collection, encoder, docs)
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson", headers={
+        "Content-Disposition": f'attachment; filename="{user_id}.ndjson"',
+    })
+
+async def ndjson_lines(request: Request):
+    """Split a streamed request body into lines without reading it all first"""
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    yield pending
+
+class ImportIdMap:
+    """New ids for imported documents.
+    
+    Ids are derived from the old id and a per-import namespace, so references
+    between imported documents (e.g. power evolutions) resolve without
+    remembering every id, even when they point at a later line.
+    """
+    def __init__(self):
+        self.namespace = uuid.uuid4()
+    
+    def __call__(self, old_id: Optional[str]) -> Optional[str]:
+        return str(uuid.uuid5(self.namespace, old_id)) if old_id else old_id
+
+async def import_custom_stats(user_id: str, stats: List[dict]) -> List[str]:
+    """Upsert imported stats by name: a stat the user already has takes the exported values. Returns the stat ids."""
+    by_name = {stat["name"]: stat for stat in stats}
+    await db.custom_stats.bulk_write([
+        UpdateOne(
+            {"user_id": user_id, "name": name},
+            {
+                "$set": {key: value for key, value in stat.items() if key not in ("id", "user_id", "name", "created_at")},
+                "$setOnInsert": {"id": stat["id"], "created_at": stat["created_at"]},
+            },
+            upsert=True
+        )
+        for name, stat in by_name.items()
+    ], ordered=False)
+    rows = await db.custom_stats.find({"user_id": user_id, "name": {"$in": list(by_name)}}, {"id": 1}).to_list(None)
+    return [row["id"] for row in rows]
+
+def remap_document(collection: str, doc: dict, user_id: str, new_id: ImportIdMap) -> dict:
+    doc = {**doc, "id": new_id(doc.get("id") or str(uuid.uuid4())), "user_id": user_id}
+    if collection == "powers":
+        doc["evolved_from"] = new_id(doc.get("evolved_from"))
+        if doc.get("evolved_abilities"):
+            doc["evolved_abilities"] = [new_id(power_id) for power_id in doc["evolved_abilities"]]
+    return doc
+
+@api_router.post("/users/{user_id}/import")
+async def import_user(user_id: str, request: Request):
+    """Load an NDJSON export into an existing user.
+    
+    The user's stats and categories are replaced by the exported ones and
+    the exported quests, inventory, powers and custom stats are added under
+    fresh ids, in batches of EXPORT_BATCH_SIZE documents. Inventory merges
+    into existing stacks and a custom stat the user already has is updated.
+    """
+    if not await db.users.find_one({"id": user_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    new_id = ImportIdMap()
+    batches = {collection: [] for collection in EXPORTED_COLLECTIONS}
+    imported = {collection: 0 for collection in EXPORTED_COLLECTIONS}
+    user_updates = {}
+    
+    async def flush(collection: str):
+        docs = batches[collection]
+        if docs:
+            if collection in REFERENCES:
+                docs = await slim_rows(collection, docs)
+            if collection == "inventory":
+                # Merge into the user's existing stacks
+                doc_ids = await add_to_inventory(user_id, docs)
+            elif collection == "custom_stats":
+                doc_ids = await import_custom_stats(user_id, docs)
+            else:
+                await db[collection].insert_many(docs, ordered=False)
+                doc_ids = [doc["id"] for doc in docs]
+            await record_upserts(db, user_id, collection, doc_ids)
+            imported[collection] += len(docs)
+            batches[collection] = []
+    
+    line_number = 0
+    header = None
+    async for line in ndjson_lines(request):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            record = loads(line)
+            record_type, data = record["type"], record["data"]
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail=f"Line {line_number}: not an export record")
+        
+        if header is None:
+            if record_type != "header" or data.get("format") != EXPORT_FORMAT:
+                raise HTTPException(status_code=400, detail="Not a user export")
+            if data.get("version", 0) > EXPORT_FORMAT_VERSION:
+                raise HTTPException(status_code=400, detail=f"Unsupported export version {data.get('version')}")
+            header = data
+        elif record_type == "user":
+            try:
+                user = User(**{**data, "username": "import"})
+            except ValidationError as e:
+                raise HTTPException(status_code=400, detail=f"Line {line_number}: invalid user: {e.errors()[0]['msg']}")
+            user_updates.update(user.model_dump(include=set(IMPORTED_USER_FIELDS)))
+        elif record_type == "categories":
+            user_updates["custom_categories"] = data
+        elif record_type in EXPORTED_COLLECTIONS:
+            model, _ = EXPORTED_COLLECTIONS[record_type]
+            try:
+                doc = model(**remap_document(record_type, data, user_id, new_id)).model_dump()
+            except ValidationError as e:
+                raise HTTPException(status_code=400, detail=f"Line {line_number}: invalid {record_type} document: {e.errors()[0]['msg']}")
+            batches[record_type].append(doc)
+            if len(batches[record_type]) >= EXPORT_BATCH_SIZE:
+                await flush(record_type)
+        else:
+            raise HTTPException(status_code=400, detail=f"Line {line_number}: unknown record type {record_type!r}")
+    
+    if header is None:
+        raise HTTPException(status_code=400, detail="Empty import")
+    for collection in EXPORTED_COLLECTIONS:
+        await flush(collection)
+    if imported["powers"]:
+        await power_facets.bump()
+    if user_updates:
+        await db.users.update_one({"id": user_id}, {"$set": user_updates})
+        await record_upserts(db, user_id, "users", [user_id])
+    
+    return {"message": "Import complete", "imported": imported}
+
+# Admin endpoints
+@api_router.get("/admin/index-report")
+async def get_index_report():
+    """Explain every registered query shape and flag any that still do a COLLSCAN"""
+    report = await index_report(db)
+    return {
+        "collscans": sum(1 for entry in report if entry.get("collscan")),
+        "queries": report
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Request latency, payload sizes and MongoDB commands per route, for Prometheus"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -1142,15 +2384,15 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", REPLAYED_HEADER],
 )
 
+# Added last so it wraps everything else, CORS included
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
@@ -0,0 +1,97 @@
+"""Shop item references on inventory and power rows.
+
+Inventory and power rows used to copy the name, description, stat boosts
+and consumable amounts of the shop item they came from. They now keep only
+the reference (``item_id`` / ``shop_item_id``) and their own state, and
+reads hydrate the shared fields from the shop catalog with one batched
+lookup, so editing a shop item shows up everywhere at once.
+
+The two kinds of row resolve conflicts differently. An inventory row has no
+state of its own in those fields, so the catalog always wins while the item
+exists. A power's description can be edited by its owner, so a value stored
+on the power wins and the catalog only fills in what is missing. Rows whose
+item isn't in the catalog (quest rewards, evolutions with no shop item, items
+an admin deleted) keep their own copy; deleting a shop item writes that copy
+onto the rows referencing it first (see ``frozen_updates``).
+
+Since a shop edit changes what those rows read as without writing them, the
+editor records a sync change for each referencing row of the collections
+``edited_collections`` names, so delta-sync clients fetch them again.
+"""
+from typing import Dict, Iterable, List, Optional
+
+# Row field -> shop item field
+INVENTORY_FIELDS = {
+    "item_name": "name",
+    "item_description": "description",
+    "item_type": "item_type",
+    "category": "category",
+    "stat_boost": "stat_boost",
+    "exp_amount": "exp_amount",
+    "gold_amount": "gold_amount",
+    "ap_amount": "ap_amount",
+    "is_synthesis_material": "is_synthesis_material",
+}
+# Powers keep name, category, tier and levels themselves: queries and evolution links use them
+POWER_FIELDS = {
+    "description": "description",
+    "stat_boost": "stat_boost",
+}
+
+REFERENCES = {
+    # collection: (reference field, shared fields, whether the catalog overrides stored values)
+    "inventory": ("item_id", INVENTORY_FIELDS, True),
+    "powers": ("shop_item_id", POWER_FIELDS, False),
+}
+
+
+def referenced_ids(collection: str, docs: Iterable[dict]) -> List[str]:
+    reference = REFERENCES[collection][0]
+    return list({doc[reference] for doc in docs if doc.get(reference)})
+
+
+def hydrate(collection: str, docs: List[dict], items: Dict[str, Optional[dict]]) -> List[dict]:
+    """The rows with their shared fields filled in from `items` (shop items by id)"""
+    reference, fields, catalog_wins = REFERENCES[collection]
+    hydrated = []
+    for doc in docs:
+        item = items.get(doc.get(reference))
+        if item is None:
+            hydrated.append(doc)
+            continue
+        doc = dict(doc)
+        for field, item_field in fields.items():
+            if catalog_wins or doc.get(field) is None:
+                doc[field] = item.get(item_field)
+        hydrated.append(doc)
+    return hydrated
+
+
+def slim(collection: str, doc: dict) -> dict:
+    """A new row without the shared fields, for an item that is in the catalog"""
+    _, fields, _ = REFERENCES[collection]
+    return {key: value for key, value in doc.items() if key not in fields}
+
+
+def edited_collections(old: dict, new: dict) -> List[str]:
+    """Collections whose rows read differently after a shop item changed from `old` to `new`"""
+    return [
+        collection
+        for collection, (_, fields, _) in REFERENCES.items()
+        if any(old.get(item_field) != new.get(item_field) for item_field in fields.values())
+    ]
+
+
+def frozen_updates(item: dict) -> Dict[str, tuple]:
+    """Per collection, the (filter, update) that copies a deleted shop item onto rows referencing it"""
+    updates = {}
+    for collection, (reference, fields, catalog_wins) in REFERENCES.items():
+        if catalog_wins:
+            update = {"$set": {field: item.get(item_field) for field, item_field in fields.items()}}
+        else:
+            update = [{"$set": {
+                field: {"$ifNull": [f"${field}", {"$literal": item.get(item_field)}]}
+                for field, item_field in fields.items()
+            }}]
+        updates[collection] = ({reference: item["id"]}, update)
+    return updates
@@ -0,0 +1,121 @@
+"""Filtered, sorted and paginated shop catalog search.
+
+``GET /api/shop/search`` lets the shop and synthesis screens ask the server
+for the slice of the catalog they show instead of downloading all of it. The
+filters are equality matches on the browse fields, a price range and a text
+search over name and description; each supported combination is backed by one
+of the compound indexes declared for ``shop_items`` in ``indexes.py``.
+
+Pages are keyset paginated on the sort field with ``_id`` as a tie-breaker,
+so the cursor carries the last row's sort value and ``_id``. Relevance order
+has no value a range query can resume from, so its cursor is an offset.
+"""
+import base64
+import json
+from typing import List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
+
+
+SEARCH_PAGE_SIZE_DEFAULT = 50
+RELEVANCE = "relevance"
+
+# sort option -> sort field and direction; _id breaks ties in the same direction
+SORTS = {
+    "name": ("name", ASCENDING),
+    "price": ("price", ASCENDING),
+    "-price": ("price", DESCENDING),
+    "newest": ("_id", DESCENDING),
+}
+
+
+def search_filter(
+    category: Optional[str] = None,
+    item_type: Optional[str] = None,
+    is_power: Optional[bool] = None,
+    power_category: Optional[str] = None,
+    power_tier: Optional[str] = None,
+    is_synthesis_material: Optional[bool] = None,
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None,
+    text: Optional[str] = None,
+) -> dict:
+    """Mongo filter for the given search parameters; None means "don't filter on it" """
+    query = {}
+    for field, value in (
+        ("category", category),
+        ("item_type", item_type),
+        ("is_power", is_power),
+        ("power_category", power_category),
+        ("power_tier", power_tier),
+        ("is_synthesis_material", is_synthesis_material),
+    ):
+        if value is not None:
+            query[field] = value
+    price = {}
+    if min_price is not None:
+        price["$gte"] = min_price
+    if max_price is not None:
+        price["$lte"] = max_price
+    if price:
+        query["price"] = price
+    if text:
+        query["$text"] = {"$search": text}
+    return query
+
+
+def sort_keys(sort: str) -> List[Tuple[str, object]]:
+    """The full sort specification for a sort option, ending with the _id tie-breaker"""
+    if sort == RELEVANCE:
+        return [("score", {"$meta": "textScore"}), ("_id", ASCENDING)]
+    field, direction = SORTS[sort]
+    if field == "_id":
+        return [("_id", direction)]
+    return [(field, direction), ("_id", direction)]
+
+
+def encode_cursor(sort: str, last: dict, offset: int) -> str:
+    """Opaque cursor for the page after `last`, which ended `offset` rows into the results"""
+    if sort == RELEVANCE:
+        position = {"offset": offset}
+    else:
+        position = {"after": [last.get(field) if field != "_id" else str(last["_id"]) for field, _ in sort_keys(sort)]}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+
+def decode_cursor(sort: str, cursor: str) -> Tuple[dict, int]:
+    """The extra filter and the number of rows to skip for the page at `cursor`.
+
+    Raises ValueError for a cursor that wasn't issued for this sort option.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(position, dict):
+        raise ValueError("Invalid cursor")
+
+    if sort == RELEVANCE:
+        offset = position.get("offset")
+        if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+            raise ValueError("Invalid cursor")
+        return {}, offset
+
+    keys = sort_keys(sort)
+    values = position.get("after")
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError("Invalid cursor")
+    try:
+        values[-1] = ObjectId(values[-1])
+    except (InvalidId, TypeError):
+        raise ValueError("Invalid cursor")
+
+    # (a, b) after (x, y) means a beyond x, or a equal to x and b beyond y
+    clauses = []
+    for i, (field, direction) in enumerate(keys):
+        clause = {keys[j][0]: values[j] for j in range(i)}
+        clause[field] = {"$gt" if direction == ASCENDING else "$lt": values[i]}
+        clauses.append(clause)
+    return (clauses[0] if len(clauses) == 1 else {"$or": clauses}), 0
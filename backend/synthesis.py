@@ -0,0 +1,78 @@
+"""Synthesis recipes and the ingredient index behind "what can I craft".
+
+A recipe turns given quantities of ingredient items (shop items marked
+``is_synthesis_material``) into a quantity of a result item. ``RecipeIndex``
+inverts the ``recipes`` collection into ingredient item id -> the recipes
+that use it, so the recipes a user can craft are found from their inventory
+counts alone: each stack the user holds votes for the recipes it satisfies,
+and a recipe is craftable once every one of its ingredients has voted. The
+work is proportional to the user's inventory, not to the number of recipes.
+
+``RecipeIndexCache`` keeps the index in memory and rebuilds it when the
+shared recipes version in ``cache_versions`` moves, which every recipe write
+bumps, so all workers see a new recipe on their next request.
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+VERSION_KEY = "recipes"
+
+
+def ingredient_totals(ingredients: Iterable[dict]) -> Dict[str, int]:
+    """Quantity needed per ingredient item id, merging repeated entries"""
+    totals: Dict[str, int] = defaultdict(int)
+    for ingredient in ingredients:
+        totals[ingredient["item_id"]] += ingredient.get("quantity", 1)
+    return dict(totals)
+
+
+class RecipeIndex:
+    def __init__(self, recipes: List[dict]):
+        self.recipes: Dict[str, dict] = {recipe["id"]: recipe for recipe in recipes}
+        # Ingredient item id -> [(recipe id, quantity the recipe needs)]
+        self.postings: Dict[str, List[Tuple[str, int]]] = defaultdict(list)
+        self.sizes: Dict[str, int] = {}
+        for recipe in recipes:
+            totals = ingredient_totals(recipe["ingredients"])
+            self.sizes[recipe["id"]] = len(totals)
+            for item_id, quantity in totals.items():
+                self.postings[item_id].append((recipe["id"], quantity))
+
+    def craftable(self, counts: Dict[str, int]) -> Dict[str, int]:
+        """Recipe id -> how many times it can be crafted from `counts` (item id -> quantity held)"""
+        satisfied: Dict[str, int] = defaultdict(int)
+        times: Dict[str, int] = {}
+        for item_id, held in counts.items():
+            for recipe_id, needed in self.postings.get(item_id, ()):
+                batches = held // needed
+                if batches:
+                    satisfied[recipe_id] += 1
+                    times[recipe_id] = min(times.get(recipe_id, batches), batches)
+        return {recipe_id: times[recipe_id] for recipe_id, votes in satisfied.items() if votes == self.sizes[recipe_id]}
+
+
+class RecipeIndexCache:
+    def __init__(self, db):
+        self.db = db
+        self._entry: Optional[Tuple[int, RecipeIndex]] = None
+
+    async def _read_version(self) -> int:
+        doc = await self.db.cache_versions.find_one({"_id": VERSION_KEY})
+        return doc["version"] if doc else 0
+
+    async def get(self) -> RecipeIndex:
+        # Read the version before the recipes, so a concurrent write can only cause a rebuild
+        version = await self._read_version()
+        if self._entry is not None and self._entry[0] == version:
+            return self._entry[1]
+
+        recipes = await self.db.recipes.find({}, {"_id": 0}).to_list(None)
+        index = RecipeIndex(recipes)
+        self._entry = (version, index)
+        return index
+
+    async def bump(self):
+        """Invalidate after a recipe write, here and on every other worker"""
+        self._entry = None
+        await self.db.cache_versions.update_one({"_id": VERSION_KEY}, {"$inc": {"version": 1}}, upsert=True)
@@ -0,0 +1,112 @@
+"""Database connections for the benchmarks, with a count of MongoDB round trips.
+
+Pass a regular ``mongodb://`` URL to benchmark against a real server; every
+command the driver sends is counted through a pymongo ``CommandListener``.
+``mongomock://`` runs against mongomock-motor instead, where each awaited
+collection call (or cursor drain) counts as one round trip. Latencies from
+the mock are only useful for comparing CPU work.
+"""
+import sys
+from collections import Counter
+from pathlib import Path
+
+from pymongo import monitoring
+
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = Counter()
+
+    def reset(self):
+        self.commands = Counter()
+
+    @property
+    def total(self) -> int:
+        return sum(self.commands.values())
+
+    def started(self, event):
+        self.commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# Collection methods that cost one round trip each on a real server
+ROUND_TRIP_METHODS = {
+    "aggregate", "bulk_write", "count_documents", "create_index", "create_indexes", "delete_many",
+    "delete_one", "distinct", "find_one", "find_one_and_delete", "find_one_and_update",
+    "insert_many", "insert_one", "replace_one", "update_many", "update_one",
+}
+
+
+class _CountingCursor:
+    def __init__(self, cursor, counter, command):
+        self._cursor = cursor
+        self._counter = counter
+        self._command = command
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name in ("sort", "limit", "skip", "batch_size"):
+            return lambda *args, **kwargs: _CountingCursor(attr(*args, **kwargs), self._counter, self._command)
+        if name == "to_list":
+            self._counter.commands[self._command] += 1
+        return attr
+
+    def __aiter__(self):
+        self._counter.commands[self._command] += 1
+        return self._cursor.__aiter__()
+
+
+class _CountingCollection:
+    def __init__(self, collection, counter):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name == "find":
+            return lambda *args, **kwargs: _CountingCursor(attr(*args, **kwargs), self._counter, "find")
+        if name in ROUND_TRIP_METHODS:
+            self._counter.commands[name] += 1
+        return attr
+
+
+class _CountingDatabase:
+    def __init__(self, database, counter):
+        self._database = database
+        self._counter = counter
+
+    def __getitem__(self, name):
+        return _CountingCollection(self._database[name], self._counter)
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+def connect(url: str, db_name: str):
+    """Return ``(client, db, counter)`` for the given URL"""
+    counter = CommandCounter()
+    if url.startswith("mongomock://"):
+        from mongomock_motor import AsyncMongoMockClient
+        client = AsyncMongoMockClient()
+        return client, _CountingDatabase(client[db_name], counter), counter
+
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(url, event_listeners=[counter])
+    return client, client[db_name], counter
+
+
+def use_mongomock():
+    """Make server.py's Motor client a mongomock-motor one; call before importing server"""
+    import motor.motor_asyncio
+    from mongomock_motor import AsyncMongoMockClient
+    motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Benchmark the quest failure pass: the original per-quest check_quest_failures
+loop against the bulk-write pass in quest_schedule.fail_due_quests.
+
+Every quest of the benchmark user has missed its deadline, so both
+implementations fail all of them and apply the demerits.
+
+Usage:
+    python benchmarks/bench_check_failures.py [--mongo-url URL] [--sizes 10 100 1000] [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from _mongo import connect
+
+from indexes import ensure_indexes
+from quest_schedule import fail_due_quests
+
+
+async def legacy_check_quest_failures(db, user_id: str, now: datetime):
+    """check_quest_failures as it was before the bulk rewrite"""
+    quests = await db.quests.find({"user_id": user_id}).to_list(1000)
+    failed_quests = []
+    total_demerits = {"xp": 0, "gold": 0, "ap": 0, "attributes": {}}
+
+    for quest in quests:
+        if quest.get("completed") or quest.get("repeat_frequency") == "limitless" or not quest.get("has_deadline"):
+            continue
+        deadline_hour, deadline_minute = map(int, quest.get("deadline_time", "00:00").split(":"))
+        today_deadline = now.replace(hour=deadline_hour, minute=deadline_minute, second=0, microsecond=0)
+        last_failed = quest.get("last_failed")
+        if last_failed and last_failed >= now.replace(hour=0, minute=0, second=0, microsecond=0):
+            continue
+        if not now > today_deadline:
+            continue
+
+        fail_updates = {"failed": True, "last_failed": now}
+        if quest.get("repeat_frequency") != "daily":
+            fail_updates["completed"] = True
+        await db.quests.update_one({"id": quest["id"]}, {"$set": fail_updates})
+
+        total_demerits["xp"] += quest.get("xp_reward", 0)
+        total_demerits["gold"] += quest.get("gold_reward", 0)
+        total_demerits["ap"] += quest.get("ap_reward", 0)
+        for attr, value in (quest.get("attribute_rewards") or {}).items():
+            total_demerits["attributes"][attr] = total_demerits["attributes"].get(attr, 0) + value
+        failed_quests.append(quest["id"])
+
+    if failed_quests:
+        user = await db.users.find_one({"id": user_id})
+        await db.users.update_one({"id": user_id}, {"$set": {
+            "xp": max(0, user.get("xp", 0) - total_demerits["xp"]),
+            "gold": max(0, user.get("gold", 0) - total_demerits["gold"]),
+            "ability_points": max(0, user.get("ability_points", 0) - total_demerits["ap"]),
+        }})
+        for attr, value in total_demerits["attributes"].items():
+            if attr not in ["strength", "intelligence", "vitality"]:
+                custom_stat = await db.custom_stats.find_one({"user_id": user_id, "name": attr})
+                if custom_stat:
+                    await db.custom_stats.update_one(
+                        {"id": custom_stat["id"]},
+                        {"$set": {"current": max(0, custom_stat.get("current", 0) - value)}}
+                    )
+    return failed_quests
+
+
+CUSTOM_STATS = ["focus", "discipline", "fitness", "creativity", "social"]
+
+
+async def seed_user(db, quest_count: int, now: datetime) -> str:
+    """Create a user with custom stats and `quest_count` overdue daily quests"""
+    user_id = str(uuid.uuid4())
+    await db.users.insert_one({
+        "id": user_id, "username": f"bench-{user_id}", "level": 5, "xp": 10_000_000,
+        "gold": 10_000_000, "ability_points": 10_000, "created_at": now,
+    })
+    await db.custom_stats.insert_many([
+        {"id": str(uuid.uuid4()), "user_id": user_id, "name": name, "color": "#fff",
+         "current": 1_000_000, "max": 100, "level": 1, "created_at": now}
+        for name in CUSTOM_STATS
+    ])
+    deadline = now - timedelta(minutes=1)
+    await db.quests.insert_many([
+        {
+            "id": str(uuid.uuid4()), "user_id": user_id, "title": f"Quest {i}", "description": "",
+            "difficulty": "custom", "xp_reward": 50, "gold_reward": 10, "ap_reward": 1,
+            "attribute_rewards": {CUSTOM_STATS[i % len(CUSTOM_STATS)]: 2, "strength": 1},
+            "completed": False, "failed": False, "repeat_frequency": "daily",
+            "has_deadline": True, "deadline_time": deadline.strftime("%H:%M"),
+            "next_reset_at": None, "next_deadline_at": deadline, "created_at": now - timedelta(days=1),
+        }
+        for i in range(quest_count)
+    ])
+    return user_id
+
+
+async def run(mongo_url: str, sizes, repeats: int):
+    db_name = f"bench_check_failures_{uuid.uuid4().hex[:8]}"
+    client, db, counter = connect(mongo_url, db_name)
+    # Keep the deadline in the past without crossing midnight
+    now = datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
+    results = []
+    try:
+        await ensure_indexes(db)
+        for size in sizes:
+            for name, implementation in (
+                ("legacy", lambda user_id: legacy_check_quest_failures(db, user_id, now)),
+                ("bulk", lambda user_id: fail_due_quests(db, now, user_id)),
+            ):
+                timings = []
+                for _ in range(repeats):
+                    user_id = await seed_user(db, size, now)
+                    counter.reset()
+                    started = time.perf_counter()
+                    await implementation(user_id)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    round_trips = counter.total
+                results.append({
+                    "quests": size,
+                    "implementation": name,
+                    "round_trips": round_trips,
+                    "latency_ms": round(min(timings), 2),
+                })
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.mongo_url, args.sizes, args.repeats))
+
+    print(f"{'quests':>8} {'implementation':>15} {'round trips':>12} {'latency ms':>11}")
+    for row in results:
+        print(f"{row['quests']:>8} {row['implementation']:>15} {row['round_trips']:>12} {row['latency_ms']:>11}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
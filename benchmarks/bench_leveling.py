@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark the leveling solvers against the while-loops they replaced.
+
+Usage:
+    python benchmarks/bench_leveling.py [--json out.json]
+"""
+import argparse
+import json
+import timeit
+
+import _mongo  # noqa: F401  (puts backend/ on sys.path)
+
+from leveling import custom_stat_level_up, level_up, xp_for_level
+
+
+def loop_level_up(level, xp):
+    levels_gained = 0
+    while xp >= xp_for_level(level):
+        xp -= xp_for_level(level)
+        level += 1
+        levels_gained += 1
+    return level, xp, levels_gained
+
+
+def loop_custom_stat_level_up(current, max_value, level):
+    while current >= max_value:
+        current -= max_value
+        level += 1
+        max_value = int(max_value * 1.1)
+    return current, max_value, level
+
+
+CASES = [
+    # (name, loop, solver, args)
+    ("xp: quest reward", loop_level_up, level_up, (12, 250)),
+    ("xp: 10M potion", loop_level_up, level_up, (1, 10_000_000)),
+    ("xp: 1B potion", loop_level_up, level_up, (1, 1_000_000_000)),
+    ("stat: quest reward", loop_custom_stat_level_up, custom_stat_level_up, (80, 100, 3)),
+    ("stat: 10M on a 100 bar", loop_custom_stat_level_up, custom_stat_level_up, (10_000_000, 100, 1)),
+    ("stat: 10M on a 5 bar", loop_custom_stat_level_up, custom_stat_level_up, (10_000_000, 5, 1)),
+]
+
+
+def measure(func, args, budget: float = 0.2) -> float:
+    """Best time per call in microseconds"""
+    timer = timeit.Timer(lambda: func(*args))
+    number, _ = timer.autorange()
+    number = max(1, int(number * budget / 0.2))
+    return min(timer.repeat(repeat=3, number=number)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'case':<24} {'loop us':>12} {'solver us':>10} {'speedup':>9}")
+    for name, loop, solver, case_args in CASES:
+        assert loop(*case_args) == solver(*case_args), name
+        loop_us = measure(loop, case_args)
+        solver_us = measure(solver, case_args)
+        results.append({"case": name, "loop_us": round(loop_us, 3), "solver_us": round(solver_us, 3)})
+        print(f"{name:<24} {loop_us:>12.2f} {solver_us:>10.2f} {loop_us / solver_us:>8.1f}x")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark GET /api/quests/{user_id}: validating every document through
+Quest(**doc) and the response_model (as the endpoint used to) against the
+DocumentEncoder + orjson rendering it uses now.
+
+Both routes run in-process through a TestClient against the same seeded
+user, so the reported CPU time per request covers routing, the Mongo read
+and serialization.
+
+Usage:
+    python benchmarks/bench_read_path.py [--mongo-url URL] [--quests 1000] [--requests 50] [--json out.json]
+"""
+import argparse
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+from _mongo import connect
+
+
+def seed_quests(db, quest_count: int):
+    async def seed():
+        user_id = str(uuid.uuid4())
+        now = datetime.utcnow()
+        await db.quests.insert_many([
+            {
+                "id": str(uuid.uuid4()), "user_id": user_id, "title": f"Quest {i}", "description": "Do the thing",
+                "difficulty": "medium", "xp_reward": 50, "gold_reward": 10, "ap_reward": 1,
+                "item_reward": None, "attribute_rewards": {"strength": 1, "focus": 2},
+                "completed": i % 3 == 0, "failed": False, "repeat_frequency": "daily",
+                "has_deadline": True, "deadline_time": "21:00", "last_completed": now - timedelta(hours=i % 24),
+                "last_failed": None, "next_reset_at": None, "next_deadline_at": now,
+                "created_at": now - timedelta(days=1), "completed_at": None,
+            }
+            for i in range(quest_count)
+        ])
+        return user_id
+    return seed
+
+
+def run(mongo_url: str, quest_count: int, requests: int):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    db_name = f"bench_read_path_{uuid.uuid4().hex[:8]}"
+    client, db, _ = connect(mongo_url, db_name)
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", db_name)
+    import server
+    # Serve the benchmark database from the real endpoint
+    server.db = db
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    app = FastAPI()
+
+    @app.get("/validated/{user_id}", response_model=List[server.Quest])
+    async def validated_quests(user_id: str):
+        quests = await db.quests.find({"user_id": user_id}).sort("_id", 1).to_list(server.PAGE_SIZE_MAX)
+        return [server.Quest(**quest) for quest in quests]
+
+    app.add_api_route("/encoded/{user_id}", server.get_user_quests, response_model=List[server.Quest])
+
+    results = []
+    try:
+        with TestClient(app) as http:
+            user_id = http.portal.call(seed_quests(db, quest_count))
+            for name in ("validated", "encoded"):
+                url = f"/{name}/{user_id}"
+                assert len(http.get(url).json()) == quest_count
+                cpu_started, wall_started = time.process_time(), time.perf_counter()
+                for _ in range(requests):
+                    http.get(url)
+                results.append({
+                    "quests": quest_count,
+                    "implementation": name,
+                    "cpu_ms_per_request": round((time.process_time() - cpu_started) * 1000 / requests, 2),
+                    "latency_ms": round((time.perf_counter() - wall_started) * 1000 / requests, 2),
+                })
+            http.portal.call(client.drop_database, db_name)
+    finally:
+        client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--quests", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.mongo_url, args.quests, args.requests)
+
+    print(f"{'quests':>8} {'implementation':>15} {'cpu ms/req':>11} {'latency ms':>11}")
+    for row in results:
+        print(f"{row['quests']:>8} {row['implementation']:>15} {row['cpu_ms_per_request']:>11} {row['latency_ms']:>11}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
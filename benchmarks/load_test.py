@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Load test the API with concurrent, realistic workloads.
+
+The server runs in-process (server.app behind an ASGI transport, its
+lifespan included) against --mongo-url, or is reached over HTTP with
+--base-url, in which case it must be serving the same --db-name. A
+population of users with quests, powers and custom stats plus a
+shop catalog is seeded first, then each scenario runs for --duration seconds
+with --concurrency clients:
+
+    launch           the app's launch fan-out: seven requests per user
+    launch_snapshot  the same data through the snapshot endpoint
+    complete         a storm of quest completions
+    shop             shop browsing with the occasional purchase
+
+Reported per scenario: throughput, p50/p95/p99 latency, errors and (against a
+real mongod, in-process) MongoDB commands per request. Results are written
+to --json and can be compared with an earlier run via --compare.
+
+Usage:
+    python benchmarks/load_test.py [--mongo-url URL | --base-url URL --db-name NAME]
+        [--users 50] [--quests 20] [--shop-items 100] [--powers 5]
+        [--concurrency 20] [--duration 10] [--scenarios launch complete shop]
+        [--json out.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import time
+import uuid
+from contextlib import AsyncExitStack
+from datetime import datetime
+from pathlib import Path
+
+from _mongo import CommandCounter, use_mongomock
+
+
+SCENARIOS = ("launch", "launch_snapshot", "complete", "shop")
+SHOP_CATEGORIES = ["weapons", "armor", "potions", "accessories", "materials"]
+POWER_CATEGORIES = ["Physical Abilities", "Mental Abilities", "Energy Manipulation"]
+STAT_NAMES = ["focus", "discipline", "fitness"]
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def seed(db, users: int, quests: int, shop_items: int, powers: int) -> dict:
+    """Insert the benchmark population directly and return the ids the scenarios pick from"""
+    now = datetime.utcnow()
+    items = [
+        {
+            "id": str(uuid.uuid4()), "name": f"Item {i}", "description": "Benchmark item", "price": 1,
+            "stock": None, "category": SHOP_CATEGORIES[i % len(SHOP_CATEGORIES)], "image_ids": None,
+            "is_power": False, "stat_boost": {"strength": 1}, "item_type": "weapon", "is_synthesis_material": False,
+        }
+        for i in range(shop_items)
+    ]
+    await db.shop_items.insert_many(items)
+
+    population = {"users": [], "quests": {}, "shop_items": [item["id"] for item in items]}
+    for u in range(users):
+        user_id = str(uuid.uuid4())
+        await db.users.insert_one({
+            "id": user_id, "username": f"load-{user_id}", "level": 1, "xp": 0, "gold": 10_000_000,
+            "strength": 10, "intelligence": 10, "vitality": 10, "ability_points": 5, "hp": 100, "max_hp": 100,
+            "mp": 50, "max_mp": 50, "player_class": "Adventurer", "title": "Novice", "created_at": now,
+            "custom_categories": {"Physical Abilities": ["Speed"]},
+        })
+        # Limitless quests can be completed over and over by the completion storm
+        user_quests = [
+            {
+                "id": str(uuid.uuid4()), "user_id": user_id, "title": f"Quest {q}", "description": "",
+                "difficulty": "medium", "xp_reward": 50, "gold_reward": 10, "ap_reward": 0, "item_reward": None,
+                "attribute_rewards": {STAT_NAMES[q % len(STAT_NAMES)]: 1}, "completed": False, "failed": False,
+                "repeat_frequency": "limitless", "has_deadline": False, "deadline_time": "00:00",
+                "last_completed": None, "last_failed": None, "next_reset_at": None, "next_deadline_at": None,
+                "created_at": now, "completed_at": None,
+            }
+            for q in range(quests)
+        ]
+        if user_quests:
+            await db.quests.insert_many(user_quests)
+        if powers:
+            await db.powers.insert_many([
+                {
+                    "id": str(uuid.uuid4()), "user_id": user_id, "shop_item_id": str(uuid.uuid4()),
+                    "name": f"Power {p}", "description": "", "power_category": POWER_CATEGORIES[p % len(POWER_CATEGORIES)],
+                    "power_tier": "Base", "current_level": 1, "max_level": 5, "is_evolved": False, "acquired_at": now,
+                }
+                for p in range(powers)
+            ])
+        await db.custom_stats.insert_many([
+            {"id": str(uuid.uuid4()), "user_id": user_id, "name": name, "color": "#fff", "current": 0,
+             "max": 100, "level": 1, "created_at": now}
+            for name in STAT_NAMES
+        ])
+        population["users"].append(user_id)
+        population["quests"][user_id] = [quest["id"] for quest in user_quests]
+    return population
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.routes = {}
+
+    async def request(self, http, route: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await http.request(method, url, **kwargs)
+            failed = response.status_code >= 400
+        except Exception:
+            failed = True
+        elapsed = (time.perf_counter() - started) * 1000
+        self.latencies.append(elapsed)
+        self.routes.setdefault(route, []).append(elapsed)
+        if failed:
+            self.errors += 1
+
+
+async def launch(http, recorder: Recorder, population: dict):
+    user_id = random.choice(population["users"])
+    await asyncio.gather(
+        recorder.request(http, "GET /users/{id}", "GET", f"/api/users/{user_id}"),
+        recorder.request(http, "GET /quests/{id}", "GET", f"/api/quests/{user_id}"),
+        recorder.request(http, "GET /inventory/{id}", "GET", f"/api/inventory/{user_id}"),
+        recorder.request(http, "GET /powers/{id}", "GET", f"/api/powers/{user_id}"),
+        recorder.request(http, "GET /users/{id}/stats", "GET", f"/api/users/{user_id}/stats"),
+        recorder.request(http, "GET /users/{id}/categories", "GET", f"/api/users/{user_id}/categories"),
+        recorder.request(http, "POST /quests/{id}/check-failures", "POST", f"/api/quests/{user_id}/check-failures"),
+    )
+
+
+async def launch_snapshot(http, recorder: Recorder, population: dict):
+    user_id = random.choice(population["users"])
+    await recorder.request(http, "GET /users/{id}/snapshot", "GET", f"/api/users/{user_id}/snapshot")
+
+
+async def complete(http, recorder: Recorder, population: dict):
+    user_id = random.choice(population["users"])
+    if population["quests"][user_id]:
+        quest_id = random.choice(population["quests"][user_id])
+        await recorder.request(http, "POST /quests/{id}/complete", "POST", f"/api/quests/{quest_id}/complete")
+
+
+async def shop(http, recorder: Recorder, population: dict):
+    roll = random.random()
+    if roll < 0.6:
+        await recorder.request(http, "GET /shop", "GET", "/api/shop")
+    elif roll < 0.9:
+        await recorder.request(http, "GET /shop?fields", "GET", "/api/shop", params={"fields": "name,price,thumbnail"})
+    else:
+        await recorder.request(http, "POST /shop/purchase", "POST", "/api/shop/purchase", json={
+            "user_id": random.choice(population["users"]),
+            "item_id": random.choice(population["shop_items"]),
+        })
+
+
+SCENARIO_FUNCTIONS = {
+    "launch": launch,
+    "launch_snapshot": launch_snapshot,
+    "complete": complete,
+    "shop": shop,
+}
+
+
+async def run_scenario(http, name: str, population: dict, concurrency: int, duration: float, counter) -> dict:
+    recorder = Recorder()
+    scenario = SCENARIO_FUNCTIONS[name]
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        while time.perf_counter() < deadline:
+            await scenario(http, recorder, population)
+
+    if counter is not None:
+        counter.reset()
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(recorder.latencies)
+    requests = len(latencies)
+    return {
+        "scenario": name,
+        "requests": requests,
+        "errors": recorder.errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "mongo_ops_per_request": round(counter.total / requests, 2) if counter is not None and requests else None,
+        "routes": {
+            route: {"requests": len(values), "p50_ms": round(percentile(sorted(values), 0.50), 2)}
+            for route, values in sorted(recorder.routes.items())
+        },
+    }
+
+
+async def run(args) -> dict:
+    import httpx
+
+    # server.py configures INFO logging; keep per-request lines out of the report
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    counter = None
+    if args.base_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        mongo_client = AsyncIOMotorClient(args.mongo_url)
+        db = mongo_client[args.db_name]
+        transport = None
+    else:
+        if args.mongo_url.startswith("mongomock://"):
+            use_mongomock()
+            os.environ["MONGO_URL"] = "mongodb://localhost:27017"
+        else:
+            from pymongo import monitoring
+            # Registered before server.py creates its client, so every command it sends is counted
+            counter = CommandCounter()
+            monitoring.register(counter)
+            os.environ["MONGO_URL"] = args.mongo_url
+        os.environ["DB_NAME"] = args.db_name
+        # One process: nothing to invalidate across workers, and no background scheduler noise
+        os.environ.setdefault("SHOP_CACHE_INVALIDATION", "none")
+        os.environ.setdefault("QUEST_SCHEDULER_ENABLED", "false")
+        import server
+        db = server.db
+        mongo_client = server.client
+        transport = httpx.ASGITransport(app=server.app)
+
+    results = {
+        "started_at": datetime.utcnow().isoformat(),
+        "git_commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("json", "compare")},
+        "scenarios": [],
+    }
+    http = httpx.AsyncClient(transport=transport, base_url=args.base_url or "http://load-test", timeout=60)
+    async with AsyncExitStack() as stack:
+        if transport is not None:
+            # Runs the app's lifespan: indexes, caches and, on exit, closing the client
+            await stack.enter_async_context(server.app.router.lifespan_context(server.app))
+        else:
+            stack.callback(mongo_client.close)
+        stack.push_async_callback(mongo_client.drop_database, args.db_name)
+        stack.push_async_callback(http.aclose)
+
+        population = await seed(db, args.users, args.quests, args.shop_items, args.powers)
+        for name in args.scenarios:
+            results["scenarios"].append(await run_scenario(http, name, population, args.concurrency, args.duration, counter))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: dict, baseline: dict = None):
+    previous = {row["scenario"]: row for row in (baseline or {}).get("scenarios", [])}
+    print(f"{'scenario':>16} {'requests':>9} {'errors':>7} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ops/req':>8}")
+    for row in results["scenarios"]:
+        ops = row["mongo_ops_per_request"]
+        print(f"{row['scenario']:>16} {row['requests']:>9} {row['errors']:>7} {row['throughput_rps']:>8} "
+              f"{row['p50_ms']:>8} {row['p95_ms']:>8} {row['p99_ms']:>8} {ops if ops is not None else '-':>8}")
+        before = previous.get(row["scenario"])
+        if before:
+            deltas = []
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+                if before[key]:
+                    deltas.append(f"{key} {100 * (row[key] - before[key]) / before[key]:+.1f}%")
+            print(f"{'':>16} vs baseline: {', '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--base-url", help="Load test a running server instead of booting one in-process")
+    parser.add_argument("--db-name", default=f"load_test_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--quests", type=int, default=20, help="Quests per user")
+    parser.add_argument("--shop-items", type=int, default=100)
+    parser.add_argument("--powers", type=int, default=5, help="Powers per user")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per scenario")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the request mix")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare against")
+    args = parser.parse_args()
+    if args.base_url and args.mongo_url.startswith("mongomock://"):
+        parser.error("--base-url needs a real --mongo-url to seed the server's database")
+
+    random.seed(args.seed)
+    results = asyncio.run(run(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,7 @@ interface InventoryItem {
   gold_amount?: number;
   ap_amount?: number;
   is_synthesis_material?: boolean;
+  quantity?: number;
 }
 
 export default function InventoryScreen() {
@@ -274,7 +275,9 @@ export default function InventoryScreen() {
                 
                 <View style={styles.itemInfo}>
                   <View style={styles.itemHeader}>
-                    <Text style={[styles.itemName, { color: statusTheme.colors.text }]}>{item.item_name}</Text>
+                    <Text style={[styles.itemName, { color: statusTheme.colors.text }]}>
+                      {item.item_name}{(item.quantity ?? 1) > 1 ? ` ×${item.quantity}` : ''}
+                    </Text>
                     <View style={[styles.typeBadge, { backgroundColor: getItemColor(item.item_type) + '20' }]}>
                       <Text style={[styles.typeText, { color: getItemColor(item.item_type) }]}>
                         {item.item_type}
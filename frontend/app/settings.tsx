@@ -44,7 +44,7 @@ export default function SettingsScreen() {
       if (inventoryResponse.ok) {
         const inventory = await inventoryResponse.json();
         for (const item of inventory) {
-          await fetch(`${API_URL}/api/inventory/${item.id}`, { method: 'DELETE' });
+          await fetch(`${API_URL}/api/inventory/${item.id}?quantity=${item.quantity || 1}`, { method: 'DELETE' });
         }
       }
       
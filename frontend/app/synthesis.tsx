@@ -51,7 +51,7 @@ export default function SynthesisScreen() {
     }
   };
 
-  const handleSynthesize = () => {
+  const handleSynthesize = async () => {
     if (selectedIngredients.length === 0) {
       Alert.alert('Error', 'Please select at least one ingredient item');
       return;
@@ -72,6 +72,26 @@ export default function SynthesisScreen() {
       .join(', ');
     const resultName = shopItems.find(item => item.id === selectedResult)?.name;
 
+    try {
+      const response = await fetch(`${API_URL}/api/synthesis/recipes`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          ingredients: selectedIngredients.map(id => ({ item_id: id, quantity: 1 })),
+          result_item_id: selectedResult,
+        }),
+      });
+      if (!response.ok) {
+        const error = await response.json();
+        Alert.alert('Error', error.detail || 'Failed to save recipe');
+        return;
+      }
+    } catch (error) {
+      console.error('Failed to save recipe:', error);
+      Alert.alert('Error', 'Failed to save recipe');
+      return;
+    }
+
     Alert.alert(
       'Synthesis Recipe Created!',
       `Combining: ${ingredientNames}\nResults in: ${resultName}\n\nThis recipe has been saved!`,
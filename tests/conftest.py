@@ -0,0 +1,39 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend modules are imported flat, the same way uvicorn loads server.py
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+@pytest.fixture(scope="session")
+def server():
+    """server.py running against mongomock-motor instead of a MongoDB server"""
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "brave_new_world_test")
+    # mongomock has no change streams, and tests drive the scheduler themselves
+    os.environ["SHOP_CACHE_INVALIDATION"] = "none"
+    os.environ["QUEST_SCHEDULER_ENABLED"] = "false"
+
+    from mongomock_motor import AsyncMongoMockClient
+    import mongo_pool
+    mongo_pool.AsyncIOMotorClient = AsyncMongoMockClient
+    import server
+    return server
+
+
+@pytest.fixture
+def api(server):
+    """A test client for the API on an empty database"""
+    from fastapi.testclient import TestClient
+
+    # Drop before startup, which creates the indexes again
+    asyncio.run(server.client.drop_database(os.environ["DB_NAME"]))
+    server.catalog_cache.invalidate()
+    with TestClient(server.app) as client:
+        yield client
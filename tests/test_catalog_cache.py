@@ -0,0 +1,77 @@
+"""The shop catalog cache: invalidation on writes, across workers, and ETag revalidation."""
+import asyncio
+
+from catalog_cache import CatalogCache
+
+
+def shop_item(name, **fields):
+    return {"name": name, "description": name, "price": 10, "item_type": "weapon", **fields}
+
+
+def shop_names(response):
+    return [item["name"] for item in response.json()]
+
+
+def test_shop_writes_invalidate_cached_pages(api):
+    sword_id = api.post("/api/shop", json=shop_item("Sword")).json()["id"]
+    assert shop_names(api.get("/api/shop")) == ["Sword"]
+
+    shield_id = api.post("/api/shop", json=shop_item("Shield")).json()["id"]
+    assert shop_names(api.get("/api/shop")) == ["Sword", "Shield"]
+
+    api.put(f"/api/shop/{sword_id}", json=shop_item("Blade"))
+    assert shop_names(api.get("/api/shop")) == ["Blade", "Shield"]
+
+    api.delete(f"/api/shop/{shield_id}")
+    assert shop_names(api.get("/api/shop")) == ["Blade"]
+
+
+def test_unchanged_pages_revalidate_with_304(api):
+    api.post("/api/shop", json=shop_item("Sword"))
+    first = api.get("/api/shop")
+    etag = first.headers["ETag"]
+
+    revalidated = api.get("/api/shop", headers={"If-None-Match": etag})
+    assert (revalidated.status_code, revalidated.content, revalidated.headers["ETag"]) == (304, b"", etag)
+
+    api.post("/api/shop", json=shop_item("Shield"))
+    changed = api.get("/api/shop", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert shop_names(changed) == ["Sword", "Shield"]
+
+
+def test_pages_rendered_during_a_write_are_not_cached():
+    cache = CatalogCache(db=None, invalidation="none")
+    generation = cache.generation
+    cache.invalidate()
+
+    cache.put(("page",), generation, b"[]", {})
+    assert cache.get(("page",)) is None
+    cache.put(("page",), cache.generation, b"[]", {})
+    assert cache.get(("page",)).body == b"[]"
+
+
+def test_polling_workers_drop_their_cache_after_another_worker_writes(api, server):
+    db = server.db
+
+    async def scenario():
+        reader = CatalogCache(db, invalidation="poll", poll_interval=0.01)
+        writer = CatalogCache(db, invalidation="poll")
+        await db.shop_items.insert_one({"id": "sword", "name": "Sword"})
+        reader.start()
+        try:
+            await asyncio.sleep(0.05)
+            reader.put(("page",), reader.generation, b"[]", {})
+            assert (await reader.items(["sword"]))["sword"]["name"] == "Sword"
+
+            await db.shop_items.update_one({"id": "sword"}, {"$set": {"name": "Blade"}})
+            await writer.bump()
+            await asyncio.sleep(0.05)
+
+            assert reader.get(("page",)) is None
+            assert (await reader.items(["sword"]))["sword"]["name"] == "Blade"
+        finally:
+            await reader.stop()
+
+    api.portal.call(scenario)
@@ -0,0 +1,60 @@
+"""Delta sync through /changes once old log entries have expired."""
+from datetime import datetime, timedelta
+
+from change_log import GAP_TIMEOUT
+
+
+def create_user(api):
+    return api.post("/api/users", json={"username": "hero"}).json()["id"]
+
+
+def create_stat(api, user_id, name):
+    stat = {"user_id": user_id, "name": name, "color": "#fff", "current": 0, "max": 100}
+    return api.post(f"/api/users/{user_id}/stats", json=stat).json()["id"]
+
+
+def changes(api, user_id, since):
+    return api.get(f"/api/users/{user_id}/changes", params={"since": since})
+
+
+def expire(api, server, user_id, through_version):
+    """What the TTL index does to entries up to `through_version`"""
+    api.portal.call(server.db.user_changes.delete_many, {"user_id": user_id, "version": {"$lte": through_version}})
+
+
+def age_log(api, server, user_id):
+    past = datetime.utcnow() - GAP_TIMEOUT - timedelta(seconds=1)
+    api.portal.call(server.db.user_changes.update_many, {"user_id": user_id}, {"$set": {"at": past}})
+    api.portal.call(server.db.sync_versions.update_one, {"_id": user_id}, {"$set": {"updated_at": past}})
+
+
+def test_clients_behind_the_oldest_kept_change_must_resync(api, server):
+    user_id = create_user(api)
+    stat_ids = [create_stat(api, user_id, name) for name in ("Strength", "Wisdom", "Charm")]
+    version = api.get(f"/api/users/{user_id}/snapshot").json()["sync_version"]
+    age_log(api, server, user_id)
+    expire(api, server, user_id, version - 2)
+
+    assert changes(api, user_id, version - 3).status_code == 410
+    # The change right after `since` is still kept
+    body = changes(api, user_id, version - 2).json()
+    assert (body["version"], [stat["id"] for stat in body["upserts"]["stats"]]) == (version, stat_ids[1:])
+
+    expire(api, server, user_id, version)
+    assert changes(api, user_id, version - 1).status_code == 410
+    assert changes(api, user_id, version).json()["version"] == version
+
+
+def test_recent_gaps_wait_for_their_writer_instead_of_resyncing(api, server):
+    user_id = create_user(api)
+    create_stat(api, user_id, "Strength")
+    create_stat(api, user_id, "Wisdom")
+    version = api.get(f"/api/users/{user_id}/snapshot").json()["sync_version"]
+    # The change before the last one is still being recorded
+    expire(api, server, user_id, version - 1)
+
+    body = changes(api, user_id, version - 2).json()
+    assert (body["version"], body["upserts"]) == (version - 2, {})
+
+    age_log(api, server, user_id)
+    assert changes(api, user_id, version - 2).status_code == 410
@@ -0,0 +1,67 @@
+"""Custom stat names are unique per user."""
+import uuid
+
+
+def create_user(api, username="hero"):
+    return api.post("/api/users", json={"username": username}).json()["id"]
+
+
+def create_stat(api, user_id, name, current=0):
+    stat = {"user_id": user_id, "name": name, "color": "#fff", "current": current, "max": 100}
+    return api.post(f"/api/users/{user_id}/stats", json=stat)
+
+
+def stats_by_name(api, user_id):
+    return {stat["name"]: stat for stat in api.get(f"/api/users/{user_id}/stats").json()}
+
+
+def test_import_updates_stats_the_user_already_has(api):
+    source_id, target_id = create_user(api), create_user(api, "twin")
+    create_stat(api, source_id, "Strength", current=40)
+    create_stat(api, source_id, "Wisdom", current=7)
+    existing = create_stat(api, target_id, "Strength", current=1).json()
+    export = api.get(f"/api/users/{source_id}/export").content
+
+    for _ in range(2):
+        assert api.post(f"/api/users/{target_id}/import", content=export).status_code == 200
+
+    stats = stats_by_name(api, target_id)
+    assert {name: stat["current"] for name, stat in stats.items()} == {"Strength": 40, "Wisdom": 7}
+    assert stats["Strength"]["id"] == existing["id"]
+
+
+def test_creating_or_renaming_to_a_taken_name_is_rejected(api):
+    user_id = create_user(api)
+    create_stat(api, user_id, "Strength")
+    wisdom = create_stat(api, user_id, "Wisdom").json()
+
+    assert create_stat(api, user_id, "Strength").status_code == 400
+    response = api.put(f"/api/users/{user_id}/stats/{wisdom['id']}", json={"name": "Strength"})
+    assert response.status_code == 400
+    assert sorted(stats_by_name(api, user_id)) == ["Strength", "Wisdom"]
+    # Another user may use the same name
+    assert create_stat(api, create_user(api, "rival"), "Strength").status_code == 200
+
+
+def test_migration_renames_duplicates_before_the_unique_index(api, server):
+    db = server.db
+    api.portal.call(db.custom_stats.drop_index, "user_id_name")
+    # The index as it was before names had to be unique
+    api.portal.call(lambda: db.custom_stats.create_index([("user_id", 1), ("name", 1)], name="user_id_name"))
+    user_id = create_user(api)
+    create_stat(api, user_id, "Strength (2)")
+    rows = [
+        {"id": str(uuid.uuid4()), "user_id": user_id, "name": "Strength", "color": "#fff", "current": current, "max": 100}
+        for current in (1, 2, 3)
+    ]
+    api.portal.call(db.custom_stats.insert_many, rows)
+
+    api.portal.call(server.migrate_custom_stat_names)
+    api.portal.call(server.ensure_indexes, db)
+
+    stats = stats_by_name(api, user_id)
+    assert {name: stat["current"] for name, stat in stats.items() if name != "Strength (2)"} == {
+        "Strength": 1, "Strength (3)": 2, "Strength (4)": 3,
+    }
+    assert stats["Strength"]["id"] == rows[0]["id"]
+    assert api.portal.call(db.custom_stats.index_information)["user_id_name"].get("unique")
@@ -0,0 +1,95 @@
+"""Idempotency keys and the gold guard on purchases."""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from idempotency import IDEMPOTENCY_LEASE_SECONDS
+
+
+def create_user(api):
+    return api.post("/api/users", json={"username": "hero"}).json()["id"]
+
+
+def set_gold(api, server, user_id, gold):
+    api.portal.call(server.db.users.update_one, {"id": user_id}, {"$set": {"gold": gold}})
+
+
+def create_item(api, price=60):
+    item = {"name": "Sword", "description": "Sharp", "price": price, "item_type": "weapon"}
+    return api.post("/api/shop", json=item).json()["id"]
+
+
+def purchase(api, user_id, item_id, key=None):
+    headers = {"Idempotency-Key": key} if key else {}
+    return api.post("/api/shop/purchase", json={"user_id": user_id, "item_id": item_id}, headers=headers)
+
+
+def inventory(api, user_id):
+    return [(row["item_name"], row["quantity"]) for row in api.get(f"/api/inventory/{user_id}").json()]
+
+
+def test_retry_replays_the_stored_response_without_buying_again(api):
+    user_id, item_id = create_user(api), create_item(api, price=30)
+
+    first = purchase(api, user_id, item_id, key="k1")
+    retry = purchase(api, user_id, item_id, key="k1")
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.content == first.content
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert api.get(f"/api/users/{user_id}").json()["gold"] == 70
+    assert inventory(api, user_id) == [("Sword", 1)]
+
+
+def test_client_errors_are_replayed_too(api, server):
+    user_id, item_id = create_user(api), create_item(api)
+    set_gold(api, server, user_id, 10)
+
+    assert purchase(api, user_id, item_id, key="k1").status_code == 400
+    set_gold(api, server, user_id, 100)
+    retry = purchase(api, user_id, item_id, key="k1")
+
+    assert retry.status_code == 400
+    assert retry.json() == {"detail": "Not enough gold"}
+    assert inventory(api, user_id) == []
+
+
+def test_reusing_a_key_for_a_different_request_is_rejected(api):
+    user_id, item_id = create_user(api), create_item(api, price=10)
+    other_item_id = create_item(api, price=20)
+
+    assert purchase(api, user_id, item_id, key="k1").status_code == 200
+    response = purchase(api, user_id, other_item_id, key="k1")
+
+    assert response.status_code == 422
+    assert api.get(f"/api/users/{user_id}").json()["gold"] == 90
+
+
+def test_unfinished_claim_conflicts_until_its_lease_runs_out(api, server):
+    user_id, item_id = create_user(api), create_item(api, price=10)
+    assert purchase(api, user_id, item_id, key="k1").status_code == 200
+
+    # The first request with k2 claimed the key, then its worker died
+    claim = dict(api.portal.call(server.db.idempotency.find_one, {"_id": {"$regex": " k1$"}}))
+    claim.update(_id=claim["_id"].replace("k1", "k2"), status_code=None, claimed_at=datetime.utcnow())
+    claim.pop("body")
+    api.portal.call(server.db.idempotency.insert_one, claim)
+    assert purchase(api, user_id, item_id, key="k2").status_code == 409
+
+    expired = datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS + 1)
+    api.portal.call(server.db.idempotency.update_one, {"_id": claim["_id"]}, {"$set": {"claimed_at": expired}})
+    assert purchase(api, user_id, item_id, key="k2").status_code == 200
+    assert purchase(api, user_id, item_id, key="k2").headers["Idempotent-Replayed"] == "true"
+    assert inventory(api, user_id) == [("Sword", 2)]
+
+
+def test_concurrent_purchases_cannot_overspend(api):
+    # New users start with 100 gold
+    user_id, item_id = create_user(api), create_item(api, price=60)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        responses = list(pool.map(lambda _: purchase(api, user_id, item_id), range(2)))
+
+    assert sorted(response.status_code for response in responses) == [200, 400]
+    assert api.get(f"/api/users/{user_id}").json()["gold"] == 40
+    assert inventory(api, user_id) == [("Sword", 1)]
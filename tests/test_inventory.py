@@ -0,0 +1,168 @@
+"""Inventory stacks: purchases, the stacking migration and batch item use."""
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+def create_user(api):
+    return api.post("/api/users", json={"username": "hero"}).json()["id"]
+
+
+def create_item(api, name="Potion", price=1, item_type="potion", **fields):
+    item = {"name": name, "description": f"A {name}", "price": price, "item_type": item_type, **fields}
+    return api.post("/api/shop", json=item).json()["id"]
+
+
+def buy(api, user_id, item_id, count):
+    for _ in range(count):
+        assert purchase(api, user_id, item_id).status_code == 200
+    return stacks_by_name(api, user_id)
+
+
+def stacks_by_name(api, user_id):
+    return {row["item_name"]: row for row in api.get(f"/api/inventory/{user_id}").json()}
+
+
+def use_batch(api, user_id, items):
+    return api.post("/api/inventory/use-batch", json={"user_id": user_id, "items": items})
+
+
+def purchase(api, user_id, item_id):
+    return api.post("/api/shop/purchase", json={"user_id": user_id, "item_id": item_id})
+
+
+def stacks(api, server, user_id):
+    rows = api.portal.call(lambda: server.db.inventory.find({"user_id": user_id}).sort("_id", 1).to_list(None))
+    return {row["item_id"]: row for row in rows}
+
+
+def legacy_row(user_id, item_id, name, **fields):
+    """An inventory row as written before stacking: one per item, no quantity"""
+    return {
+        "id": str(uuid.uuid4()), "user_id": user_id, "item_id": item_id, "item_name": name,
+        "item_description": name, "item_type": "potion", "category": "general", **fields,
+    }
+
+
+def test_repeated_purchases_stack_into_one_row(api, server):
+    user_id, item_id = create_user(api), create_item(api)
+
+    for _ in range(3):
+        assert purchase(api, user_id, item_id).status_code == 200
+
+    rows = api.get(f"/api/inventory/{user_id}").json()
+    assert [(row["item_name"], row["quantity"]) for row in rows] == [("Potion", 3)]
+    assert api.get(f"/api/users/{user_id}").json()["gold"] == 97
+
+
+def test_migration_merges_duplicate_rows_once(api, server):
+    db = server.db
+    api.portal.call(db.inventory.drop_index, "user_id_item_id")
+    user_id, other_user_id = create_user(api), str(uuid.uuid4())
+    rows = [
+        legacy_row(user_id, "potion", "Potion"),
+        legacy_row(user_id, "potion", "Potion"),
+        legacy_row(user_id, "potion", "Potion", quantity=2),
+        legacy_row(user_id, "ether", "Ether"),
+        legacy_row(other_user_id, "potion", "Potion"),
+        # Quest rewards had random item ids; the migration derives them from the name
+        legacy_row(user_id, str(uuid.uuid4()), "Trophy", item_type="quest_reward"),
+        legacy_row(user_id, str(uuid.uuid4()), "Trophy", item_type="quest_reward"),
+    ]
+    api.portal.call(db.inventory.insert_many, rows)
+
+    api.portal.call(server.migrate_inventory_stacks)
+    merged = stacks(api, server, user_id)
+    assert {row["item_name"]: row["quantity"] for row in merged.values()} == {"Potion": 4, "Ether": 1, "Trophy": 2}
+    # The oldest row of each stack is the one kept
+    assert merged["potion"]["id"] == rows[0]["id"]
+    assert merged[server.quest_reward_item_id("Trophy")]["quantity"] == 2
+    assert [row["quantity"] for row in stacks(api, server, other_user_id).values()] == [1]
+
+    api.portal.call(server.migrate_inventory_stacks)
+    assert stacks(api, server, user_id) == merged
+
+
+def test_batch_use_sums_effects_and_levels_up_once(api):
+    user_id = create_user(api)
+    buy(api, user_id, create_item(api, "Tome", item_type="exp", exp_amount=150), 2)
+    buy(api, user_id, create_item(api, "Coin", item_type="gold", gold_amount=5), 3)
+    owned = buy(api, user_id, create_item(api, "Sword", item_type="weapon"), 1)
+
+    response = use_batch(api, user_id, {
+        owned["Tome"]["id"]: 2,
+        # More than the stack holds uses the whole stack
+        owned["Coin"]["id"]: 10,
+        owned["Sword"]["id"]: 1,
+        "missing": 1,
+    })
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [(result["item_id"], result["status"], result.get("used")) for result in body["results"]] == [
+        (owned["Tome"]["id"], "used", 2),
+        (owned["Coin"]["id"], "used", 3),
+        (owned["Sword"]["id"], "not_consumable", None),
+        ("missing", "not_found", None),
+    ]
+    # 300 XP from level 1 is exactly two levels (100 + 200)
+    assert (body["exp_gained"], body["gold_gained"], body["levels_gained"]) == (300, 15, 2)
+    user = body["user"]
+    assert (user["level"], user["xp"]) == (3, 0)
+    # 100 starting gold, 6 spent, 15 from coins, 50 per level
+    assert user["gold"] == 100 - 6 + 15 + 2 * 50
+    # 5 starting AP, 5 per level
+    assert user["ability_points"] == 5 + 2 * 5
+    assert list(stacks_by_name(api, user_id)) == ["Sword"]
+
+
+def test_batch_use_of_part_of_a_stack_keeps_the_rest(api):
+    user_id = create_user(api)
+    owned = buy(api, user_id, create_item(api, "Tome", item_type="exp", exp_amount=10), 5)
+
+    body = use_batch(api, user_id, {owned["Tome"]["id"]: 2}).json()
+
+    assert body["results"] == [{"item_id": owned["Tome"]["id"], "status": "used", "used": 2, "remaining": 3}]
+    assert (body["exp_gained"], body["levels_gained"]) == (20, 0)
+    assert stacks_by_name(api, user_id)["Tome"]["quantity"] == 3
+
+
+def test_concurrent_batches_never_use_more_than_the_stack(api):
+    user_id = create_user(api)
+    owned = buy(api, user_id, create_item(api, "Tome", item_type="exp", exp_amount=10), 3)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        bodies = [
+            response.json()
+            for response in pool.map(lambda _: use_batch(api, user_id, {owned["Tome"]["id"]: 2}), range(2))
+        ]
+
+    # The second batch may find fewer than it asked for and use nothing; either way nothing is used twice
+    used = sum(result.get("used", 0) for body in bodies for result in body["results"])
+    assert 2 <= used <= 3
+    assert sum(body["exp_gained"] for body in bodies) == 10 * used
+    assert api.get(f"/api/users/{user_id}").json()["xp"] == 10 * used
+    assert stacks_by_name(api, user_id).get("Tome", {"quantity": 0})["quantity"] == 3 - used
+
+
+def test_batch_use_validates_counts(api):
+    user_id = create_user(api)
+
+    assert use_batch(api, user_id, {}).status_code == 400
+    assert use_batch(api, user_id, {"any": 0}).status_code == 400
+
+
+def test_deleting_takes_items_off_the_stack(api):
+    user_id = create_user(api)
+    stack_id = buy(api, user_id, create_item(api), 3)["Potion"]["id"]
+    version = api.get(f"/api/users/{user_id}/snapshot").json()["sync_version"]
+
+    assert api.delete(f"/api/inventory/{stack_id}").json()["remaining"] == 2
+    assert stacks_by_name(api, user_id)["Potion"]["quantity"] == 2
+    assert api.get(f"/api/users/{user_id}/changes", params={"since": version}).json()["upserts"]["inventory"][0]["quantity"] == 2
+
+    assert api.delete(f"/api/inventory/{stack_id}", params={"quantity": 3}).status_code == 400
+    assert api.delete(f"/api/inventory/{stack_id}", params={"quantity": 2}).json()["remaining"] == 0
+    assert stacks_by_name(api, user_id) == {}
+    changes = api.get(f"/api/users/{user_id}/changes", params={"since": version}).json()
+    assert (changes["upserts"], changes["tombstones"]) == ({}, {"inventory": [stack_id]})
+    assert api.delete(f"/api/inventory/{stack_id}").status_code == 404
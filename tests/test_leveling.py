@@ -0,0 +1,72 @@
+"""Property tests: the leveling solvers must match the original while-loops."""
+import random
+
+import pytest
+
+from leveling import custom_stat_level_up, level_up, total_xp_for_level, xp_for_level
+
+
+def loop_level_up(level, xp):
+    """The loop complete_quest and use_inventory_item used to run"""
+    levels_gained = 0
+    while xp >= xp_for_level(level):
+        xp -= xp_for_level(level)
+        level += 1
+        levels_gained += 1
+    return level, xp, levels_gained
+
+
+def loop_custom_stat_level_up(current, max_value, level):
+    """The custom-stat loop complete_quest used to run"""
+    while current >= max_value:
+        current -= max_value
+        level += 1
+        max_value = int(max_value * 1.1)
+    return current, max_value, level
+
+
+def test_total_xp_is_the_sum_of_level_costs():
+    for level in range(1, 200):
+        assert total_xp_for_level(level) == sum(xp_for_level(l) for l in range(1, level))
+
+
+@pytest.mark.parametrize("level,xp", [
+    (1, 0), (1, 99), (1, 100), (1, 299), (1, 300), (2, 199), (2, 200), (7, 10_000), (50, 0),
+])
+def test_level_up_boundaries(level, xp):
+    assert level_up(level, xp) == loop_level_up(level, xp)
+
+
+def test_level_up_matches_loop():
+    rng = random.Random(7)
+    for _ in range(20_000):
+        level = rng.randint(1, 500)
+        xp = rng.randint(0, 10 ** rng.randint(0, 7))
+        assert level_up(level, xp) == loop_level_up(level, xp)
+
+
+def test_level_up_with_huge_grant():
+    new_level, remaining, gained = level_up(1, 10_000_000)
+    assert total_xp_for_level(new_level) + remaining == 10_000_000
+    assert 0 <= remaining < xp_for_level(new_level)
+    assert gained == new_level - 1
+
+
+@pytest.mark.parametrize("current,max_value,level", [
+    (0, 100, 1), (99, 100, 1), (100, 100, 1), (210, 100, 1), (55, 10, 1), (1_000, 9, 3), (10_000, 1, 1),
+])
+def test_custom_stat_boundaries(current, max_value, level):
+    assert custom_stat_level_up(current, max_value, level) == loop_custom_stat_level_up(current, max_value, level)
+
+
+def test_custom_stat_matches_loop():
+    rng = random.Random(11)
+    for _ in range(5_000):
+        max_value = rng.randint(1, 2_000)
+        current = rng.randint(0, 10 ** rng.randint(0, 6))
+        level = rng.randint(1, 50)
+        assert custom_stat_level_up(current, max_value, level) == loop_custom_stat_level_up(current, max_value, level)
+
+
+def test_custom_stat_with_empty_bar_does_not_hang():
+    assert custom_stat_level_up(50, 0, 3) == (50, 0, 3)
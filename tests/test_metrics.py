@@ -0,0 +1,61 @@
+"""Request metrics: route attribution of MongoDB commands and the text format."""
+import asyncio
+from types import SimpleNamespace
+
+from metrics import Metrics, MetricsMiddleware, MongoCommandMetrics
+
+
+def run_request(middleware, path="/api/quests/u1", route_path="/api/quests/{user_id}"):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"{}", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "route_path": route_path}
+    asyncio.run(middleware(scope, receive, send))
+    return sent
+
+
+def find_event(documents):
+    return SimpleNamespace(command_name="find", duration_micros=2000, reply={"cursor": {"firstBatch": [{}] * documents}})
+
+
+def test_commands_are_attributed_to_the_route_that_sent_them():
+    metrics = Metrics(slow_request_ms=10_000)
+    listener = MongoCommandMetrics(metrics)
+
+    async def app(scope, receive, send):
+        await receive()
+        scope["route"] = SimpleNamespace(path=scope["route_path"])
+        listener.succeeded(find_event(3))
+        listener.succeeded(find_event(2))
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"[1,2,3]"})
+
+    run_request(MetricsMiddleware(app, metrics))
+    listener.succeeded(find_event(1))
+
+    text = metrics.render()
+    assert 'http_requests_total{method="GET",route="/api/quests/{user_id}",status="200"} 1' in text
+    assert 'http_response_size_bytes_sum{method="GET",route="/api/quests/{user_id}"} 7' in text
+    assert 'mongodb_commands_total{route="/api/quests/{user_id}",command="find"} 2' in text
+    assert 'mongodb_documents_returned_total{route="/api/quests/{user_id}",command="find"} 5' in text
+    assert 'mongodb_commands_total{route="background",command="find"} 1' in text
+    assert metrics.in_flight == 0
+
+
+def test_errors_are_counted_as_500_on_the_unmatched_route():
+    metrics = Metrics(slow_request_ms=10_000)
+
+    async def app(scope, receive, send):
+        raise RuntimeError("boom")
+
+    try:
+        run_request(MetricsMiddleware(app, metrics))
+    except RuntimeError:
+        pass
+
+    assert 'http_requests_total{method="GET",route="unmatched",status="500"} 1' in metrics.render()
@@ -0,0 +1,58 @@
+"""Evolution graph construction: id and name links, locking and cycle breaking."""
+from power_tree import PowerGraph
+
+
+def power(power_id, **fields):
+    return {"id": power_id, "name": power_id.upper(), "current_level": 1, "max_level": 5, **fields}
+
+
+def render(doc):
+    return {"id": doc["id"]}
+
+
+def shape(nodes):
+    return {node["id"]: shape(node["children"]) for node in nodes}
+
+
+def test_id_and_name_links_nest_evolutions():
+    graph = PowerGraph([
+        power("a", evolved_abilities=["b"]),
+        power("b", evolved_from="a", evolved_ability_names=[{"name": "C"}, {"name": "Unowned"}]),
+        power("c"),
+        power("d"),
+    ], render)
+
+    forest = graph.forest()
+    assert shape(forest) == {"a": {"b": {"c": {}}}, "d": {}}
+    assert forest[0]["children"][0]["pending_evolutions"] == [{"name": "Unowned"}]
+
+
+def test_evolutions_stay_locked_until_every_parent_is_maxed():
+    graph = PowerGraph([
+        power("a", evolved_abilities=["c"], current_level=5),
+        power("b", evolved_ability_names=[{"name": "C"}]),
+        power("c"),
+    ], render)
+
+    assert not graph.locked("a")
+    assert graph.locked("c")
+    graph.powers["b"]["current_level"] = 5
+    assert not graph.locked("c")
+
+
+def test_cycles_are_broken_and_reported():
+    graph = PowerGraph([
+        power("a", evolved_abilities=["b"]),
+        power("b", evolved_abilities=["c"]),
+        power("c", evolved_abilities=["a"]),
+    ], render)
+
+    assert shape(graph.forest()) == {"a": {"b": {"c": {}}}}
+    assert graph.cycles == [("c", "a")]
+
+
+def test_links_to_unknown_powers_are_ignored():
+    graph = PowerGraph([power("a", evolved_abilities=["gone"], evolved_from="also-gone")], render)
+
+    assert shape(graph.forest()) == {"a": {}}
+    assert not graph.locked("a")
@@ -0,0 +1,124 @@
+"""Completing quests, one at a time and in batches."""
+from leveling import custom_stat_level_up
+
+
+def create_user(api):
+    return api.post("/api/users", json={"username": "hero"}).json()["id"]
+
+
+def create_quest(api, user_id, title, xp=50, gold=10, **fields):
+    quest = {"user_id": user_id, "title": title, "description": title, "xp_reward": xp, "gold_reward": gold, **fields}
+    return api.post("/api/quests", json=quest).json()["id"]
+
+
+def complete(api, quest_id):
+    return api.post(f"/api/quests/{quest_id}/complete")
+
+
+def complete_batch(api, user_id, quest_ids):
+    return api.post("/api/quests/complete-batch", json={"user_id": user_id, "quest_ids": quest_ids})
+
+
+def statuses(body):
+    return [(result["quest_id"], result["status"]) for result in body["results"]]
+
+
+def test_completing_a_quest_rewards_it_once(api):
+    user_id = create_user(api)
+    quest_id = create_quest(api, user_id, "Run", xp=40, gold=10, ap_reward=1, item_reward="Medal")
+
+    body = complete(api, quest_id).json()
+    assert body["quest"]["completed"]
+    assert (body["user"]["xp"], body["user"]["gold"], body["user"]["ability_points"], body["item_reward"]) == (40, 110, 6, "Medal")
+
+    again = complete(api, quest_id)
+    assert (again.status_code, again.json()) == (400, {"detail": "Quest already completed"})
+    user = api.get(f"/api/users/{user_id}").json()
+    assert (user["xp"], user["gold"], user["ability_points"]) == (40, 110, 6)
+    assert [(row["item_name"], row["quantity"]) for row in api.get(f"/api/inventory/{user_id}").json()] == [("Medal", 1)]
+    assert complete(api, "missing").status_code == 404
+
+
+def test_completion_levels_up_custom_stats_and_the_user(api):
+    user_id = create_user(api)
+    stat = {"user_id": user_id, "name": "Focus", "color": "#fff", "current": 90, "max": 100}
+    assert api.post(f"/api/users/{user_id}/stats", json=stat).status_code == 200
+    quest_id = create_quest(api, user_id, "Study", xp=150, gold=0, attribute_rewards={"Focus": 130, "strength": 2})
+
+    body = complete(api, quest_id).json()
+
+    focus = api.get(f"/api/users/{user_id}/stats").json()[0]
+    assert (focus["current"], focus["max"], focus["level"]) == custom_stat_level_up(220, 100, 1)
+    assert focus["level"] > 1
+    # Level 2 takes 100 XP; 2 AP per level on top of the 5 a new user has
+    assert (body["old_level"], body["levels_gained"], body["user"]["level"]) == (1, 1, 2)
+    assert (body["user"]["strength"], body["user"]["ability_points"]) == (12, 7)
+
+
+def test_duplicate_ids_complete_and_reward_once(api):
+    user_id = create_user(api)
+    quest_id = create_quest(api, user_id, "Run", xp=40, gold=10)
+
+    body = complete_batch(api, user_id, [quest_id, quest_id, quest_id]).json()
+
+    assert statuses(body) == [(quest_id, "completed")]
+    assert (body["user"]["xp"], body["user"]["gold"]) == (40, 110)
+
+
+def test_already_completed_and_unknown_quests_earn_nothing(api):
+    user_id, other_user_id = create_user(api), api.post("/api/users", json={"username": "rival"}).json()["id"]
+    done = create_quest(api, user_id, "Done", xp=30, gold=5)
+    fresh = create_quest(api, user_id, "Fresh", xp=20, gold=5)
+    theirs = create_quest(api, other_user_id, "Theirs", xp=1000, gold=1000)
+    assert api.post(f"/api/quests/{done}/complete").status_code == 200
+
+    body = complete_batch(api, user_id, [done, fresh, theirs, "missing"]).json()
+
+    assert statuses(body) == [(done, "already_completed"), (fresh, "completed"), (theirs, "not_found"), ("missing", "not_found")]
+    assert (body["user"]["xp"], body["user"]["gold"]) == (50, 110)
+    assert api.get(f"/api/users/{other_user_id}").json()["xp"] == 0
+
+
+def test_limitless_quests_stay_open_and_can_be_completed_again(api):
+    user_id = create_user(api)
+    quest_id = create_quest(api, user_id, "Push-ups", xp=10, gold=1, repeat_frequency="limitless")
+
+    for _ in range(2):
+        assert statuses(complete_batch(api, user_id, [quest_id]).json()) == [(quest_id, "completed")]
+
+    user = api.get(f"/api/users/{user_id}").json()
+    assert (user["xp"], user["gold"]) == (20, 102)
+    quest = next(quest for quest in api.get(f"/api/quests/{user_id}").json() if quest["id"] == quest_id)
+    assert not quest["completed"]
+
+
+def test_levels_are_reported_in_request_order(api):
+    user_id = create_user(api)
+    quest_ids = [create_quest(api, user_id, f"Quest {i}", xp=60) for i in range(4)]
+
+    body = complete_batch(api, user_id, quest_ids).json()
+
+    # Level 2 takes 100 XP and level 3 another 200, so 240 XP ends at level 2
+    assert [result["level_after"] for result in body["results"]] == [1, 2, 2, 2]
+    assert (body["levels_gained"], body["user"]["level"], body["user"]["xp"]) == (1, 2, 140)
+
+
+def test_quests_deleted_before_the_claim_earn_nothing(api, server, monkeypatch):
+    user_id = create_user(api)
+    kept = create_quest(api, user_id, "Kept", xp=10, gold=1, repeat_frequency="limitless")
+    deleted = create_quest(api, user_id, "Deleted", xp=1000, gold=1000, repeat_frequency="limitless")
+
+    # Another device deletes a quest after the batch has read it
+    collection_type = type(server.db.quests)
+    update_many = collection_type.update_many
+
+    async def delete_first(self, *args, **kwargs):
+        await server.db.quests.delete_one({"id": deleted})
+        return await update_many(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection_type, "update_many", delete_first)
+    body = complete_batch(api, user_id, [kept, deleted]).json()
+    monkeypatch.undo()
+
+    assert statuses(body) == [(kept, "completed"), (deleted, "not_found")]
+    assert (body["user"]["xp"], body["user"]["gold"]) == (10, 101)
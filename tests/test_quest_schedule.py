@@ -0,0 +1,139 @@
+"""Quest scheduling rules, checked against the reset and failure rules they replaced.
+
+Before the scheduler, repeating quests were reset while listing a user's
+quests and deadlines were evaluated by check-failures; ``old_should_reset``
+and ``old_should_fail`` are those rules verbatim.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from change_log import current_version
+from quest_schedule import deadline_missed, fail_due_quests, next_deadline_check, reset_due_at
+
+
+def old_should_reset(frequency, last_completed, now):
+    if frequency == "daily":
+        return last_completed < now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if frequency == "weekly":
+        return (now - last_completed).days >= 7
+    if frequency == "monthly":
+        return last_completed.year != now.year or last_completed.month != now.month
+    return False
+
+
+def old_should_fail(quest, now):
+    if quest.get("completed") or quest.get("repeat_frequency") == "limitless" or not quest.get("has_deadline"):
+        return False
+    try:
+        deadline_hour, deadline_minute = map(int, quest.get("deadline_time", "00:00").split(":"))
+    except ValueError:
+        deadline_hour, deadline_minute = 0, 0
+    today_deadline = now.replace(hour=deadline_hour, minute=deadline_minute, second=0, microsecond=0)
+    last_failed = quest.get("last_failed")
+    if last_failed and last_failed >= now.replace(hour=0, minute=0, second=0, microsecond=0):
+        return False
+    if quest.get("repeat_frequency") in ["daily", "weekly", "monthly"]:
+        return now > today_deadline
+    return quest.get("created_at", now) < today_deadline and now > today_deadline
+
+
+@pytest.mark.parametrize("frequency, last_completed, now", [
+    ("daily", datetime(2024, 3, 10, 23, 59), datetime(2024, 3, 10, 23, 59, 59)),
+    ("daily", datetime(2024, 3, 10, 23, 59), datetime(2024, 3, 11, 0, 0)),
+    ("daily", datetime(2024, 3, 10, 0, 0), datetime(2024, 3, 12, 8, 0)),
+    ("weekly", datetime(2024, 3, 10, 9, 30), datetime(2024, 3, 17, 9, 29)),
+    ("weekly", datetime(2024, 3, 10, 9, 30), datetime(2024, 3, 17, 9, 30)),
+    ("monthly", datetime(2024, 1, 31, 23, 0), datetime(2024, 1, 31, 23, 59)),
+    ("monthly", datetime(2024, 1, 31, 23, 0), datetime(2024, 2, 1, 0, 0)),
+    ("monthly", datetime(2024, 2, 29, 12, 0), datetime(2024, 3, 1, 0, 0)),
+    ("monthly", datetime(2023, 12, 31, 12, 0), datetime(2024, 1, 1, 0, 0)),
+    ("monthly", datetime(2023, 12, 1, 0, 0), datetime(2023, 12, 31, 23, 59)),
+])
+def test_reset_instant_matches_the_old_reset_rule(frequency, last_completed, now):
+    assert (now >= reset_due_at(frequency, last_completed)) == old_should_reset(frequency, last_completed, now)
+
+
+@pytest.mark.parametrize("frequency", ["none", "limitless", None])
+def test_non_repeating_quests_never_reset(frequency):
+    assert reset_due_at(frequency, datetime(2024, 3, 10)) is None
+
+
+NOW = datetime(2024, 3, 10, 18, 0)
+TODAY = datetime(2024, 3, 10)
+
+
+@pytest.mark.parametrize("quest, now", [
+    ({"repeat_frequency": "daily", "deadline_time": "17:00"}, NOW),
+    ({"repeat_frequency": "daily", "deadline_time": "19:00"}, NOW),
+    ({"repeat_frequency": "daily", "deadline_time": "18:00"}, NOW),
+    ({"repeat_frequency": "daily", "deadline_time": "17:00", "last_failed": TODAY + timedelta(hours=17, minutes=1)}, NOW),
+    ({"repeat_frequency": "daily", "deadline_time": "17:00", "last_failed": TODAY - timedelta(hours=1)}, NOW),
+    ({"repeat_frequency": "daily", "deadline_time": "17:00", "completed": True}, NOW),
+    ({"repeat_frequency": "weekly", "deadline_time": "09:00"}, NOW),
+    ({"repeat_frequency": "monthly", "deadline_time": "23:59"}, datetime(2024, 1, 31, 23, 59, 30)),
+    ({"repeat_frequency": "limitless", "deadline_time": "09:00"}, NOW),
+    ({"repeat_frequency": "none", "deadline_time": "09:00", "created_at": TODAY + timedelta(hours=8)}, NOW),
+    ({"repeat_frequency": "none", "deadline_time": "09:00", "created_at": TODAY + timedelta(hours=10)}, NOW),
+    ({"repeat_frequency": "none", "deadline_time": "bad"}, NOW),
+    ({"repeat_frequency": "none", "deadline_time": "09:00", "has_deadline": False, "created_at": TODAY}, NOW),
+])
+def test_deadline_missed_matches_the_old_failure_rule(quest, now):
+    quest = {"has_deadline": True, "created_at": TODAY - timedelta(days=1), **quest}
+    assert deadline_missed(quest, now) == old_should_fail(quest, now)
+
+
+def test_failed_daily_quest_stays_open_and_is_checked_again_tomorrow():
+    quest = {"has_deadline": True, "repeat_frequency": "daily", "deadline_time": "17:00", "created_at": TODAY}
+    assert deadline_missed(quest, NOW)
+
+    # What the scheduler writes for a failed daily quest: failed, but not completed
+    quest.update(failed=True, last_failed=NOW)
+    assert not quest.get("completed")
+    assert next_deadline_check(quest, NOW) == TODAY + timedelta(days=1, hours=17)
+    assert not deadline_missed(quest, TODAY + timedelta(hours=23, minutes=59))
+    assert not deadline_missed(quest, TODAY + timedelta(days=1, hours=17))
+    assert deadline_missed(quest, TODAY + timedelta(days=1, hours=17, minutes=1))
+
+
+@pytest.mark.parametrize("quest", [
+    {"repeat_frequency": "daily", "deadline_time": "17:00"},
+    {"repeat_frequency": "daily", "deadline_time": "19:00"},
+    {"repeat_frequency": "weekly", "deadline_time": "23:00"},
+    {"repeat_frequency": "none", "deadline_time": "23:30"},
+])
+def test_no_failure_is_due_before_the_next_check(quest):
+    quest = {"has_deadline": True, "created_at": TODAY - timedelta(days=1), **quest}
+    if deadline_missed(quest, NOW):
+        quest["last_failed"] = NOW
+    check = next_deadline_check(quest, NOW)
+    moment = NOW
+    while moment < check:
+        assert not deadline_missed(quest, moment)
+        moment += timedelta(minutes=15)
+    assert deadline_missed(quest, check + timedelta(seconds=1)) == old_should_fail(quest, check + timedelta(seconds=1))
+
+
+def test_completed_and_limitless_quests_have_no_deadline_check():
+    assert next_deadline_check({"has_deadline": True, "completed": True}, NOW) is None
+    assert next_deadline_check({"has_deadline": True, "repeat_frequency": "limitless"}, NOW) is None
+    assert next_deadline_check({"has_deadline": False}, NOW) is None
+
+
+def test_completed_quests_are_not_claimed_again(api, server):
+    db = server.db
+    user_id = api.post("/api/users", json={"username": "hero"}).json()["id"]
+    quest = {"user_id": user_id, "title": "Run", "description": "Run", "has_deadline": True, "deadline_time": "23:59"}
+    quest_id = api.post("/api/quests", json=quest).json()["id"]
+    assert api.post(f"/api/quests/{quest_id}/complete").status_code == 200
+    assert api.portal.call(db.quests.find_one, {"id": quest_id})["next_deadline_at"] is None
+
+    # A check left behind by a completion from before completions cleared it
+    api.portal.call(db.quests.update_one, {"id": quest_id}, {"$set": {"next_deadline_at": datetime.utcnow() - timedelta(minutes=1)}})
+    version = api.portal.call(current_version, db, user_id)
+    for _ in range(2):
+        assert api.portal.call(fail_due_quests, db, datetime.utcnow()) == {}
+
+    stored = api.portal.call(db.quests.find_one, {"id": quest_id})
+    assert (stored["next_deadline_at"], stored.get("deadline_claim"), stored["failed"]) == (None, None, False)
+    assert api.portal.call(current_version, db, user_id) == version
@@ -0,0 +1,69 @@
+"""Inventory and power rows that reference their shop item instead of copying it."""
+from shop_refs import edited_collections, frozen_updates, hydrate, slim
+
+ITEM = {"id": "sword", "name": "Sword", "description": "Sharp", "item_type": "weapon", "category": "arms", "stat_boost": {"strength": 2}}
+
+
+def test_catalog_wins_on_inventory_rows_and_fills_gaps_on_powers():
+    inventory = hydrate("inventory", [{"id": "row", "item_id": "sword", "item_name": "Old", "quantity": 2}], {"sword": ITEM})
+    assert (inventory[0]["item_name"], inventory[0]["item_description"], inventory[0]["quantity"]) == ("Sword", "Sharp", 2)
+
+    powers = hydrate("powers", [
+        {"id": "own", "shop_item_id": "sword", "description": "My notes"},
+        {"id": "bare", "shop_item_id": "sword"},
+    ], {"sword": ITEM})
+    assert [power["description"] for power in powers] == ["My notes", "Sharp"]
+    assert powers[1]["stat_boost"] == {"strength": 2}
+
+
+def test_rows_without_a_catalog_item_keep_their_copy():
+    row = {"id": "row", "item_id": "gone", "item_name": "Trophy"}
+    assert hydrate("inventory", [row], {"gone": None}) == [row]
+
+
+def test_slim_drops_only_the_shared_fields():
+    row = {"id": "row", "user_id": "u", "item_id": "sword", "item_name": "Sword", "stat_boost": {}, "quantity": 1}
+    assert slim("inventory", row) == {"id": "row", "user_id": "u", "item_id": "sword", "quantity": 1}
+
+
+def test_freezing_copies_the_item_without_overriding_power_edits():
+    updates = frozen_updates(ITEM)
+    query, update = updates["inventory"]
+    assert query == {"item_id": "sword"}
+    assert update["$set"]["item_name"] == "Sword"
+    query, update = updates["powers"]
+    assert query == {"shop_item_id": "sword"}
+    assert update[0]["$set"]["description"] == {"$ifNull": ["$description", {"$literal": "Sharp"}]}
+
+
+def test_only_edits_to_shared_fields_touch_rows():
+    assert edited_collections(ITEM, {**ITEM, "price": 10}) == []
+    assert edited_collections(ITEM, {**ITEM, "name": "Blade"}) == ["inventory"]
+    assert edited_collections(ITEM, {**ITEM, "description": "Blunt"}) == ["inventory", "powers"]
+
+
+def create_user(api):
+    return api.post("/api/users", json={"username": "hero"}).json()["id"]
+
+
+def shop_item(**fields):
+    return {"name": "Sword", "description": "Sharp", "price": 10, "item_type": "weapon", **fields}
+
+
+def test_shop_edits_and_deletion_reach_synced_clients(api):
+    user_id = create_user(api)
+    item_id = api.post("/api/shop", json=shop_item()).json()["id"]
+    assert api.post("/api/shop/purchase", json={"user_id": user_id, "item_id": item_id}).status_code == 200
+    row_id = api.get(f"/api/inventory/{user_id}").json()[0]["id"]
+    version = api.get(f"/api/users/{user_id}/snapshot").json()["sync_version"]
+
+    assert api.put(f"/api/shop/{item_id}", json=shop_item(price=20)).status_code == 200
+    assert api.get(f"/api/users/{user_id}/changes", params={"since": version}).json()["version"] == version
+
+    assert api.put(f"/api/shop/{item_id}", json=shop_item(name="Blade")).status_code == 200
+    changes = api.get(f"/api/users/{user_id}/changes", params={"since": version}).json()
+    assert [(row["id"], row["item_name"]) for row in changes["upserts"]["inventory"]] == [(row_id, "Blade")]
+
+    # The row keeps the item as it last was
+    assert api.delete(f"/api/shop/{item_id}").status_code == 200
+    assert api.get(f"/api/inventory/{user_id}").json()[0]["item_name"] == "Blade"
@@ -0,0 +1,34 @@
+"""Shop search filters and keyset cursors."""
+import pytest
+from bson import ObjectId
+
+from shop_search import decode_cursor, encode_cursor, search_filter
+
+
+def test_filter_only_includes_given_parameters():
+    assert search_filter() == {}
+    assert search_filter(is_power=False, min_price=10, text="fire") == {
+        "is_power": False,
+        "price": {"$gte": 10},
+        "$text": {"$search": "fire"},
+    }
+
+
+def test_cursor_resumes_after_the_last_row_in_sort_order():
+    last = {"_id": ObjectId(), "name": "Sword", "price": 40}
+    after, skip = decode_cursor("-price", encode_cursor("-price", last, 50))
+    assert skip == 0
+    assert after == {"$or": [
+        {"price": {"$lt": 40}},
+        {"price": 40, "_id": {"$lt": last["_id"]}},
+    ]}
+    assert decode_cursor("newest", encode_cursor("newest", last, 50)) == ({"_id": {"$lt": last["_id"]}}, 0)
+    assert decode_cursor("relevance", encode_cursor("relevance", last, 50)) == ({}, 50)
+
+
+def test_cursor_from_another_sort_is_rejected():
+    cursor = encode_cursor("newest", {"_id": ObjectId()}, 50)
+    with pytest.raises(ValueError):
+        decode_cursor("price", cursor)
+    with pytest.raises(ValueError):
+        decode_cursor("name", "not a cursor")
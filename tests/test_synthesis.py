@@ -0,0 +1,95 @@
+"""Recipe index: craftable recipes from inventory counts, and crafting them."""
+from concurrent.futures import ThreadPoolExecutor
+
+from synthesis import RecipeIndex
+
+
+def recipe(recipe_id, **ingredients):
+    return {
+        "id": recipe_id,
+        "name": recipe_id,
+        "ingredients": [{"item_id": item_id, "quantity": quantity} for item_id, quantity in ingredients.items()],
+        "result_item_id": f"{recipe_id}-result",
+    }
+
+
+def test_recipe_is_craftable_only_when_every_ingredient_is_held():
+    index = RecipeIndex([recipe("sword", ore=2, wood=1), recipe("tea", herb=3), recipe("staff", wood=2)])
+
+    assert index.craftable({"ore": 5, "wood": 1, "herb": 2}) == {"sword": 1}
+    assert index.craftable({"ore": 4, "wood": 4, "herb": 9}) == {"sword": 2, "tea": 3, "staff": 2}
+    assert index.craftable({"ore": 1, "wood": 1}) == {}
+    assert index.craftable({}) == {}
+
+
+def test_repeated_ingredient_entries_are_merged():
+    index = RecipeIndex([{
+        "id": "potion",
+        "name": "potion",
+        "ingredients": [{"item_id": "herb", "quantity": 1}, {"item_id": "herb", "quantity": 2}],
+        "result_item_id": "potion-result",
+    }])
+
+    assert index.craftable({"herb": 2}) == {}
+    assert index.craftable({"herb": 6}) == {"potion": 2}
+
+
+def create_item(api, name, **fields):
+    item = {"name": name, "description": name, "price": 1, "item_type": "material", **fields}
+    return api.post("/api/shop", json=item).json()["id"]
+
+
+def setup_sword_recipe(api, ore, wood):
+    """A user holding `ore` and `wood`, and a recipe turning 2 ore and 1 wood into a sword"""
+    user_id = api.post("/api/users", json={"username": "smith"}).json()["id"]
+    materials = {name: create_item(api, name, is_synthesis_material=True) for name in ("Ore", "Wood")}
+    sword_id = create_item(api, "Sword", item_type="weapon")
+    for name, count in (("Ore", ore), ("Wood", wood)):
+        for _ in range(count):
+            assert api.post("/api/shop/purchase", json={"user_id": user_id, "item_id": materials[name]}).status_code == 200
+    recipe = {
+        "ingredients": [{"item_id": materials["Ore"], "quantity": 2}, {"item_id": materials["Wood"], "quantity": 1}],
+        "result_item_id": sword_id,
+    }
+    return user_id, api.post("/api/synthesis/recipes", json=recipe).json()["id"]
+
+
+def craft(api, user_id, recipe_id, times=1):
+    return api.post("/api/synthesis/craft", json={"user_id": user_id, "recipe_id": recipe_id, "times": times})
+
+
+def holdings(api, user_id):
+    return {row["item_name"]: row["quantity"] for row in api.get(f"/api/inventory/{user_id}").json()}
+
+
+def test_crafting_consumes_ingredients_and_adds_the_result(api):
+    user_id, recipe_id = setup_sword_recipe(api, ore=5, wood=2)
+
+    response = craft(api, user_id, recipe_id, times=2)
+
+    assert response.status_code == 200
+    assert [(item["item_name"], item["quantity"]) for item in response.json()["items"]] == [("Sword", 2)]
+    assert holdings(api, user_id) == {"Ore": 1, "Sword": 2}
+    assert api.get(f"/api/synthesis/craftable/{user_id}").json() == []
+
+
+def test_short_ingredients_give_back_what_was_taken(api):
+    user_id, recipe_id = setup_sword_recipe(api, ore=4, wood=1)
+
+    response = craft(api, user_id, recipe_id, times=2)
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Not enough ingredients: Wood"}
+    assert holdings(api, user_id) == {"Ore": 4, "Wood": 1}
+
+
+def test_concurrent_crafts_cannot_overdraw(api):
+    user_id, recipe_id = setup_sword_recipe(api, ore=3, wood=1)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        responses = list(pool.map(lambda _: craft(api, user_id, recipe_id), range(2)))
+
+    # Each may take one ingredient before the other, then both give theirs back
+    crafted = [response.status_code for response in responses].count(200)
+    assert sorted(response.status_code for response in responses) in ([200, 400], [400, 400])
+    assert holdings(api, user_id) == ({"Ore": 1, "Sword": 1} if crafted else {"Ore": 3, "Wood": 1})